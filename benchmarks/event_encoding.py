@@ -0,0 +1,100 @@
+"""
+Кодирование событий платежа (app.payment_events): прежний JSON с текстом в message,
+версионированный JSON и 18-байтовый бинарный формат, при установленном msgpack — он же
+для сравнения. Для каждого формата — байт на событие и время кодирования у публикатора
+и разбора у consumer (NotificationConsumer.parse_message: тип и текст уведомления).
+
+Время меряется пачкой из --events событий, --repeat раз; в таблице — время на одно событие:
+
+    python benchmarks/event_encoding.py --events 10000 --repeat 20 --output events.json
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from uuid import uuid4
+
+from harness import load_service, write_results
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def formats(events_module, publisher_module) -> dict:
+    """Формат -> (кодирование (event) -> (content_type, body), разбор (body, content_type))"""
+    PaymentEvent, encode_event = events_module.PaymentEvent, events_module.encode_event
+
+    def legacy_encode(event):
+        return None, json.dumps({
+            "type": event.type, "payment_id": str(event.payment_id),
+            "message": f"Payment {event.payment_id} completed successfully",
+        }).encode()
+
+    result = {
+        "legacy json": legacy_encode,
+        "json v1": lambda event: encode_event(event, "json"),
+        "binary v1": lambda event: encode_event(event, "binary"),
+        "aio_pika.Message (binary v1)": lambda event: publisher_module.build_event_message(event, "binary"),
+    }
+    if msgpack is not None:
+        result["msgpack v1"] = lambda event: ("application/msgpack", msgpack.packb(
+            [event.version, events_module.EVENT_TYPES[event.type], event.payment_id.bytes]
+        ))
+    return result
+
+
+def measure(operation, items: list, repeat: int) -> tuple[float, float]:
+    """Медиана и минимум времени на один элемент, мкс"""
+    per_item = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            operation(item)
+        per_item.append((time.perf_counter() - started) / len(items) * 1e6)
+    per_item.sort()
+    return per_item[len(per_item) // 2], per_item[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10000, help="events per measured batch")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    logging.disable(logging.INFO)
+    payment = load_service("payment", ["app.payment_events", "app.clients.publisher"])
+    notification = load_service("notification", ["app.consumers.notification_consumer"])
+    events_module = payment["app.payment_events"]
+    parse_message = notification["app.consumers.notification_consumer"].NotificationConsumer.parse_message
+
+    events = [events_module.PaymentEvent("payment_complete", uuid4()) for _ in range(args.events)]
+    results = {}
+    for name, encode in formats(events_module, payment["app.clients.publisher"]).items():
+        encoded = [encode(event) for event in events]
+        encode_p50, encode_min = measure(encode, events, args.repeat)
+        row = {"encode_us_p50": encode_p50, "encode_us_min": encode_min}
+        if name.startswith("aio_pika"):
+            row["bytes_per_event"] = len(encoded[0].body)
+        else:
+            row["bytes_per_event"] = sum(len(body) for _, body in encoded) / len(encoded)
+            if not name.startswith("msgpack"):
+                decode_p50, decode_min = measure(lambda item: parse_message(item[1], item[0]), encoded, args.repeat)
+                row.update({"decode_us_p50": decode_p50, "decode_us_min": decode_min})
+        results[name] = row
+
+    print(f"{'format':<30} {'bytes':>7} {'encode us':>10} {'decode us':>10}")
+    for name, row in results.items():
+        decode = f"{row['decode_us_p50']:>10.2f}" if "decode_us_p50" in row else f"{'-':>10}"
+        print(f"{name:<30} {row['bytes_per_event']:>7.0f} {row['encode_us_p50']:>10.2f} {decode}")
+    if msgpack is None:
+        print("msgpack is not installed: skipped")
+    write_results(args.output, "event_encoding", {k: v for k, v in vars(args).items() if k != "output"}, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Общие части бенчмарков: загрузка кода сервисов, вызов ASGI-приложения без сети,
+перцентили задержек и запись результатов в JSON для сравнения между прогонами.
+"""
+import contextlib
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_service(service: str, modules: list[str], env: dict[str, str] | None = None,
+                 shared: dict | None = None) -> dict:
+    """Импорт модулей сервиса ({service}_service/app) с переменными окружения env.
+
+    Оба сервиса называют свой пакет app, поэтому после импорта модули сервиса убираются
+    из sys.modules под своими именами: так в одном процессе можно загрузить оба.
+    Уже загруженные модули держат ссылки друг на друга и продолжают работать.
+    shared — уже загруженные модули другого сервиса, которые этот сервис использует
+    вместо своих копий (например, app.inprocess_bus для общего брокера).
+    """
+    os.environ.update(env or {})
+    root = str(ROOT / f"{service}_service")
+    sys.path.insert(0, root)
+    sys.modules.update(shared or {})
+    try:
+        return {name: importlib.import_module(name) for name in modules}
+    finally:
+        sys.path.remove(root)
+        for name in [m for m in sys.modules if m == "app" or m.startswith("app.")]:
+            sys.modules[f"{service}_service.{name}"] = sys.modules.pop(name)
+
+
+@contextlib.contextmanager
+def service_modules(service: str):
+    """Модули сервиса, загруженные load_service, снова доступны как app.* — для кода,
+    который импортирует модули лениво (например, выбор транспорта при startup)"""
+    prefix = f"{service}_service."
+    names = [m[len(prefix):] for m in sys.modules if m.startswith(prefix)]
+    sys.modules.update({name: sys.modules[prefix + name] for name in names})
+    try:
+        yield
+    finally:
+        for name in [m for m in sys.modules if m == "app" or m.startswith("app.")]:
+            sys.modules[prefix + name] = sys.modules.pop(name)
+
+
+async def asgi_call(app, method: str, path: str, body: dict | None = None,
+                    headers: dict[str, str] | None = None) -> tuple[int, bytes]:
+    """Запрос прямо в ASGI-приложение; возвращает статус и тело ответа"""
+    payload = json.dumps(body).encode() if body is not None else b""
+    raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+    raw_headers += [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query.encode(),
+        "headers": raw_headers, "client": ("bench", 1), "server": ("bench", 80),
+    }
+    messages = [{"type": "http.request", "body": payload, "more_body": False}]
+    status = 0
+    chunks = []
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+def latency_stats(seconds: list[float]) -> dict:
+    """Число замеров, среднее и перцентили (nearest-rank) в миллисекундах"""
+    if not seconds:
+        return {"count": 0}
+    ordered = sorted(seconds)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "git_commit": commit or None,
+    }
+
+
+def write_results(path: str | None, benchmark: str, config: dict, results: dict):
+    """Результаты с параметрами запуска и окружением; path=None — только вывод на экран"""
+    if not path:
+        return
+    document = {
+        "benchmark": benchmark,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": environment(),
+        "config": config,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+    print(f"Results written to {path}")
+
+
+def print_latency_table(rows: dict[str, dict]):
+    print(f"{'operation':<40} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, stats in rows.items():
+        if not stats.get("count"):
+            print(f"{name:<40} {0:>7}")
+            continue
+        print(f"{name:<40} {stats['count']:>7} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+              f"{stats['p99_ms']:>8.2f} {stats['max_ms']:>8.2f}")
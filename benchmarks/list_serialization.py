@@ -0,0 +1,144 @@
+"""
+Сериализация больших списков: прежний путь (объекты pydantic из строк БД + повторная
+валидация по response_model и стандартный JSON-энкодер FastAPI) против быстрого:
+dict из строк БД + orjson для платежей и уведомлений в SQLite, сериализация готовых
+моделей одним вызовом pydantic-core для уведомлений в памяти.
+
+Списки отдаются целиком, через ASGI-приложение без сети; сравнивается время ответа
+и проверяется, что оба пути дают одинаковый JSON:
+
+    python benchmarks/list_serialization.py --rows 10000 100000 --repeat 5 --output lists.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, Response
+
+from harness import load_service, asgi_call, latency_stats, print_latency_table, write_results
+
+
+def list_app(model, validated, fast) -> FastAPI:
+    """Приложение с двумя путями отдачи одного и того же списка; fast возвращает готовый Response"""
+    app = FastAPI()
+
+    @app.get("/validated", response_model=list[model])
+    async def validated_list():
+        return validated()
+
+    @app.get("/fast", response_model=list[model])
+    async def fast_list():
+        return fast()
+
+    return app
+
+
+def seed_payments(workdir: str, rows: int, rnd: random.Random):
+    modules = load_service("payment", ["app.database", "app.models.payment", "app.repositories.db_payment_repo"], {
+        "DATABASE_URL": f"sqlite:///{workdir}/payments.db",
+    })
+    database, models, repo_module = modules.values()
+    engine = database.create_db_engine(f"sqlite:///{workdir}/payments-{rows}.db")
+    database.Base.metadata.create_all(bind=engine)
+    session = database.sessionmaker(bind=engine, autoflush=False)()
+    repo = repo_module.PaymentRepo(session)
+
+    start = datetime(2024, 1, 1)
+    statuses = list(models.PaymentStatus)
+    for offset in range(0, rows, 5000):
+        repo.create_payments([
+            models.Payment(id=uuid4(), amount=round(rnd.uniform(1, 500), 2), currency=rnd.choice(["USD", "EUR", "JPY"]),
+                           status=rnd.choice(statuses), created_at=start + timedelta(seconds=rnd.randrange(365 * 24 * 3600)))
+            for _ in range(min(5000, rows - offset))
+        ])
+    app = list_app(models.Payment, repo.get_payments, lambda: ORJSONResponse(repo.get_payment_dicts()))
+    return app, lambda: (session.close(), engine.dispose())
+
+
+def seed_notifications(workdir: str, rows: int, rnd: random.Random, storage: str):
+    modules = load_service("notification", [
+        "app.models.notification", "app.repositories.local_notification_repo", "app.repositories.sqlite_notification_repo",
+    ])
+    models, local_repo, sqlite_repo = modules.values()
+    if storage == "memory":
+        repo = local_repo.NotificationRepo(max_items=rows)
+    else:
+        repo = sqlite_repo.SQLiteNotificationRepo(os.path.join(workdir, f"notifications-{rows}.db"))
+
+    types = list(models.NotificationType)
+    for i in range(rows):
+        repo.create_notification(models.Notification(
+            id=uuid4(), type=rnd.choice(types), message=f"Notification {i}", recipient=rnd.choice([None, "user@example.com"]),
+        ), buffered=True)
+    repo.flush()
+    app = list_app(
+        models.Notification, repo.list_notifications,
+        lambda: Response(repo.list_notifications_json(), media_type="application/json"),
+    )
+    return app, repo.close
+
+
+async def measure(app, repeat: int) -> dict:
+    samples = {"validated": [], "fast": []}
+    bodies = {}
+    for _ in range(repeat):
+        for path in samples:
+            started = time.perf_counter()
+            status, body = await asgi_call(app, "GET", f"/{path}")
+            samples[path].append(time.perf_counter() - started)
+            assert status == 200, f"/{path} returned {status}"
+            bodies[path] = body
+    if json.loads(bodies["validated"]) != json.loads(bodies["fast"]):
+        raise AssertionError("validated and fast paths returned different JSON")
+    return {
+        path: {**latency_stats(values), "response_bytes": len(bodies[path])} for path, values in samples.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="list sizes")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    logging.disable(logging.INFO)
+    rnd = random.Random(args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="list-bench-") as workdir:
+        for rows in args.rows:
+            datasets = {
+                "payments": lambda: seed_payments(workdir, rows, rnd),
+                "notifications[memory]": lambda: seed_notifications(workdir, rows, rnd, "memory"),
+                "notifications[sqlite]": lambda: seed_notifications(workdir, rows, rnd, "sqlite"),
+            }
+            for name, seed in datasets.items():
+                app, close = seed()
+                try:
+                    result = asyncio.run(measure(app, args.repeat))
+                finally:
+                    close()
+                result["speedup_p50"] = result["validated"]["p50_ms"] / result["fast"]["p50_ms"]
+                results[f"{name}[{rows}]"] = result
+
+    print_latency_table({
+        f"{name} {path}": result[path] for name, result in results.items() for path in ("validated", "fast")
+    })
+    print()
+    for name, result in results.items():
+        print(f"{name:<40} fast path {result['speedup_p50']:.1f}x faster (p50)")
+    write_results(args.output, "list_serialization", {k: v for k, v in vars(args).items() if k != "output"}, results)
+
+
+if __name__ == "__main__":
+    main()
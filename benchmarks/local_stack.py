@@ -0,0 +1,93 @@
+"""
+Оба сервиса в одном процессе без RabbitMQ и docker-compose: payment_service и
+notification_service (с consumer) на общем брокере процесса (MESSAGE_TRANSPORT=inprocess).
+Сервисы слушают обычные порты, поэтому e2e-тесты сервисов можно гонять против них:
+
+    python benchmarks/local_stack.py --payment-port 8001 --notification-port 8002 --workdir /tmp/stack
+
+С --workdir базы и журнал брокера сохраняются между запусками, иначе живут во временном каталоге.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import tempfile
+
+import uvicorn
+
+from harness import load_service, service_modules
+
+
+class ServiceServer(uvicorn.Server):
+    """uvicorn.Server, startup/shutdown которого видят модули своего сервиса как app.*.
+
+    Подмена app.* общая для процесса, поэтому startup и shutdown серверов идут по очереди.
+    Сигналы обрабатывает serve для всех серверов сразу.
+    """
+
+    _lifespan_lock = asyncio.Lock()
+
+    def __init__(self, service: str, config: uvicorn.Config):
+        super().__init__(config)
+        self.service = service
+
+    def install_signal_handlers(self):
+        pass
+
+    async def startup(self, sockets=None):
+        async with self._lifespan_lock:
+            with service_modules(self.service):
+                await super().startup(sockets)
+
+    async def shutdown(self, sockets=None):
+        async with self._lifespan_lock:
+            with service_modules(self.service):
+                await super().shutdown(sockets)
+
+
+async def serve(args, workdir: str):
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    payment = load_service("payment", ["app.main", "app.inprocess_bus"], {
+        "MESSAGE_TRANSPORT": "inprocess",
+        "INPROCESS_BUS_PATH": os.path.join(workdir, "bus.log"),
+        "DATABASE_URL": f"sqlite:///{workdir}/payments.db",
+    })
+    notification = load_service("notification", ["app.main"], {
+        "RUN_CONSUMER": "true",
+        "NOTIFICATION_STORAGE": args.storage,
+        "NOTIFICATIONS_DB_PATH": os.path.join(workdir, "notifications.db"),
+    }, shared={"app.inprocess_bus": payment["app.inprocess_bus"]})
+
+    servers = [
+        ServiceServer("payment", uvicorn.Config(payment["app.main"].app, host=args.host, port=args.payment_port)),
+        ServiceServer("notification", uvicorn.Config(notification["app.main"].app, host=args.host,
+                                                     port=args.notification_port)),
+    ]
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: [setattr(server, "should_exit", True) for server in servers])
+    try:
+        await asyncio.gather(*(server.serve() for server in servers))
+    finally:
+        payment["app.inprocess_bus"].get_bus().close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--payment-port", type=int, default=8001)
+    parser.add_argument("--notification-port", type=int, default=8002)
+    parser.add_argument("--storage", choices=["memory", "sqlite"], default="sqlite", help="notification storage")
+    parser.add_argument("--workdir", help="directory for databases and the bus journal")
+    args = parser.parse_args()
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        asyncio.run(serve(args, args.workdir))
+    else:
+        with tempfile.TemporaryDirectory(prefix="local-stack-") as workdir:
+            asyncio.run(serve(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Микробенчмарки горячих мест: методы PaymentRepo на временной SQLite и
+NotificationConsumer.process_message с хранилищем в памяти и в SQLite.
+
+Каждая операция выполняется --repeat раз, для нее печатаются перцентили времени
+одного вызова:
+
+    python benchmarks/microbenchmarks.py --rows 20000 --repeat 2000 --output micro.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from harness import load_service, latency_stats, print_latency_table, write_results
+
+BATCH_SIZE = 100
+
+
+def measure(operation, repeat: int) -> list[float]:
+    samples = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        operation(i)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_payment_repo(workdir: str, rows: int, repeat: int, seed: int) -> dict:
+    modules = load_service("payment", ["app.database", "app.models.payment", "app.repositories.db_payment_repo"], {
+        "DATABASE_URL": f"sqlite:///{workdir}/payments.db",
+    })
+    database, models, repo_module = modules.values()
+    Payment, PaymentStatus = models.Payment, models.PaymentStatus
+
+    engine = database.create_db_engine(f"sqlite:///{workdir}/payments.db")
+    database.Base.metadata.create_all(bind=engine)
+    session = database.sessionmaker(bind=engine, autoflush=False)()
+    repo = repo_module.PaymentRepo(session)
+    rnd = random.Random(seed)
+    start = datetime(2024, 1, 1)
+
+    def new_payments(count: int) -> list:
+        return [
+            Payment(id=uuid4(), amount=round(rnd.uniform(1, 500), 2), currency=rnd.choice(["USD", "EUR"]),
+                    created_at=start + timedelta(seconds=rnd.randrange(365 * 24 * 3600)))
+            for _ in range(count)
+        ]
+
+    seeded = []
+    for offset in range(0, rows, 1000):
+        seeded += repo.create_payments(new_payments(min(1000, rows - offset)))
+    ids = [p.id for p in seeded]
+    singles = new_payments(repeat)
+    batches = [new_payments(BATCH_SIZE) for _ in range(max(10, repeat // 20))]
+    pages = [repo_module.encode_cursor(p) for p in rnd.sample(seeded, min(repeat, len(seeded)))]
+
+    results = {
+        "PaymentRepo.create_payment": measure(lambda i: repo.create_payment(singles[i]), repeat),
+        f"PaymentRepo.create_payments[{BATCH_SIZE}]": measure(lambda i: repo.create_payments(batches[i]), len(batches)),
+        "PaymentRepo.get_payment_by_id": measure(lambda i: repo.get_payment_by_id(rnd.choice(ids)), repeat),
+        "PaymentRepo.get_payments[100]": measure(lambda i: repo.get_payments(limit=100, cursor=pages[i % len(pages)]), repeat),
+        "PaymentRepo.transition": measure(
+            lambda i: repo.transition(singles[i].id, PaymentStatus.CREATED, PaymentStatus.SUCCESS), repeat
+        ),
+        f"PaymentRepo.transition_many[{BATCH_SIZE}]": measure(
+            lambda i: repo.transition_many({p.id: PaymentStatus.FAILED for p in batches[i]}, PaymentStatus.CREATED),
+            len(batches),
+        ),
+    }
+    session.close()
+    engine.dispose()
+    return results
+
+
+def bench_process_message(workdir: str, repeat: int) -> dict:
+    modules = load_service("notification", [
+        "app.consumers.notification_consumer", "app.repositories.local_notification_repo",
+        "app.repositories.sqlite_notification_repo",
+    ])
+    consumer_module, local_repo, sqlite_repo = modules.values()
+    consumer = consumer_module.NotificationConsumer()
+    bodies = [
+        json.dumps({"type": "payment_complete", "payment_id": str(id), "message": f"Payment {id} completed successfully"})
+        .encode() for id in (uuid4() for _ in range(repeat))
+    ]
+
+    async def run() -> list[float]:
+        samples = []
+        for body in bodies:
+            started = time.perf_counter()
+            await consumer.process_message(body)
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    results = {}
+    for name, repo in (
+        ("memory", local_repo.NotificationRepo()),
+        ("sqlite", sqlite_repo.SQLiteNotificationRepo(os.path.join(workdir, "notifications.db"))),
+    ):
+        consumer.notification_service.repo = repo
+        results[f"process_message[{name}]"] = asyncio.run(run())
+        repo.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000, help="payments in the database before measuring")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory(prefix="micro-bench-") as workdir:
+        samples = bench_payment_repo(workdir, args.rows, args.repeat, args.seed)
+        samples.update(bench_process_message(workdir, args.repeat))
+
+    results = {name: latency_stats(values) for name, values in samples.items()}
+    print_latency_table(results)
+    write_results(args.output, "microbenchmarks", {k: v for k, v in vars(args).items() if k != "output"}, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Накладные расходы middleware метрик HTTP на один запрос.
+
+Запросы подаются прямо в ASGI-приложение (без сети и сервера), поэтому разница
+между вариантами — это стоимость самой инструментации:
+
+    python benchmarks/middleware_overhead.py --requests 20000
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+from uuid import uuid4
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "payment_service"))
+
+from fastapi import FastAPI, Request  # noqa: E402
+
+from app.instrumentation import PrometheusMiddleware  # noqa: E402
+from app.metrics import REQUEST_COUNT, REQUEST_LATENCY  # noqa: E402
+
+
+def build_app(variant: str) -> FastAPI:
+    app = FastAPI()
+
+    if variant == "legacy":
+        # Прежний monitor_requests: BaseHTTPMiddleware, метки по фактическому пути, time.time
+        @app.middleware("http")
+        async def monitor_requests(request: Request, call_next):
+            start_time = time.time()
+            response = await call_next(request)
+            REQUEST_COUNT.labels(method=request.method, endpoint=request.url.path, status=response.status_code).inc()
+            REQUEST_LATENCY.labels(method=request.method, endpoint=request.url.path).observe(time.time() - start_time)
+            return response
+    elif variant == "asgi":
+        app.add_middleware(PrometheusMiddleware)
+
+    @app.post("/bench/{item_id}/process")
+    async def process(item_id: str):
+        return {"id": item_id}
+
+    return app
+
+
+async def run(app: FastAPI, requests: int) -> float:
+    """Среднее время запроса в микросекундах"""
+    body = b'{"success": true}'
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        path = f"/bench/{uuid4()}/process"
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+            "headers": headers, "client": ("bench", 1), "server": ("bench", 80),
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            return messages.pop() if messages else {"type": "http.disconnect"}
+
+        await app(scope, receive, send)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = {}
+    for variant in ("none", "legacy", "asgi"):
+        app = build_app(variant)
+        asyncio.run(run(app, min(1000, args.requests)))  # прогрев
+        results[variant] = asyncio.run(run(app, args.requests))
+
+    baseline = results["none"]
+    print(f"{'variant':<8} {'us/request':>11} {'overhead us':>12}")
+    for variant, us in results.items():
+        print(f"{variant:<8} {us:>11.1f} {us - baseline:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
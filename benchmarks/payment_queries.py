@@ -0,0 +1,142 @@
+"""
+Запросы к payments до и после миграций схемы (app/migrations.py).
+
+Заполняет БД в исходной схеме (строковые id, суммы Float, только индекс под пагинацию),
+копирует ее и прогоняет на копии миграции, затем замеряет одни и те же запросы
+на обеих БД и сравнивает размеры файлов:
+
+    python benchmarks/payment_queries.py --rows 200000
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "payment_service"))
+
+from app.database import create_db_engine  # noqa: E402
+from app.migrations import migrate  # noqa: E402
+
+LEGACY_SCHEMA = """
+CREATE TABLE payments (
+    id VARCHAR NOT NULL, amount FLOAT NOT NULL, currency VARCHAR NOT NULL,
+    status VARCHAR(16) NOT NULL, created_at DATETIME, PRIMARY KEY (id)
+);
+CREATE INDEX ix_payments_id ON payments (id);
+CREATE INDEX ix_payments_created_at_id ON payments (created_at, id);
+"""
+
+STATUSES = ["CREATED"] * 2 + ["SUCCESS"] * 14 + ["FAILED"] * 3 + ["REFUND_REQUESTED", "REFUND_DONE"]
+CURRENCIES = ["USD"] * 6 + ["EUR"] * 3 + ["GBP", "JPY"]
+START = datetime(2024, 1, 1)
+
+
+def fill_legacy(path: str, rows: int, seed: int) -> list[str]:
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    ids = []
+    step = 365 * 24 * 3600 / rows
+    batch = []
+    for i in range(rows):
+        id = str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+        ids.append(id)
+        created_at = (START + timedelta(seconds=i * step)).isoformat(" ")
+        batch.append((id, round(rnd.uniform(1, 5000), 2), rnd.choice(CURRENCIES), rnd.choice(STATUSES), created_at))
+        if len(batch) == 10000:
+            conn.executemany("INSERT INTO payments VALUES (?, ?, ?, ?, ?)", batch)
+            batch = []
+    conn.executemany("INSERT INTO payments VALUES (?, ?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    return ids
+
+
+def queries(amount_column: str):
+    """Название → (SQL, параметры); параметры id подставляются отдельно"""
+    month_from, month_to = (START + timedelta(days=150)).isoformat(" "), (START + timedelta(days=180)).isoformat(" ")
+    return {
+        "page by status": (
+            "SELECT * FROM payments WHERE status = 'FAILED' ORDER BY created_at LIMIT 100", ()),
+        "oldest CREATED": (
+            "SELECT min(created_at) FROM payments WHERE status = 'CREATED'", ()),
+        "status in period": (
+            "SELECT count(*) FROM payments WHERE status = 'SUCCESS' AND created_at >= ? AND created_at < ?",
+            (month_from, month_to)),
+        "currency in period": (
+            "SELECT * FROM payments WHERE currency = 'GBP' AND created_at >= ? AND created_at < ? "
+            "ORDER BY created_at LIMIT 100", (month_from, month_to)),
+        "sum by currency": (
+            f"SELECT currency, sum({amount_column}) FROM payments GROUP BY currency", ()),
+        "lookup by id": ("SELECT * FROM payments WHERE id = ?", None),
+    }
+
+
+def time_query(conn: sqlite3.Connection, sql: str, params, repeat: int) -> float:
+    """Среднее время запроса в микросекундах (params — кортеж или список кортежей по кругу)"""
+    params_list = params if isinstance(params, list) else [params]
+    conn.execute(sql, params_list[0]).fetchall()  # прогрев кеша страниц
+    start = time.perf_counter()
+    for i in range(repeat):
+        conn.execute(sql, params_list[i % len(params_list)]).fetchall()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def measure(path: str, amount_column: str, lookup_ids: list, repeat: int) -> dict[str, float]:
+    conn = sqlite3.connect(path)
+    try:
+        results = {}
+        for name, (sql, params) in queries(amount_column).items():
+            if params is None:
+                params = [(id,) for id in lookup_ids]
+            results[name] = time_query(conn, sql, params, repeat)
+        return results
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        before = os.path.join(workdir, "before.db")
+        after = os.path.join(workdir, "after.db")
+        ids = fill_legacy(before, args.rows, args.seed)
+        shutil.copy(before, after)
+
+        engine = create_db_engine(f"sqlite:///{after}")
+        started = time.perf_counter()
+        migrate(engine, batch_size=20000)
+        migration_seconds = time.perf_counter() - started
+        engine.dispose()
+        conn = sqlite3.connect(after)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+        conn.close()
+
+        sample = random.Random(args.seed).sample(ids, min(1000, len(ids)))
+        old = measure(before, "amount", sample, args.repeat)
+        new = measure(after, "amount_minor", [uuid.UUID(id).bytes for id in sample], args.repeat)
+        sizes = (os.path.getsize(before), os.path.getsize(after))
+
+    print(f"{args.rows} rows, migration took {migration_seconds:.2f}s")
+    print(f"{'query':<20} {'before us':>10} {'after us':>10} {'speedup':>8}")
+    for name in old:
+        print(f"{name:<20} {old[name]:>10.1f} {new[name]:>10.1f} {old[name] / new[name]:>7.1f}x")
+    print(f"{'db size MB':<20} {sizes[0] / 2**20:>10.1f} {sizes[1] / 2**20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
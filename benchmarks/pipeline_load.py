@@ -0,0 +1,200 @@
+"""
+Нагрузочный прогон всего конвейера в одном процессе: payment_service (ASGI-приложение
+без сети) -> outbox -> брокер процесса (app.inprocess_bus) -> NotificationConsumer ->
+хранилище уведомлений. RabbitMQ не нужен, поэтому прогон годится и для CI (--check).
+
+--concurrency клиентов параллельно проходят сценарий create -> process (с долей неуспешных)
+-> refund -> refund/complete (для доли успешных). Для каждого уровня конкурентности
+печатаются p50/p95/p99 задержек по операциям, RPS и время от запроса process до
+сохранения уведомления:
+
+    python benchmarks/pipeline_load.py --concurrency 1 8 32 --duration 10 --output pipeline.json
+
+Логи INFO сервисов на время прогона отключаются (--log их оставляет). С --bus-journal
+брокер пишет журнал сообщений в файл, как при INPROCESS_BUS_PATH.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from harness import load_service, service_modules, asgi_call, latency_stats, print_latency_table, write_results
+
+
+class Pipeline:
+    """Оба сервиса в одном процессе на общем брокере app.inprocess_bus (MESSAGE_TRANSPORT=inprocess)"""
+
+    def __init__(self, payment_app, notification_app, events):
+        self.payment_app = payment_app
+        self.notification_app = notification_app
+        self.events = events  # app.payment_events
+        self.sent_at: dict[str, float] = {}
+        self.delivered: dict[str, float] = {}
+        self._all_delivered = asyncio.Event()
+
+    async def start(self):
+        with service_modules("notification"):
+            await self.notification_app.router.startup()
+        with service_modules("payment"):
+            await self.payment_app.router.startup()
+
+        # Момент сохранения уведомления — коммит записи, созданной process_message для этого платежа
+        consumer = self.notification_app.state.consumer
+        process_message = consumer.process_message
+
+        async def timed_process_message(body: bytes, content_type: str | None = None):
+            stored = await process_message(body, content_type)
+            if content_type == self.events.CONTENT_TYPE_BINARY:
+                payment_id = str(self.events.decode_binary(body).payment_id)
+            else:
+                payment_id = json.loads(body).get("payment_id")
+            stored.add_done_callback(lambda f: f.exception() is None and self._on_stored(payment_id))
+            return stored
+
+        consumer.process_message = timed_process_message
+
+    def _on_stored(self, payment_id: str):
+        if payment_id in self.sent_at and payment_id not in self.delivered:
+            self.delivered[payment_id] = time.perf_counter() - self.sent_at[payment_id]
+            if len(self.delivered) == len(self.sent_at):
+                self._all_delivered.set()
+
+    async def stop(self):
+        await self.payment_app.router.shutdown()
+        await self.notification_app.router.shutdown()
+
+    async def wait_delivered(self, timeout: float) -> bool:
+        if len(self.delivered) == len(self.sent_at):
+            return True
+        self._all_delivered.clear()
+        try:
+            await asyncio.wait_for(self._all_delivered.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+async def client(pipeline: Pipeline, rnd: random.Random, deadline: float, args, latencies: dict, errors: dict):
+    async def call(operation: str, path: str, body: dict | None) -> dict | None:
+        started = time.perf_counter()
+        status, response = await asgi_call(pipeline.payment_app, "POST", path, body)
+        latencies[operation].append(time.perf_counter() - started)
+        if status != 200:
+            errors[operation] = errors.get(operation, 0) + 1
+            return None
+        return json.loads(response)
+
+    while time.perf_counter() < deadline:
+        payment = await call("create", "/api/payments/", {"amount": round(rnd.uniform(1, 500), 2), "currency": "USD"})
+        if payment is None:
+            continue
+        payment_id = payment["id"]
+        success = rnd.random() < args.success_rate
+        if success:
+            pipeline.sent_at[payment_id] = time.perf_counter()
+        if await call("process", f"/api/payments/{payment_id}/process", {"success": success}) is None:
+            pipeline.sent_at.pop(payment_id, None)
+            continue
+        if success and rnd.random() < args.refund_rate:
+            if await call("refund", f"/api/payments/{payment_id}/refund", None) is not None:
+                await call("refund_complete", f"/api/payments/{payment_id}/refund/complete", {"success": True})
+
+
+async def run_level(pipeline: Pipeline, concurrency: int, args) -> dict:
+    latencies = {op: [] for op in ("create", "process", "refund", "refund_complete")}
+    errors: dict[str, int] = {}
+    pipeline.sent_at.clear()
+    pipeline.delivered.clear()
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    rnd = random.Random(args.seed + concurrency)
+    await asyncio.gather(*(
+        client(pipeline, random.Random(rnd.random()), deadline, args, latencies, errors) for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    complete = await pipeline.wait_delivered(args.drain_timeout)
+
+    requests = sum(len(samples) for samples in latencies.values())
+    return {
+        "concurrency": concurrency,
+        "duration_s": elapsed,
+        "requests": requests,
+        "rps": requests / elapsed,
+        "flows_per_s": len(latencies["create"]) / elapsed,
+        "errors": errors,
+        "latency": {op: latency_stats(samples) for op, samples in latencies.items()},
+        "end_to_end": latency_stats(list(pipeline.delivered.values())),
+        "notifications_expected": len(pipeline.sent_at),
+        "notifications_delivered": len(pipeline.delivered),
+        "all_delivered": complete,
+    }
+
+
+async def main_async(args, workdir: str) -> list[dict]:
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    payment = load_service("payment", ["app.main", "app.inprocess_bus"], {
+        "MESSAGE_TRANSPORT": "inprocess",
+        "INPROCESS_BUS_PATH": os.path.join(workdir, "bus.log") if args.bus_journal else "",
+        "DATABASE_URL": f"sqlite:///{workdir}/payments.db",
+        "PAYMENT_DB_BACKEND": args.db_backend,
+        "PAYMENT_CACHE": args.payment_cache,
+        "PAYMENT_EVENT_ENCODING": args.event_encoding,
+    })
+    notification = load_service("notification", ["app.main", "app.payment_events"], {
+        "RUN_CONSUMER": "true",
+        "NOTIFICATION_STORAGE": args.storage,
+        "NOTIFICATIONS_DB_PATH": os.path.join(workdir, "notifications.db"),
+    }, shared={"app.inprocess_bus": payment["app.inprocess_bus"]})
+    if not args.log:
+        logging.disable(logging.INFO)
+
+    pipeline = Pipeline(payment["app.main"].app, notification["app.main"].app, notification["app.payment_events"])
+    await pipeline.start()
+    try:
+        results = []
+        for concurrency in args.concurrency:
+            result = await run_level(pipeline, concurrency, args)
+            results.append(result)
+            print(f"\nconcurrency {concurrency}: {result['rps']:.1f} req/s, {result['flows_per_s']:.1f} flows/s, "
+                  f"errors {sum(result['errors'].values())}, notifications "
+                  f"{result['notifications_delivered']}/{result['notifications_expected']}")
+            print_latency_table({**result["latency"], "process -> notification": result["end_to_end"]})
+        return results
+    finally:
+        await pipeline.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10, help="seconds per concurrency level")
+    parser.add_argument("--success-rate", type=float, default=0.9)
+    parser.add_argument("--refund-rate", type=float, default=0.2, help="share of successful payments refunded")
+    parser.add_argument("--db-backend", choices=["async", "sync"], default="async")
+    parser.add_argument("--payment-cache", choices=["none", "memory"], default="none")
+    parser.add_argument("--storage", choices=["memory", "sqlite"], default="memory", help="notification storage")
+    parser.add_argument("--event-encoding", choices=["json", "binary"], default="json", help="payment event format")
+    parser.add_argument("--bus-journal", action="store_true", help="persist bus messages to a journal file")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="wait for outstanding notifications")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--log", action="store_true", help="keep INFO logs of the services")
+    parser.add_argument("--check", action="store_true", help="exit with 1 on request errors or lost notifications")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="pipeline-bench-") as workdir:
+        results = asyncio.run(main_async(args, workdir))
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "log", "check")}
+    write_results(args.output, "pipeline_load", config, {"levels": results})
+    if args.check and any(r["errors"] or not r["all_delivered"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from collections import deque
+from aio_pika.abc import AbstractIncomingMessage
+
+logger = logging.getLogger(__name__)
+
+
+class AckBatcher:
+    """Групповое подтверждение сообщений через ack(multiple=True).
+
+    Сообщения обрабатываются конкурентно и завершаются не по порядку, а multiple-ack
+    подтверждает все delivery tag до указанного. Поэтому подтверждается только
+    непрерывный префикс завершенных сообщений — по числу завершений или по таймеру.
+    """
+
+    def __init__(self, batch_size: int = 50, interval: float = 0.2):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._pending: deque[AbstractIncomingMessage] = deque()
+        self._done: set[int] = set()  # id() завершенных сообщений
+        self._settled: set[int] = set()  # id() уже возвращенных брокеру отдельно (nack)
+        self._since_flush = 0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Подтверждает все завершенные сообщения и останавливает таймер"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    def track(self, message: AbstractIncomingMessage):
+        """Регистрирует сообщение в порядке доставки"""
+        self._pending.append(message)
+
+    def done(self, message: AbstractIncomingMessage, settled: bool = False):
+        """settled — сообщение уже отдано брокеру через nack: multiple-ack по его delivery tag
+        закрыл бы канал, поэтому в префиксе оно только пропускается"""
+        self._done.add(id(message))
+        if settled:
+            self._settled.add(id(message))
+        self._since_flush += 1
+        if self._since_flush >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        last = None
+        while self._pending and id(self._pending[0]) in self._done:
+            message = self._pending.popleft()
+            self._done.discard(id(message))
+            if id(message) in self._settled:
+                self._settled.discard(id(message))
+            else:
+                last = message
+        self._since_flush = 0
+        if last is None:
+            return
+        try:
+            await last.ack(multiple=True)
+        except Exception as e:
+            # Канал закрыт (например, переподключение) — брокер доставит его неподтвержденные
+            # сообщения заново, а их delivery tag больше недействительны
+            logger.warning(f"Failed to ack messages up to {last.delivery_tag}: {e}")
+            stale = [m for m in self._pending if m.channel is last.channel]
+            self._pending = deque(m for m in self._pending if m.channel is not last.channel)
+            self._done.difference_update(id(m) for m in stale)
+            self._settled.difference_update(id(m) for m in stale)
@@ -0,0 +1,133 @@
+"""
+Дедупликация повторных доставок в consumer по message_id, который ставит публикатор.
+
+Доставка at-least-once: сообщение приходит повторно после переподключения
+(неподтвержденные доставляются заново) и после повторной публикации outbox-релеем.
+Обработанные message_id хранятся 16-байтовыми хэшами в LRU, ограниченном и числом
+записей, и окном времени — проверка O(1), память ограничена.
+
+С CONSUMER_DEDUP_PATH каждая запись дописывается в файл (хэш + время, без fsync)
+и множество переживает перезапуск; файл переписывается только с живыми записями,
+когда в нем накапливается вдвое больше записей, чем max_items.
+
+Множество у каждого процесса свое: при нескольких consumer (воркеры gunicorn с
+RUN_CONSUMER, API и app.worker) повторная доставка, попавшая в другой процесс, не
+отсеивается. Файлом владеет один процесс (flock на <путь>.lock); остальные с тем же
+CONSUMER_DEDUP_PATH работают только в памяти, чтобы не перетирать файл друг другу.
+"""
+import os
+import fcntl
+import time
+import struct
+import hashlib
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 0 — дедупликация выключена
+CONSUMER_DEDUP_MAX_ITEMS = int(os.getenv("CONSUMER_DEDUP_MAX_ITEMS", "100000"))
+CONSUMER_DEDUP_WINDOW_SECONDS = float(os.getenv("CONSUMER_DEDUP_WINDOW_SECONDS", "86400"))
+CONSUMER_DEDUP_PATH = os.getenv("CONSUMER_DEDUP_PATH", "")
+
+RECORD = struct.Struct("<16sd")  # хэш message_id, time.time() обработки
+
+
+def message_key(message_id: str) -> bytes:
+    return hashlib.blake2b(message_id.encode(), digest_size=16).digest()
+
+
+class SeenSet:
+    """Множество обработанных сообщений: не больше max_items записей не старше window секунд"""
+
+    def __init__(self, max_items: int = CONSUMER_DEDUP_MAX_ITEMS, window: float = CONSUMER_DEDUP_WINDOW_SECONDS,
+                 path: str | None = CONSUMER_DEDUP_PATH or None):
+        self.max_items = max_items
+        self.window = window
+        self.path = path
+        self._seen: OrderedDict[bytes, float] = OrderedDict()  # от давних к свежим
+        self._file = None
+        self._records = 0
+        self._lock_fd: int | None = None
+        if path and self._lock():
+            self._load()
+        else:
+            self.path = None
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def __contains__(self, key: bytes) -> bool:
+        seen_at = self._seen.get(key)
+        if seen_at is None:
+            return False
+        if seen_at < time.time() - self.window:
+            del self._seen[key]
+            return False
+        return True
+
+    def add(self, key: bytes):
+        now = time.time()
+        self._seen[key] = now
+        self._seen.move_to_end(key)
+        self._evict(now)
+        if self._file is not None:
+            self._file.write(RECORD.pack(key, now))
+            self._file.flush()
+            self._records += 1
+            if self._records > 2 * self.max_items:
+                self._compact()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)  # снимает и flock
+            self._lock_fd = None
+
+    def _lock(self) -> bool:
+        """Владение файлом; сам файл при сжатии подменяется, поэтому блокируется соседний"""
+        fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            logger.warning(
+                f"Deduplication file {self.path} is owned by another process; processed message ids "
+                "are kept in memory only. Give each consumer process its own CONSUMER_DEDUP_PATH"
+            )
+            return False
+        self._lock_fd = fd
+        return True
+
+    def _evict(self, now: float):
+        expired_before = now - self.window
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if len(self._seen) <= self.max_items and seen_at >= expired_before:
+                break
+            del self._seen[key]
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                data = f.read()
+            # Недописанная при падении последняя запись отбрасывается
+            for offset in range(0, len(data) - RECORD.size + 1, RECORD.size):
+                key, seen_at = RECORD.unpack_from(data, offset)
+                self._seen[key] = seen_at
+                self._seen.move_to_end(key)
+            self._evict(time.time())
+            logger.info(f"Deduplication: restored {len(self._seen)} processed message ids from {self.path}")
+        self._compact()
+
+    def _compact(self):
+        if self._file is not None:
+            self._file.close()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(RECORD.pack(key, seen_at) for key, seen_at in self._seen.items()))
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "ab")
+        self._records = len(self._seen)
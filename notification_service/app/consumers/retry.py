@@ -0,0 +1,31 @@
+"""
+Повторная обработка уведомлений с экспоненциальной задержкой и карантин poison-сообщений.
+
+Не обработанное сообщение публикуется заново в очередь задержки своей ступени backoff
+(payment_notifications.retry.<мс>): у нее нет потребителей, а по истечении TTL брокер
+возвращает сообщение в основную очередь. Номер попытки едет в заголовке x-attempt.
+После CONSUMER_RETRY_MAX_ATTEMPTS попыток, а poison-сообщение (битый JSON, неизвестный
+тип) сразу, уходит через exchange notifications.dlx в очередь payment_notifications.dlq
+с причиной в x-error — оттуда их разбирают вручную. Исходное сообщение подтверждается,
+так что основная очередь не блокируется и горячего цикла повторных доставок нет.
+"""
+
+ATTEMPT_HEADER = "x-attempt"
+ERROR_HEADER = "x-error"
+
+
+class PoisonMessage(Exception):
+    """Сообщение не обработать ни с какой попытки — сразу в карантин"""
+
+
+def backoff_delays(max_attempts: int, base_delay_ms: int, max_delay_ms: int) -> list[int]:
+    """Задержки перед попытками 2..max_attempts: base, 2*base, 4*base... не больше max_delay_ms"""
+    return [min(base_delay_ms * 2 ** i, max_delay_ms) for i in range(max_attempts - 1)]
+
+
+def attempt_of(message) -> int:
+    """Номер текущей попытки из заголовка x-attempt; у первой доставки заголовка нет"""
+    try:
+        return max(1, int((message.headers or {}).get(ATTEMPT_HEADER, 1)))
+    except (TypeError, ValueError):
+        return 1
@@ -1,4 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Body, Query
+from fastapi.responses import Response
+from uuid import UUID
 from app.services.notification_service import NotificationService
 from app.models.notification import Notification, NotificationType
 from pydantic import BaseModel
@@ -18,11 +20,19 @@ def send(req: SendRequest, service: NotificationService = Depends(get_service)):
     return service.send(req.type, req.message, req.recipient)
 
 @router.get("/", response_model=list[Notification])
-def list_notifications(service: NotificationService = Depends(get_service)):
-    return service.list()
+def list_notifications(
+    type: NotificationType | None = None,
+    recipient: str | None = None,
+    limit: int | None = Query(None, ge=1),
+    service: NotificationService = Depends(get_service),
+):
+    # Уведомления из хранилища уже соответствуют Notification: хранилище сразу отдает JSON,
+    # без повторной валидации по response_model (она остается для схемы OpenAPI)
+    content = service.list_json(type=type, recipient=recipient, limit=limit)
+    return Response(content, media_type="application/json")
 
 @router.get("/{notification_id}", response_model=Notification)
-def get_notification(notification_id: str, service: NotificationService = Depends(get_service)):
+def get_notification(notification_id: UUID, service: NotificationService = Depends(get_service)):
     try:
         return service.get(notification_id)
     except KeyError:
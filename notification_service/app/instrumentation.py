@@ -0,0 +1,151 @@
+import os
+import gzip
+import time
+import logging
+import threading
+from prometheus_client import CollectorRegistry
+from prometheus_client.exposition import choose_encoder
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.metrics import REQUEST_COUNT, REQUEST_LATENCY, REQUEST_SIZE, RESPONSE_SIZE, REQUESTS_IN_PROGRESS, exposition_registry
+
+logger = logging.getLogger(__name__)
+
+# Как часто /metrics пересобирает экспозицию; 0 — на каждый запрос
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL_MS", "1000")) / 1000
+
+# Прочие методы сводятся к одной метке, чтобы клиент не мог плодить временные ряды
+KNOWN_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def content_length(scope: Scope) -> int | None:
+    for name, value in scope["headers"]:
+        if name == b"content-length":
+            return int(value) if value.isdigit() else None
+    return None
+
+
+def route_label(scope: Scope) -> str:
+    """Шаблон пути маршрута (/api/payments/{id}/process) вместо фактического URL.
+
+    Роутер кладет в scope найденный маршрут; APIRoute передает его в scope["route"].
+    Запросы без маршрута (404) сводятся к одной метке.
+    """
+    route = scope.get("route")
+    if route is not None:
+        return route.path_format
+    if "endpoint" in scope:
+        return scope["path"]  # статические маршруты Starlette без параметров: docs, openapi.json
+    return UNMATCHED_ROUTE
+
+
+class PrometheusMiddleware:
+    """ASGI middleware метрик HTTP: число и длительность запросов, размеры тела запроса
+    и ответа, число запросов в обработке.
+
+    Дочерние метрики (labels(...)) кэшируются: с шаблонами путей набор меток ограничен.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._children: dict[tuple, tuple] = {}
+        self._in_progress: dict[str, object] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"] if scope["method"] in KNOWN_METHODS else "OTHER"
+        in_progress = self._in_progress.get(method)
+        if in_progress is None:
+            in_progress = self._in_progress[method] = REQUESTS_IN_PROGRESS.labels(method=method)
+
+        status_code = 500
+        # Размер тела запроса: Content-Length, а для chunked — фактически прочитанные байты
+        declared_size = content_length(scope)
+        request_size = 0
+        response_size = 0
+
+        async def receive_wrapper() -> Message:
+            nonlocal request_size
+            message = await receive()
+            if message["type"] == "http.request":
+                request_size += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        in_progress.inc()
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except Exception as e:
+            logger.error(f"Request failed: {e}")
+            status_code = 500
+            raise
+        finally:
+            duration = time.perf_counter() - start_time
+            in_progress.dec()
+            count, latency, req_size, resp_size = self._labels(method, route_label(scope), status_code)
+            count.inc()
+            latency.observe(duration)
+            req_size.observe(declared_size if declared_size is not None else request_size)
+            resp_size.observe(response_size)
+
+    def _labels(self, method: str, endpoint: str, status_code: int) -> tuple:
+        key = (method, endpoint, status_code)
+        children = self._children.get(key)
+        if children is None:
+            children = self._children[key] = (
+                REQUEST_COUNT.labels(method=method, endpoint=endpoint, status=status_code),
+                REQUEST_LATENCY.labels(method=method, endpoint=endpoint),
+                REQUEST_SIZE.labels(method=method, endpoint=endpoint),
+                RESPONSE_SIZE.labels(method=method, endpoint=endpoint),
+            )
+        return children
+
+
+class MetricsSnapshot:
+    """Экспозиция реестра, пересобираемая не чаще раза в interval.
+
+    Снимок кэшируется отдельно для каждого формата (text / OpenMetrics) и сжатия gzip,
+    так что scrape между пересборками — это отдача готовых байтов.
+    """
+
+    def __init__(self, registry: CollectorRegistry | None = None, interval: float = METRICS_SNAPSHOT_INTERVAL):
+        self.registry = registry if registry is not None else exposition_registry()
+        self.interval = interval
+        self._cache: dict[tuple[str, bool], tuple[float, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def render(self, accept: str | None = None, accept_encoding: str | None = None) -> tuple[bytes, str, bool]:
+        """Возвращает (тело, content type, сжато ли gzip) согласно заголовкам запроса"""
+        encoder, content_type = choose_encoder(accept)
+        compress = "gzip" in (accept_encoding or "")
+        key = (content_type, compress)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is None or now - cached[0] >= self.interval:
+                body = encoder(self.registry)
+                if compress:
+                    body = gzip.compress(body, compresslevel=6)
+                cached = self._cache[key] = (now, body)
+        return cached[1], content_type, compress
+
+    def response(self, request: Request) -> Response:
+        body, content_type, compressed = self.render(
+            request.headers.get("accept"), request.headers.get("accept-encoding")
+        )
+        headers = {"Content-Encoding": "gzip"} if compressed else None
+        return Response(body, media_type=content_type, headers=headers)
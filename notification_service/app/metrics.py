@@ -1,33 +1,123 @@
 """
 Metrics for Notification Service
 """
-from prometheus_client import Counter, Histogram, Gauge
+import os
+from prometheus_client import Counter, Histogram, Gauge, CollectorRegistry, multiprocess
+
+# Единый реестр процесса: /metrics отдает его снимок
+REGISTRY = CollectorRegistry()
+
+# При нескольких воркерах значения метрик пишутся в файлы этого каталога и суммируются
+# при экспозиции; multiprocess_mode у Gauge задает способ агрегации между воркерами
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
 
 # Создаем метрики Prometheus
 REQUEST_COUNT = Counter(
     'http_requests_total',
     'Total HTTP Requests',
-    ['method', 'endpoint', 'status']
+    ['method', 'endpoint', 'status'],
+    registry=REGISTRY
 )
 
 REQUEST_LATENCY = Histogram(
     'http_request_duration_seconds',
     'HTTP request latency in seconds',
-    ['method', 'endpoint']
+    ['method', 'endpoint'],
+    registry=REGISTRY
+)
+
+REQUEST_SIZE = Histogram(
+    'http_request_size_bytes',
+    'HTTP request body size in bytes',
+    ['method', 'endpoint'],
+    buckets=(0, 100, 1000, 10_000, 100_000, 1_000_000),
+    registry=REGISTRY
+)
+
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes',
+    'HTTP response body size in bytes',
+    ['method', 'endpoint'],
+    buckets=(0, 100, 1000, 10_000, 100_000, 1_000_000, 10_000_000),
+    registry=REGISTRY
+)
+
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress',
+    'Number of HTTP requests being processed',
+    ['method'],
+    multiprocess_mode='livesum',
+    registry=REGISTRY
 )
 
 NOTIFICATIONS_SENT = Counter(
     'notifications_sent_total',
     'Total number of notifications sent',
-    ['type', 'status']
+    ['type', 'status'],
+    registry=REGISTRY
 )
 
 NOTIFICATIONS_QUEUED = Gauge(
     'notifications_queued',
-    'Number of notifications in queue'
+    'Number of notifications in queue',
+    multiprocess_mode='livesum',
+    registry=REGISTRY
 )
 
 RABBITMQ_CONNECTIONS = Gauge(
     'rabbitmq_connections',
-    'RabbitMQ connection status'
-)
\ No newline at end of file
+    'RabbitMQ connection status',
+    multiprocess_mode='livesum',
+    registry=REGISTRY
+)
+NOTIFICATION_RETRIES = Counter(
+    'notification_retries_total',
+    'Messages scheduled for a delayed retry',
+    registry=REGISTRY
+)
+
+NOTIFICATIONS_DEAD_LETTERED = Counter(
+    'notifications_dead_lettered_total',
+    'Messages moved to the dead-letter queue',
+    ['reason'],
+    registry=REGISTRY
+)
+
+NOTIFICATION_DUPLICATES = Counter(
+    'notification_duplicates_total',
+    'Redelivered messages dropped by deduplication',
+    registry=REGISTRY
+)
+
+# Глубина очередей брокера одна на всех: берем максимум, а не сумму по процессам
+NOTIFICATION_RETRY_QUEUE_DEPTH = Gauge(
+    'notification_retry_queue_depth',
+    'Messages waiting in the retry (delay) queues',
+    multiprocess_mode='max',
+    registry=REGISTRY
+)
+
+NOTIFICATION_DLQ_DEPTH = Gauge(
+    'notification_dead_letter_queue_depth',
+    'Messages in the dead-letter queue',
+    multiprocess_mode='max',
+    registry=REGISTRY
+)
+
+STORE_FLUSH_BATCH_SIZE = Histogram(
+    'notification_store_flush_batch_size',
+    'Number of notifications written per group commit',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500),
+    registry=REGISTRY
+)
+
+
+def exposition_registry() -> CollectorRegistry:
+    """Реестр для /metrics: в multiprocess-режиме — агрегат метрик всех воркеров"""
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
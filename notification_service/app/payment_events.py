@@ -0,0 +1,93 @@
+"""
+Событие платежа для уведомлений: версионированная схема и два формата на проводе,
+которые получатель различает по AMQP content_type:
+
+- application/json — {"v": 1, "type": "payment_complete", "payment_id": "<uuid>"};
+- application/vnd.payment-event — 18 байт: версия (uint8), код типа (uint8),
+  payment_id (16 байт UUID).
+
+Текст уведомления не передается — получатель строит его по типу (PaymentEvent.text).
+JSON без поля "v" — прежний формат с готовым текстом в message. Коды типов только
+добавляются и не переиспользуются; изменение раскладки — новая версия.
+
+Модуль одинаков в обоих сервисах.
+"""
+import os
+import json
+import struct
+from dataclasses import dataclass
+from uuid import UUID
+
+# json понимают и получатели прежних версий; binary — после их обновления
+PAYMENT_EVENT_ENCODING = os.getenv("PAYMENT_EVENT_ENCODING", "json")
+
+SCHEMA_VERSION = 1
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_BINARY = "application/vnd.payment-event"
+
+EVENT_TYPES = {"payment_complete": 1}
+EVENT_TYPE_NAMES = {code: name for name, code in EVENT_TYPES.items()}
+EVENT_TEXT = {"payment_complete": "Payment %s completed successfully"}
+
+BINARY_LAYOUT = struct.Struct("!BB16s")
+
+
+class InvalidEvent(ValueError):
+    """Тело сообщения не соответствует схеме события"""
+
+
+@dataclass(frozen=True, slots=True)
+class PaymentEvent:
+    type: str
+    payment_id: UUID
+    version: int = SCHEMA_VERSION
+
+    def __post_init__(self):
+        if self.version != SCHEMA_VERSION:
+            raise InvalidEvent(f"Unsupported event version {self.version!r}")
+        if self.type not in EVENT_TYPES:
+            raise InvalidEvent(f"Unknown event type {self.type!r}")
+        if not isinstance(self.payment_id, UUID):
+            raise InvalidEvent(f"payment_id must be a UUID, got {type(self.payment_id).__name__}")
+
+    @property
+    def message_id(self) -> str:
+        """Постоянный id для дедупликации у получателя: событие данного типа у платежа одно"""
+        return f"{self.type}:{self.payment_id}"
+
+    def text(self) -> str:
+        return EVENT_TEXT[self.type] % self.payment_id
+
+    def to_dict(self) -> dict:
+        return {"v": self.version, "type": self.type, "payment_id": str(self.payment_id)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PaymentEvent":
+        """Без "v" — запись прежнего формата (лишние поля вроде message не используются)"""
+        if not isinstance(data, dict):
+            raise InvalidEvent("Event must be a JSON object")
+        try:
+            payment_id = UUID(data["payment_id"])
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise InvalidEvent(f"Invalid payment_id: {e!r}") from e
+        return cls(type=data.get("type"), payment_id=payment_id, version=data.get("v", SCHEMA_VERSION))
+
+
+def encode_event(event: PaymentEvent, encoding: str = PAYMENT_EVENT_ENCODING) -> tuple[str, bytes]:
+    """content_type и тело сообщения"""
+    if encoding == "binary":
+        return CONTENT_TYPE_BINARY, BINARY_LAYOUT.pack(event.version, EVENT_TYPES[event.type], event.payment_id.bytes)
+    if encoding == "json":
+        return CONTENT_TYPE_JSON, json.dumps(event.to_dict(), separators=(",", ":")).encode()
+    raise ValueError(f"Unknown PAYMENT_EVENT_ENCODING: {encoding}")
+
+
+def decode_binary(body: bytes) -> PaymentEvent:
+    if not body or body[0] != SCHEMA_VERSION:
+        raise InvalidEvent(f"Unsupported event version {body[0] if body else None!r}")
+    if len(body) != BINARY_LAYOUT.size:
+        raise InvalidEvent(f"Event must be {BINARY_LAYOUT.size} bytes, got {len(body)}")
+    version, code, payment_id = BINARY_LAYOUT.unpack(body)
+    if code not in EVENT_TYPE_NAMES:
+        raise InvalidEvent(f"Unknown event type code {code}")
+    return PaymentEvent(EVENT_TYPE_NAMES[code], UUID(bytes=payment_id), version)
@@ -1,19 +1,119 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from itertools import islice
+from datetime import datetime, timedelta
 from typing import List
 from uuid import UUID
-from app.models.notification import Notification
+from pydantic import TypeAdapter
+from app.models.notification import Notification, NotificationType
+
+# Ограничения хранилища: число уведомлений и их возраст (0 — без ограничения)
+NOTIFICATIONS_MAX_ITEMS = int(os.getenv("NOTIFICATIONS_MAX_ITEMS", "10000"))
+NOTIFICATIONS_TTL_SECONDS = float(os.getenv("NOTIFICATIONS_TTL_SECONDS", "0"))
+
+NOTIFICATION_LIST = TypeAdapter(List[Notification])
 
-notifications: List[Notification] = []
 
 class NotificationRepo:
-    def list_notifications(self) -> List[Notification]:
-        return notifications
+    """Хранилище уведомлений в памяти.
+
+    Основной индекс — dict по id (в порядке добавления), вторичные — по типу и получателю.
+    При превышении max_items вытесняется давно не читавшееся уведомление (LRU),
+    уведомления старше ttl_seconds удаляются. Доступ защищен блокировкой: хранилище
+    используют и consumer, и обработчики запросов.
+    """
+
+    def __init__(self, max_items: int = NOTIFICATIONS_MAX_ITEMS, ttl_seconds: float = NOTIFICATIONS_TTL_SECONDS):
+        self.max_items = max_items
+        self.ttl = timedelta(seconds=ttl_seconds) if ttl_seconds > 0 else None
+        self._items: dict[UUID, Notification] = {}
+        self._lru: OrderedDict[UUID, None] = OrderedDict()
+        self._by_type: dict[NotificationType, dict[UUID, None]] = {}
+        self._by_recipient: dict[str, dict[UUID, None]] = {}
+        self._lock = threading.RLock()
+
+    def list_notifications(
+        self, type: NotificationType | None = None, recipient: str | None = None, limit: int | None = None
+    ) -> List[Notification]:
+        with self._lock:
+            self._expire()
+            if type is not None and recipient is not None:
+                by_type = self._by_type.get(type, {})
+                ids = (id for id in self._by_recipient.get(recipient, {}) if id in by_type)
+            elif type is not None:
+                ids = self._by_type.get(type, {})
+            elif recipient is not None:
+                ids = self._by_recipient.get(recipient, {})
+            else:
+                ids = self._items
+            return [self._items[id] for id in islice(ids, limit)]
+
+    def list_notifications_json(
+        self, type: NotificationType | None = None, recipient: str | None = None, limit: int | None = None
+    ) -> bytes:
+        """list_notifications сразу в JSON: уже провалидированные модели сериализуются
+        одним вызовом pydantic-core, без повторной валидации"""
+        return NOTIFICATION_LIST.dump_json(self.list_notifications(type=type, recipient=recipient, limit=limit))
 
-    def create_notification(self, notification: Notification) -> Notification:
-        notifications.append(notification)
+    def create_notification(self, notification: Notification, buffered: bool = False) -> Notification | Future:
+        """buffered — как у SQLiteNotificationRepo: Future записи, здесь уже завершенный"""
+        with self._lock:
+            self._items[notification.id] = notification
+            self._lru[notification.id] = None
+            self._by_type.setdefault(notification.type, {})[notification.id] = None
+            if notification.recipient is not None:
+                self._by_recipient.setdefault(notification.recipient, {})[notification.id] = None
+            self._expire()
+            while len(self._items) > self.max_items:
+                self._remove(next(iter(self._lru)))
+        if buffered:
+            future = Future()
+            future.set_result(notification)
+            return future
         return notification
 
     def get_notification(self, id: UUID) -> Notification:
-        for n in notifications:
-            if n.id == id:
-                return n
-        raise KeyError("Notification not found")
+        with self._lock:
+            self._expire()
+            notification = self._items.get(id)
+            if notification is None:
+                raise KeyError("Notification not found")
+            self._lru.move_to_end(id)
+            return notification
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _expire(self):
+        """Удаляет устаревшие уведомления; _items упорядочен по времени добавления"""
+        if self.ttl is None:
+            return
+        threshold = datetime.utcnow() - self.ttl
+        while self._items:
+            oldest = next(iter(self._items.values()))
+            if oldest.created_at >= threshold:
+                break
+            self._remove(oldest.id)
+
+    def _remove(self, id: UUID):
+        notification = self._items.pop(id)
+        del self._lru[id]
+        self._discard_index(self._by_type, notification.type, id)
+        if notification.recipient is not None:
+            self._discard_index(self._by_recipient, notification.recipient, id)
+
+    @staticmethod
+    def _discard_index(index: dict, key, id: UUID):
+        ids = index.get(key)
+        if ids is not None:
+            ids.pop(id, None)
+            if not ids:
+                del index[key]
@@ -0,0 +1,225 @@
+import os
+import sqlite3
+import logging
+import threading
+import orjson
+from concurrent.futures import Future
+from datetime import datetime
+from typing import List
+from uuid import UUID
+from app.models.notification import Notification, NotificationType, NotificationStatus
+from app.metrics import STORE_FLUSH_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATIONS_DB_PATH = os.getenv("NOTIFICATIONS_DB_PATH", "./notifications.db")
+# Групповой коммит: по числу накопленных уведомлений или по таймеру
+NOTIFICATIONS_FLUSH_BATCH_SIZE = int(os.getenv("NOTIFICATIONS_FLUSH_BATCH_SIZE", "100"))
+NOTIFICATIONS_FLUSH_INTERVAL_MS = float(os.getenv("NOTIFICATIONS_FLUSH_INTERVAL_MS", "200"))
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS notifications (
+        id TEXT PRIMARY KEY,
+        type TEXT NOT NULL,
+        message TEXT NOT NULL,
+        recipient TEXT,
+        status TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_notifications_created_at ON notifications (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_notifications_type ON notifications (type, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_notifications_recipient ON notifications (recipient, created_at)",
+)
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+}
+
+COLUMNS = "id, type, message, recipient, status, created_at"
+
+
+def to_row(notification: Notification) -> tuple:
+    return (
+        str(notification.id),
+        notification.type.value,
+        notification.message,
+        notification.recipient,
+        notification.status.value,
+        notification.created_at.isoformat(),
+    )
+
+
+def to_notification(row: tuple) -> Notification:
+    id, type, message, recipient, status, created_at = row
+    return Notification(
+        id=UUID(id),
+        type=NotificationType(type),
+        message=message,
+        recipient=recipient,
+        status=NotificationStatus(status),
+        created_at=datetime.fromisoformat(created_at),
+    )
+
+
+def to_notification_dict(row: tuple) -> dict:
+    """Строка таблицы в dict с полями Notification без разбора значений.
+
+    Колонки хранят ровно то, что дает JSON-сериализация модели (строки перечислений,
+    created_at в isoformat), поэтому их можно отдавать клиенту как есть.
+    """
+    id, type, message, recipient, status, created_at = row
+    return {
+        "id": id,
+        "type": type,
+        "message": message,
+        "recipient": recipient,
+        "status": status,
+        "created_at": created_at,
+    }
+
+
+class SQLiteNotificationRepo:
+    """Хранилище уведомлений в SQLite с тем же интерфейсом, что и NotificationRepo.
+
+    Записи с buffered=True (из consumer) копятся в буфере и пишутся одной транзакцией,
+    когда набирается flush_batch_size уведомлений или проходит flush_interval —
+    consumer не упирается в число fsync в секунду. Чтение идет только по зафиксированным
+    строкам и не форсирует запись буфера: иначе поток GET разбивал бы групповой коммит;
+    буферизованное уведомление становится видно после COMMIT пачки (не позже flush_interval).
+    Для такой записи возвращается Future: он завершается после COMMIT ее пачки или
+    получает ошибку записи — тогда запись не повторяется, повтором занимается вызывающий.
+    """
+
+    def __init__(
+        self,
+        path: str = NOTIFICATIONS_DB_PATH,
+        flush_batch_size: int = NOTIFICATIONS_FLUSH_BATCH_SIZE,
+        flush_interval: float = NOTIFICATIONS_FLUSH_INTERVAL_MS / 1000,
+    ):
+        self.path = path
+        self.flush_batch_size = flush_batch_size
+        self.flush_interval = flush_interval
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        for name, value in PRAGMAS.items():
+            self._conn.execute(f"PRAGMA {name}={value}")
+        with self._conn:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+
+        self._db_lock = threading.Lock()  # одно соединение на процесс
+        self._buffer: dict[UUID, Notification] = {}
+        self._futures: dict[UUID, list[Future]] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="notification-flusher", daemon=True)
+        self._flusher.start()
+
+    def list_notifications(
+        self, type: NotificationType | None = None, recipient: str | None = None, limit: int | None = None
+    ) -> List[Notification]:
+        return [to_notification(row) for row in self._select(type, recipient, limit)]
+
+    def list_notifications_json(
+        self, type: NotificationType | None = None, recipient: str | None = None, limit: int | None = None
+    ) -> bytes:
+        """list_notifications сразу в JSON: строки идут в orjson без создания моделей"""
+        return orjson.dumps([to_notification_dict(row) for row in self._select(type, recipient, limit)])
+
+    def _select(self, type: NotificationType | None, recipient: str | None, limit: int | None) -> list[tuple]:
+        conditions, params = [], []
+        if type is not None:
+            conditions.append("type = ?")
+            params.append(type.value)
+        if recipient is not None:
+            conditions.append("recipient = ?")
+            params.append(recipient)
+        query = f"SELECT {COLUMNS} FROM notifications"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY created_at, rowid"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._db_lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def create_notification(self, notification: Notification, buffered: bool = False) -> Notification | Future:
+        if not buffered:
+            # Вместе с буфером — сохраняем порядок относительно уже принятых записей
+            self.flush(notification)
+            return notification
+        future = Future()
+        with self._cond:
+            self._buffer[notification.id] = notification
+            self._futures.setdefault(notification.id, []).append(future)
+            if len(self._buffer) >= self.flush_batch_size:
+                self._cond.notify()
+        return future
+
+    def get_notification(self, id: UUID) -> Notification:
+        with self._db_lock:
+            row = self._conn.execute(f"SELECT {COLUMNS} FROM notifications WHERE id = ?", (str(id),)).fetchone()
+        if row is None:
+            raise KeyError("Notification not found")
+        return to_notification(row)
+
+    def __len__(self) -> int:
+        with self._db_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM notifications").fetchone()[0]
+
+    def flush(self, *notifications: Notification):
+        """Записывает буфер и переданные уведомления одной транзакцией"""
+        with self._db_lock:
+            with self._cond:
+                buffered, futures = self._buffer, self._futures
+                self._buffer, self._futures = {}, {}
+            batch = list(buffered.values()) + list(notifications)
+            if not batch:
+                return
+            try:
+                self._write(batch)
+            except sqlite3.Error as e:
+                # Буферизованные записи не возвращаются в буфер: их future получают ошибку,
+                # и consumer отправляет сообщения на повтор, не подтверждая их брокеру
+                logger.error(f"Failed to flush {len(batch)} notifications: {e}")
+                for pending in futures.values():
+                    for future in pending:
+                        future.set_exception(e)
+                raise
+            for id, pending in futures.items():
+                for future in pending:
+                    future.set_result(buffered[id])
+
+    def close(self):
+        """Остановка фоновой записи с финальным flush"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._flusher.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+    def _write(self, notifications: list[Notification]):
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO notifications ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                [to_row(n) for n in notifications],
+            )
+        STORE_FLUSH_BATCH_SIZE.observe(len(notifications))
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._buffer) < self.flush_batch_size:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass  # уже залогировано, повтор на следующем тике
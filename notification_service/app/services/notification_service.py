@@ -1,15 +1,37 @@
+import os
+from concurrent.futures import Future
 from uuid import uuid4, UUID
 from datetime import datetime
 from app.models.notification import Notification, NotificationType, NotificationStatus
 from app.repositories.local_notification_repo import NotificationRepo
+from app.repositories.sqlite_notification_repo import SQLiteNotificationRepo
 from app.metrics import NOTIFICATIONS_SENT
 
+# Хранилище уведомлений: memory (теряется при рестарте) или sqlite
+NOTIFICATION_STORAGE = os.getenv("NOTIFICATION_STORAGE", "memory")
 
-class NotificationService:
-    def __init__(self):
-        self.repo = NotificationRepo()
 
-    def send(self, n_type: NotificationType, message: str, recipient: str | None = None) -> Notification:
+def create_notification_repo(storage: str = NOTIFICATION_STORAGE) -> NotificationRepo | SQLiteNotificationRepo:
+    if storage == "sqlite":
+        return SQLiteNotificationRepo()
+    if storage == "memory":
+        return NotificationRepo()
+    raise ValueError(f"Unknown notification storage: {storage}")
+
+
+# Общее хранилище процесса для сервиса и consumer
+notification_repo = create_notification_repo()
+
+
+class NotificationService:
+    def __init__(self, repo: NotificationRepo | SQLiteNotificationRepo | None = None):
+        self.repo = repo if repo is not None else notification_repo
+
+    def send(
+        self, n_type: NotificationType, message: str, recipient: str | None = None, buffered: bool = False
+    ) -> Notification | Future:
+        """buffered=True откладывает запись до группового коммита хранилища и возвращает
+        concurrent.futures.Future с уведомлением, завершающийся после коммита"""
         notif = Notification(
             id=uuid4(),
             type=n_type,
@@ -19,15 +41,21 @@ class NotificationService:
             created_at=datetime.utcnow()
         )
 
-        result = self.repo.create_notification(notif)
+        result = self.repo.create_notification(notif, buffered=buffered)
 
         # Обновляем метрики
         NOTIFICATIONS_SENT.labels(type=n_type.value, status='sent').inc()
 
         return result
 
-    def list(self):
-        return self.repo.list_notifications()
+    def list(self, type: NotificationType | None = None, recipient: str | None = None, limit: int | None = None):
+        return self.repo.list_notifications(type=type, recipient=recipient, limit=limit)
+
+    def list_json(
+        self, type: NotificationType | None = None, recipient: str | None = None, limit: int | None = None
+    ) -> bytes:
+        """list, сериализованный хранилищем в JSON — для ответа без повторной валидации"""
+        return self.repo.list_notifications_json(type=type, recipient=recipient, limit=limit)
 
     def get(self, id: UUID):
         return self.repo.get_notification(id)
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""
+Consumer уведомлений отдельным процессом: python -m app.worker
+
+API в этом случае запускается с RUN_CONSUMER=false, а хранилище должно быть общим
+(NOTIFICATION_STORAGE=sqlite). Метрики отдаются на CONSUMER_METRICS_PORT, если он задан.
+"""
+import os
+import glob
+import signal
+import asyncio
+import logging
+from prometheus_client import start_http_server
+
+# Файлы метрик прошлого запуска иначе попали бы в счетчики нового (как on_starting в
+# gunicorn.conf.py); удаляются до импорта app.*, потому что метрики создают файлы при импорте
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, "*.db")):
+        os.remove(path)
+
+from app.consumers.notification_consumer import NotificationConsumer  # noqa: E402
+from app.services.notification_service import notification_repo, NOTIFICATION_STORAGE  # noqa: E402
+from app.metrics import exposition_registry  # noqa: E402
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CONSUMER_METRICS_PORT = int(os.getenv("CONSUMER_METRICS_PORT", "0"))
+
+
+async def run():
+    if NOTIFICATION_STORAGE == "memory":
+        logger.warning("Standalone consumer with in-memory storage: notifications are not visible to the API")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    consumer = NotificationConsumer()
+    consuming = consumer.start()
+    stop_requested = asyncio.create_task(stopping.wait())
+    await asyncio.wait([consuming, stop_requested], return_when=asyncio.FIRST_COMPLETED)
+    stop_requested.cancel()
+
+    logger.info("Notification consumer shutting down")
+    await consumer.stop()
+    notification_repo.close()
+
+
+def main():
+    if CONSUMER_METRICS_PORT:
+        start_http_server(CONSUMER_METRICS_PORT, registry=exposition_registry())
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
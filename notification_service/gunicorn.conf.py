@@ -0,0 +1,35 @@
+"""
+Запуск нескольких воркеров uvicorn под gunicorn: gunicorn -c gunicorn.conf.py app.main:app
+"""
+import os
+import glob
+from prometheus_client import multiprocess
+
+bind = os.getenv("BIND", "0.0.0.0:80")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+def on_starting(server):
+    """Файлы метрик прошлого запуска иначе попали бы в счетчики нового"""
+    if MULTIPROC_DIR:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(MULTIPROC_DIR, "*.db")):
+            os.remove(path)
+    # Хранилище в памяти у каждого воркера свое — API видел бы только часть уведомлений
+    if workers > 1 and os.getenv("NOTIFICATION_STORAGE", "memory") == "memory":
+        server.log.warning("WEB_CONCURRENCY > 1 with in-memory notification storage; set NOTIFICATION_STORAGE=sqlite")
+    # Дедупликация consumer у каждого воркера своя, а файл CONSUMER_DEDUP_PATH достается одному из них
+    if workers > 1 and os.getenv("RUN_CONSUMER", "true").lower() == "true":
+        server.log.warning(
+            "WEB_CONCURRENCY > 1 with RUN_CONSUMER=true: redeliveries are deduplicated per worker only "
+            "and only one worker persists CONSUMER_DEDUP_PATH; run the consumer as a separate app.worker"
+        )
+
+def child_exit(server, worker):
+    """Live-gauge завершившегося воркера больше не учитываются"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(worker.pid)
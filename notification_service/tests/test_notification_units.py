@@ -68,4 +68,659 @@ def test_notification_service_list():
     service = NotificationService()
 
     notifications = service.list()
-    assert isinstance(notifications, list)
\ No newline at end of file
+    assert isinstance(notifications, list)
+
+class FakeMessage:
+    """Входящее сообщение без брокера: запоминает multiple-ack"""
+
+    def __init__(self, delivery_tag, body=b"{}", channel=None, acks=None, headers=None, message_id=None):
+        self.delivery_tag = delivery_tag
+        self.body = body
+        self.channel = channel
+        self.headers = headers or {}
+        self.message_id = message_id
+        self.content_type = None
+        self.acks = acks if acks is not None else []
+
+    async def ack(self, multiple=False):
+        self.acks.append((self.delivery_tag, multiple))
+
+    async def nack(self, multiple=False, requeue=True):
+        self.acks.append((self.delivery_tag, "nack"))
+
+
+def test_ack_batcher_acks_contiguous_prefix():
+    """Multiple-ack covers only the contiguous prefix of completed deliveries"""
+    import asyncio
+    from app.consumers.ack_batcher import AckBatcher
+
+    async def scenario():
+        acks = []
+        batcher = AckBatcher(batch_size=100, interval=10)
+        messages = [FakeMessage(tag, acks=acks) for tag in range(1, 6)]
+        for m in messages:
+            batcher.track(m)
+
+        for m in (messages[0], messages[1], messages[3]):
+            batcher.done(m)
+        await batcher.flush()
+        assert acks == [(2, True)]
+
+        batcher.done(messages[2])
+        batcher.done(messages[4])
+        await batcher.flush()
+        assert acks == [(2, True), (5, True)]
+
+    asyncio.run(scenario())
+
+
+def test_ack_batcher_skips_settled_messages():
+    """A message already nacked on its own is never the target of a multiple-ack"""
+    import asyncio
+    from app.consumers.ack_batcher import AckBatcher
+
+    async def scenario():
+        acks = []
+        batcher = AckBatcher(batch_size=100, interval=10)
+        messages = [FakeMessage(tag, acks=acks) for tag in range(1, 4)]
+        for m in messages:
+            batcher.track(m)
+        batcher.done(messages[0])
+        batcher.done(messages[1])
+        batcher.done(messages[2], settled=True)
+        await batcher.flush()
+        return acks
+
+    assert asyncio.run(scenario()) == [(2, True)]
+
+
+def test_consumer_concurrent_dispatch_keeps_payment_order():
+    """Concurrent handlers are bounded and keep per-payment order"""
+    import asyncio
+    import json
+    from app.consumers.notification_consumer import NotificationConsumer
+
+    async def scenario():
+        consumer = NotificationConsumer()
+        consumer.concurrency = 2
+        consumer._semaphore = asyncio.Semaphore(2)
+        processed, running, peak = [], 0, 0
+
+        async def process_message(body, content_type=None):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01 if json.loads(body)["seq"] == 0 else 0)
+            processed.append(json.loads(body)["seq"])
+            running -= 1
+
+        consumer.process_message = process_message
+        acks = []
+        bodies = [{"payment_id": "a" if seq < 2 else f"p{seq}", "seq": seq} for seq in range(5)]
+        for tag, body in enumerate(bodies, start=1):
+            await consumer.dispatch(FakeMessage(tag, json.dumps(body).encode(), acks=acks))
+        await consumer.drain()
+        return processed, peak, acks
+
+    processed, peak, acks = asyncio.run(scenario())
+
+    assert processed.index(0) < processed.index(1)
+    assert sorted(processed) == [0, 1, 2, 3, 4]
+    assert peak <= 2
+    assert acks[-1] == (5, True)
+
+
+def test_consumer_stop_drains_in_flight_messages():
+    """stop() cancels consumption, finishes received messages, acks them and reports disconnect"""
+    import asyncio
+    from app.consumers.notification_consumer import NotificationConsumer
+    from app.metrics import RABBITMQ_CONNECTIONS
+
+    async def scenario():
+        consumer = NotificationConsumer()
+        processed, acks = [], []
+
+        async def process_message(body, content_type=None):
+            await asyncio.sleep(0.02)
+            processed.append(body)
+
+        async def start_consuming():
+            consumer._set_connected(True)
+            consumer._acker.start()
+            for tag in range(1, 4):
+                await consumer.dispatch(FakeMessage(tag, b"{}", acks=acks))
+            await asyncio.Event().wait()  # ждет следующих сообщений, пока не отменят
+
+        consumer.process_message = process_message
+        consumer.start_consuming = start_consuming
+        consumer.start()
+        await asyncio.sleep(0)
+        assert consumer.is_connected and RABBITMQ_CONNECTIONS._value.get() == 1
+
+        await consumer.stop(timeout=5)
+        return consumer, processed, acks
+
+    consumer, processed, acks = asyncio.run(scenario())
+
+    assert len(processed) == 3
+    assert acks == [(3, True)]
+    assert not consumer.is_connected
+    assert RABBITMQ_CONNECTIONS._value.get() == 0
+
+
+def test_inprocess_bus_prefetch_ack_and_requeue():
+    """In-process bus honours prefetch, multiple-ack, nack requeue and returns unacked on close"""
+    import asyncio
+    import aio_pika
+    from app.inprocess_bus import InProcessBus
+
+    async def scenario():
+        bus = InProcessBus()
+        bus.declare_queue("q", "ex")
+        bus.publish("ex", [aio_pika.Message(body=str(i).encode(), message_id=str(i)) for i in range(4)])
+        sub = bus.subscribe("q", prefetch_count=2)
+        it = sub.__aiter__()
+
+        first, second = await it.__anext__(), await it.__anext__()
+        assert (first.body, second.body, second.message_id) == (b"0", b"1", "1")
+        blocked = asyncio.ensure_future(it.__anext__())
+        await asyncio.sleep(0.01)
+        assert not blocked.done()  # prefetch исчерпан
+
+        await second.ack(multiple=True)
+        third = await blocked
+        await third.nack(requeue=True)
+        again = await it.__anext__()
+        assert (again.body, again.redelivered) == (b"2", True)
+        with pytest.raises(ValueError):
+            await third.ack()
+
+        sub.close()
+        assert bus.queue_depth("q") == 2
+        rest = bus.subscribe("q", prefetch_count=10).__aiter__()
+        assert [(await rest.__anext__()).body for _ in range(2)] == [b"2", b"3"]
+
+    asyncio.run(scenario())
+
+
+def test_inprocess_bus_journal_restores_unacked(tmp_path):
+    """Messages not acked before restart are redelivered from the journal; acked ones are compacted away"""
+    import asyncio
+    import aio_pika
+    from app.inprocess_bus import InProcessBus
+
+    path = str(tmp_path / "bus.log")
+
+    async def consume(bus, count, ack):
+        it = bus.subscribe("q").__aiter__()
+        messages = [await it.__anext__() for _ in range(count)]
+        if ack:
+            await messages[-1].ack(multiple=True)
+        return [m.body for m in messages]
+
+    bus = InProcessBus(path, compact_threshold=1)
+    bus.declare_queue("q", "ex")
+    bus.publish("ex", [aio_pika.Message(body=str(i).encode(), headers={"n": i}) for i in range(5)])
+    assert asyncio.run(consume(bus, 2, ack=True)) == [b"0", b"1"]
+    assert asyncio.run(consume(bus, 1, ack=False)) == [b"2"]
+    bus._journal.close()  # процесс завершился, не закрыв подписку
+
+    bus = InProcessBus(path, compact_threshold=1)
+    assert bus.queue_depth("q") == 3
+    assert asyncio.run(consume(bus, 3, ack=True)) == [b"2", b"3", b"4"]
+    bus.close()
+
+    with open(path) as f:
+        assert f.read() == ""
+    assert InProcessBus(path).queue_depth("q") == 0
+
+
+def test_consumer_over_inprocess_transport():
+    """Consumer receives, stores and acks messages published to the in-process bus"""
+    import asyncio
+    import json
+    import aio_pika
+    from app.consumers.notification_consumer import NotificationConsumer
+    from app.consumers.transport import InProcessTransport, EXCHANGE_NAME, QUEUE_NAME
+    from app.inprocess_bus import InProcessBus
+    from app.repositories.local_notification_repo import NotificationRepo
+
+    async def scenario():
+        bus = InProcessBus()
+        consumer = NotificationConsumer(InProcessTransport(bus))
+        consumer.notification_service.repo = repo = NotificationRepo()
+        consumer.start()
+        await asyncio.sleep(0)
+        assert consumer.is_connected
+
+        bus.publish(EXCHANGE_NAME, [
+            aio_pika.Message(body=json.dumps({"type": "payment_complete", "payment_id": str(uuid4()), "message": str(i)}).encode())
+            for i in range(30)
+        ])
+        deadline = asyncio.get_running_loop().time() + 5
+        while len(repo) < 30 and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.01)
+        await consumer.stop(timeout=5)
+        return bus, repo
+
+    bus, repo = asyncio.run(scenario())
+
+    assert sorted(int(n.message) for n in repo.list_notifications()) == list(range(30))
+    assert bus.queue_depth(QUEUE_NAME) == 0 and not bus._live
+
+
+def test_inprocess_bus_ttl_queue_dead_letters_to_target(tmp_path):
+    """Expired messages of a TTL queue move to its dead-letter queue, also after a restart"""
+    import asyncio
+    import aio_pika
+    from app.inprocess_bus import InProcessBus
+
+    path = str(tmp_path / "bus.log")
+
+    async def scenario():
+        bus = InProcessBus(path)
+        bus.declare_queue("q")
+        bus.declare_queue("q.delay", message_ttl=0.05, dead_letter_queue="q")
+        bus.send("q.delay", [aio_pika.Message(body=b"late", headers={"x-attempt": 2}, message_id="m1")])
+        bus.send("q.delay", [aio_pika.Message(body=b"later")])
+        assert (bus.queue_depth("q.delay"), bus.queue_depth("q")) == (2, 0)
+        bus._journal.close()  # процесс завершился до истечения TTL
+
+        bus = InProcessBus(path)
+        bus.declare_queue("q.delay", message_ttl=0.05, dead_letter_queue="q")
+        await asyncio.sleep(0.1)
+        assert (bus.queue_depth("q.delay"), bus.queue_depth("q")) == (0, 2)
+        message = await bus.subscribe("q").__aiter__().__anext__()
+        bus.close()
+        return message
+
+    message = asyncio.run(scenario())
+
+    assert (message.body, message.headers, message.message_id) == (b"late", {"x-attempt": 2}, "m1")
+    assert InProcessBus(path).queue_depth("q") == 2
+
+
+def test_consumer_retries_with_backoff_and_quarantines_poison():
+    """Transient failures are retried through delay queues, poison and exhausted messages go to the DLQ"""
+    import asyncio
+    import json
+    import aio_pika
+    from app.consumers.notification_consumer import NotificationConsumer
+    from app.consumers.transport import InProcessTransport, EXCHANGE_NAME, QUEUE_NAME, DEAD_LETTER_QUEUE
+    from app.inprocess_bus import InProcessBus
+    from app.repositories.local_notification_repo import NotificationRepo
+    from app.metrics import NOTIFICATION_RETRIES, NOTIFICATIONS_DEAD_LETTERED, NOTIFICATION_DLQ_DEPTH
+
+    retries_before = NOTIFICATION_RETRIES._value.get()
+    poison_before = NOTIFICATIONS_DEAD_LETTERED.labels(reason="poison")._value.get()
+
+    async def scenario():
+        bus = InProcessBus()
+        consumer = NotificationConsumer(InProcessTransport(bus))
+        consumer.max_attempts, consumer.retry_delays = 3, [100, 200]
+        consumer.notification_service.repo = repo = NotificationRepo()
+        send, failures = consumer.notification_service.send, {"flaky": 1, "broken": 10}
+
+        def flaky_send(**kwargs):
+            if failures.get(kwargs["message"], 0) > 0:
+                failures[kwargs["message"]] -= 1
+                raise OSError("storage unavailable")
+            return send(**kwargs)
+
+        consumer.notification_service.send = flaky_send
+        consumer.start()
+        await asyncio.sleep(0)
+
+        def message(text):
+            return aio_pika.Message(body=json.dumps({"type": "payment_complete", "payment_id": text, "message": text}).encode())
+
+        bus.publish(EXCHANGE_NAME, [message("flaky"), aio_pika.Message(body=b"not json"), message("broken"), message("ok")])
+        await asyncio.sleep(0.03)
+        assert {n.message for n in repo.list_notifications()} == {"ok"}  # основная очередь не заблокирована
+        deadline = asyncio.get_running_loop().time() + 5
+        while bus.queue_depth(DEAD_LETTER_QUEUE) < 2 and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.01)
+        await consumer.report_queue_depths()
+        await consumer.stop(timeout=5)
+        quarantine = bus.subscribe(DEAD_LETTER_QUEUE).__aiter__()
+        return bus, repo, [await quarantine.__anext__() for _ in range(2)]
+
+    bus, repo, quarantined = asyncio.run(scenario())
+
+    assert {n.message for n in repo.list_notifications()} == {"ok", "flaky"}
+    assert [(m.body, m.headers["x-attempt"]) for m in quarantined] == [
+        (b"not json", 1), (json.dumps({"type": "payment_complete", "payment_id": "broken", "message": "broken"}).encode(), 3),
+    ]
+    assert "storage unavailable" in quarantined[1].headers["x-error"]
+    assert bus.queue_depth(QUEUE_NAME) == 0
+    assert NOTIFICATION_RETRIES._value.get() - retries_before == 3  # flaky: 1, broken: 2
+    assert NOTIFICATIONS_DEAD_LETTERED.labels(reason="poison")._value.get() - poison_before == 1
+    assert NOTIFICATION_DLQ_DEPTH._value.get() == 2
+
+
+def test_seen_set_bounds_window_and_persistence(tmp_path, monkeypatch):
+    """Seen-set evicts the least recent ids by size and by age and survives a restart"""
+    import time
+    from app.consumers.dedup import SeenSet, message_key
+
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    path = str(tmp_path / "seen.bin")
+
+    seen = SeenSet(max_items=3, window=60, path=path)
+    for i in range(4):
+        seen.add(message_key(f"m{i}"))
+    assert message_key("m0") not in seen and message_key("m1") in seen
+    assert len(seen) == 3
+
+    now[0] += 30
+    seen.add(message_key("m4"))
+    seen.close()
+    with open(path, "ab") as f:
+        f.write(b"\x00" * 5)  # недописанная запись
+
+    now[0] += 40
+    restored = SeenSet(max_items=3, window=60, path=path)
+    assert [message_key(f"m{i}") in restored for i in range(5)] == [False, False, False, False, True]
+    restored.close()
+
+
+def test_seen_set_file_is_owned_by_one_instance(tmp_path):
+    """A second seen-set on the same path keeps ids in memory and leaves the owner's file intact"""
+    from app.consumers.dedup import SeenSet, message_key
+
+    path = str(tmp_path / "seen.bin")
+    owner = SeenSet(max_items=2, window=60, path=path)
+    other = SeenSet(max_items=2, window=60, path=path)
+    assert owner.path == path and other.path is None
+
+    owner.add(message_key("a"))
+    for i in range(10):
+        other.add(message_key(f"other{i}"))  # сжатие у владельца не перетирается
+        owner.add(message_key(f"owner{i}"))
+    assert message_key("other9") in other and message_key("other9") not in owner
+    owner.close()
+    other.close()
+
+    restored = SeenSet(max_items=2, window=60, path=path)
+    assert restored.path == path
+    assert [message_key(k) in restored for k in ("owner8", "owner9", "other9")] == [True, True, False]
+    restored.close()
+
+
+def test_consumer_drops_duplicate_deliveries():
+    """A message id processed once is acked and skipped when delivered again"""
+    import asyncio
+    import json
+    from app.consumers.notification_consumer import NotificationConsumer
+    from app.metrics import NOTIFICATION_DUPLICATES
+    from app.repositories.local_notification_repo import NotificationRepo
+
+    duplicates_before = NOTIFICATION_DUPLICATES._value.get()
+
+    async def scenario():
+        consumer = NotificationConsumer()
+        consumer.notification_service.repo = repo = NotificationRepo()
+        acks = []
+        body = json.dumps({"type": "payment_complete", "payment_id": "p1", "message": "done"}).encode()
+        for tag, message_id in enumerate(["payment_complete:p1", "payment_complete:p1", None, None], start=1):
+            await consumer.dispatch(FakeMessage(tag, body, acks=acks, message_id=message_id))
+        await consumer.drain()
+        return repo, acks
+
+    repo, acks = asyncio.run(scenario())
+
+    assert len(repo) == 3  # без message_id дедупликации нет
+    assert acks == [(4, True)]
+    assert NOTIFICATION_DUPLICATES._value.get() - duplicates_before == 1
+
+
+def test_payment_event_encodings_and_schema_check():
+    """Binary and JSON payment events round-trip; malformed events are rejected"""
+    import json
+    from app.payment_events import (
+        PaymentEvent, InvalidEvent, CONTENT_TYPE_BINARY, CONTENT_TYPE_JSON, encode_event, decode_binary,
+    )
+
+    event = PaymentEvent("payment_complete", uuid4())
+    content_type, body = encode_event(event, "binary")
+    assert (content_type, len(body)) == (CONTENT_TYPE_BINARY, 18)
+    assert decode_binary(body) == event
+    content_type, body = encode_event(event, "json")
+    assert content_type == CONTENT_TYPE_JSON
+    assert PaymentEvent.from_dict(json.loads(body)) == event
+
+    binary = encode_event(event, "binary")[1]
+    for bad in (b"", b"\x02" + binary[1:], binary[:-1], binary[:1] + b"\x63" + binary[2:]):
+        with pytest.raises(InvalidEvent):
+            decode_binary(bad)
+    for bad in ({"v": 2, "type": "payment_complete", "payment_id": str(event.payment_id)},
+                {"v": 1, "type": "order_placed", "payment_id": str(event.payment_id)},
+                {"v": 1, "type": "payment_complete", "payment_id": "nope"}, ["payment_complete"]):
+        with pytest.raises(InvalidEvent):
+            PaymentEvent.from_dict(bad)
+
+
+def test_consumer_negotiates_event_format():
+    """The consumer decodes binary and versioned JSON events by content type and still accepts legacy JSON"""
+    import asyncio
+    import json
+    from app.consumers.notification_consumer import NotificationConsumer
+    from app.consumers.retry import PoisonMessage
+    from app.models.notification import NotificationType
+    from app.payment_events import PaymentEvent, encode_event
+
+    event = PaymentEvent("payment_complete", uuid4())
+    expected = (NotificationType.PAYMENT_COMPLETE, f"Payment {event.payment_id} completed successfully")
+    legacy = json.dumps({"type": "payment_complete", "payment_id": str(event.payment_id), "message": "custom"}).encode()
+
+    assert NotificationConsumer.parse_message(*reversed(encode_event(event, "binary"))) == expected
+    assert NotificationConsumer.parse_message(*reversed(encode_event(event, "json"))) == expected
+    assert NotificationConsumer.parse_message(legacy, None) == (NotificationType.PAYMENT_COMPLETE, "custom")
+    assert NotificationConsumer.parse_message(legacy, "application/json; charset=utf-8")[1] == "custom"
+    assert NotificationConsumer._ordering_key(*reversed(encode_event(event, "binary"))) == str(event.payment_id)
+
+    consumer = NotificationConsumer()
+    with pytest.raises(PoisonMessage):
+        asyncio.run(consumer.process_message(legacy, "text/xml"))
+    with pytest.raises(PoisonMessage):
+        asyncio.run(consumer.process_message(b"\x01\x01", "application/vnd.payment-event"))
+
+
+def test_notification_repo_indexes_and_lookup():
+    """Lookup by UUID and filtering through the type/recipient indexes"""
+    from app.repositories.local_notification_repo import NotificationRepo
+    from app.models.notification import Notification, NotificationType
+
+    repo = NotificationRepo(max_items=10)
+    first = repo.create_notification(Notification(id=uuid4(), type=NotificationType.ORDER_PLACED, message="1", recipient="a"))
+    second = repo.create_notification(Notification(id=uuid4(), type=NotificationType.PAYMENT_COMPLETE, message="2", recipient="a"))
+    third = repo.create_notification(Notification(id=uuid4(), type=NotificationType.PAYMENT_COMPLETE, message="3"))
+
+    assert repo.get_notification(second.id) is second
+    assert repo.list_notifications() == [first, second, third]
+    assert repo.list_notifications(type=NotificationType.PAYMENT_COMPLETE) == [second, third]
+    assert repo.list_notifications(recipient="a") == [first, second]
+    assert repo.list_notifications(type=NotificationType.PAYMENT_COMPLETE, recipient="a") == [second]
+    assert repo.list_notifications(limit=1) == [first]
+
+    with pytest.raises(KeyError):
+        repo.get_notification(uuid4())
+
+
+def test_notification_repo_lru_and_ttl_eviction():
+    """Size cap evicts the least recently read notification, TTL drops old ones"""
+    from datetime import timedelta
+    from app.repositories.local_notification_repo import NotificationRepo
+    from app.models.notification import Notification, NotificationType
+
+    repo = NotificationRepo(max_items=2)
+    first = repo.create_notification(Notification(id=uuid4(), type=NotificationType.ORDER_PLACED, message="1"))
+    second = repo.create_notification(Notification(id=uuid4(), type=NotificationType.ORDER_PLACED, message="2"))
+    repo.get_notification(first.id)
+    third = repo.create_notification(Notification(id=uuid4(), type=NotificationType.ORDER_PLACED, message="3"))
+
+    assert repo.list_notifications() == [first, third]
+    assert repo.list_notifications(type=NotificationType.ORDER_PLACED) == [first, third]
+
+    repo = NotificationRepo(max_items=10, ttl_seconds=60)
+    repo.create_notification(Notification(
+        id=uuid4(), type=NotificationType.ORDER_PLACED, message="old",
+        created_at=datetime.utcnow() - timedelta(minutes=5)
+    ))
+    fresh = repo.create_notification(Notification(id=uuid4(), type=NotificationType.ORDER_PLACED, message="new"))
+
+    assert repo.list_notifications() == [fresh]
+    assert len(repo) == 1
+
+
+def test_sqlite_notification_repo_persists_and_filters(tmp_path):
+    """SQLite repo survives reopen and filters by type/recipient"""
+    from app.repositories.sqlite_notification_repo import SQLiteNotificationRepo
+    from app.models.notification import Notification, NotificationType
+
+    path = str(tmp_path / "notifications.db")
+    repo = SQLiteNotificationRepo(path)
+    first = repo.create_notification(Notification(id=uuid4(), type=NotificationType.ORDER_PLACED, message="1", recipient="a"))
+    second = repo.create_notification(Notification(id=uuid4(), type=NotificationType.PAYMENT_COMPLETE, message="2", recipient="a"))
+    repo.close()
+
+    repo = SQLiteNotificationRepo(path)
+    try:
+        assert repo.get_notification(first.id) == first
+        assert repo.list_notifications() == [first, second]
+        assert repo.list_notifications(type=NotificationType.PAYMENT_COMPLETE) == [second]
+        assert repo.list_notifications(recipient="a", limit=1) == [first]
+        with pytest.raises(KeyError):
+            repo.get_notification(uuid4())
+    finally:
+        repo.close()
+
+
+def test_sqlite_notification_repo_group_commit(tmp_path):
+    """Buffered writes are committed by count, timer or close, become readable only then, and resolve their futures"""
+    import time
+    import sqlite3
+    from app.repositories.sqlite_notification_repo import SQLiteNotificationRepo
+    from app.models.notification import Notification, NotificationType
+
+    path = str(tmp_path / "notifications.db")
+
+    def committed():
+        with sqlite3.connect(path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM notifications").fetchone()[0]
+
+    repo = SQLiteNotificationRepo(path, flush_batch_size=3, flush_interval=60)
+    created = [Notification(id=uuid4(), type=NotificationType.ORDER_PLACED, message=str(i)) for i in range(3)]
+    futures = [repo.create_notification(n, buffered=True) for n in created[:2]]
+    assert committed() == 0
+    assert not any(f.done() for f in futures)
+    # Чтение не форсирует коммит буфера и видит только зафиксированное
+    assert repo.list_notifications() == [] and len(repo) == 0
+    with pytest.raises(KeyError):
+        repo.get_notification(created[0].id)
+    assert committed() == 0
+
+    futures.append(repo.create_notification(created[2], buffered=True))
+    assert [f.result(timeout=5) for f in futures] == created
+    assert committed() == 3
+    assert repo.get_notification(created[0].id) == created[0]
+
+    repo.create_notification(Notification(id=uuid4(), type=NotificationType.ORDER_PLACED, message="3"), buffered=True)
+    repo.close()
+    assert committed() == 4
+
+    repo = SQLiteNotificationRepo(path, flush_batch_size=100, flush_interval=0.05)
+    try:
+        repo.create_notification(Notification(id=uuid4(), type=NotificationType.ORDER_PLACED, message="4"), buffered=True)
+        deadline = time.monotonic() + 5
+        while committed() < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert committed() == 5
+    finally:
+        repo.close()
+
+
+def test_consumer_acks_only_after_store_commit(tmp_path):
+    """A message is acked after its notification is committed; a failed commit sends it to retry instead"""
+    import asyncio
+    import json
+    import sqlite3
+    from app.consumers.notification_consumer import NotificationConsumer
+    from app.consumers.dedup import message_key
+    from app.repositories.sqlite_notification_repo import SQLiteNotificationRepo
+
+    class RecordingTransport:
+        def __init__(self):
+            self.retries = []
+
+        async def publish_retry(self, message, headers, delay_ms):
+            self.retries.append((message.delivery_tag, headers["x-attempt"]))
+
+    body = json.dumps({"type": "payment_complete", "payment_id": "p1", "message": "done"}).encode()
+
+    async def scenario():
+        transport = RecordingTransport()
+        consumer = NotificationConsumer(transport)
+        consumer.notification_service.repo = repo = SQLiteNotificationRepo(
+            str(tmp_path / "notifications.db"), flush_batch_size=100, flush_interval=60
+        )
+        acks = []
+        await consumer.dispatch(FakeMessage(1, body, acks=acks, message_id="m1"))
+        await asyncio.sleep(0.01)
+        await consumer._acker.flush()
+        assert acks == []  # уведомление еще в буфере
+
+        await asyncio.to_thread(repo.flush)
+        await consumer.drain()
+        assert acks == [(1, True)]
+
+        def failing_write(notifications):
+            raise sqlite3.OperationalError("disk I/O error")
+
+        repo._write = failing_write
+        await consumer.dispatch(FakeMessage(2, body.replace(b"p1", b"p2"), acks=acks, message_id="m2"))
+        await asyncio.sleep(0.01)
+        try:
+            await asyncio.to_thread(repo.flush)
+        except sqlite3.Error:
+            pass
+        await consumer.drain()
+        repo._write = SQLiteNotificationRepo._write.__get__(repo)
+        count = len(repo)
+        repo.close()
+        return acks, transport.retries, count, consumer.seen
+
+    acks, retries, count, seen = asyncio.run(scenario())
+
+    assert retries == [(2, 2)]
+    assert acks == [(1, True), (2, True)]  # оригинал подтвержден только после публикации повтора
+    assert count == 1
+    assert message_key("m1") in seen and message_key("m2") not in seen  # повтор m2 не будет отброшен
+
+
+def test_list_notification_dicts_match_model_json(tmp_path):
+    """Fast list path serializes to the same JSON as the pydantic model"""
+    import json
+    from datetime import timedelta
+    from app.repositories.local_notification_repo import NotificationRepo
+    from app.repositories.sqlite_notification_repo import SQLiteNotificationRepo
+    from app.models.notification import Notification, NotificationType
+
+    created_at = datetime(2024, 1, 1, 12, 0, 0)
+    notifications = [
+        Notification(id=uuid4(), type=NotificationType.ORDER_PLACED, message="1", recipient="a", created_at=created_at),
+        Notification(id=uuid4(), type=NotificationType.PAYMENT_COMPLETE, message="2",
+                     created_at=created_at + timedelta(microseconds=1500)),
+    ]
+    expected = [json.loads(n.model_dump_json()) for n in notifications]
+
+    sqlite_repo = SQLiteNotificationRepo(str(tmp_path / "notifications.db"))
+    try:
+        for repo in (NotificationRepo(), sqlite_repo):
+            for n in notifications:
+                repo.create_notification(n)
+            assert json.loads(repo.list_notifications_json()) == expected
+            assert json.loads(repo.list_notifications_json(recipient="a")) == expected[:1]
+    finally:
+        sqlite_repo.close()
@@ -0,0 +1,30 @@
+import aio_pika
+from app.clients.publisher import MessagePublisher, EXCHANGE_NAME, QUEUE_NAME
+from app.inprocess_bus import InProcessBus, get_bus
+from app.metrics import PUBLISH_BATCH_SIZE
+
+
+class InProcessClient(MessagePublisher):
+    """Публикатор в брокер процесса (app.inprocess_bus) вместо RabbitMQ.
+
+    Публикация синхронно кладет сообщения в очереди (и в журнал, если он включен),
+    поэтому подтверждается сразу и без пакетирования.
+    """
+
+    def __init__(self, bus: InProcessBus | None = None):
+        self.bus = bus if bus is not None else get_bus()
+
+    async def start(self):
+        # Как и RabbitMQClient, объявляем очередь сами: сообщения не теряются до старта consumer
+        self.bus.declare_queue(QUEUE_NAME, EXCHANGE_NAME)
+
+    async def publish(self, messages: list[aio_pika.Message], return_exceptions: bool = False) -> list:
+        await self.start()
+        try:
+            self.bus.publish(EXCHANGE_NAME, messages)
+        except OSError as e:  # запись в журнал
+            if not return_exceptions:
+                raise
+            return [e] * len(messages)
+        PUBLISH_BATCH_SIZE.observe(len(messages))
+        return [None] * len(messages)
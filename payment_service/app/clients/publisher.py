@@ -0,0 +1,83 @@
+import os
+import logging
+import aio_pika
+from abc import ABC, abstractmethod
+from uuid import UUID
+from app.payment_events import PaymentEvent, PAYMENT_EVENT_ENCODING, encode_event
+
+logger = logging.getLogger(__name__)
+
+# Транспорт уведомлений: rabbitmq или inprocess — брокер в памяти процесса (app.inprocess_bus)
+# для локальных запусков и тестов, когда оба сервиса работают в одном процессе
+MESSAGE_TRANSPORT = os.getenv("MESSAGE_TRANSPORT", "rabbitmq")
+
+EXCHANGE_NAME = "notifications"
+QUEUE_NAME = "payment_notifications"
+
+
+def build_notification_body(payment_id: UUID, message_type: str = "payment_complete") -> dict:
+    """Событие для outbox (JSON-схема app.payment_events)"""
+    return PaymentEvent(message_type, payment_id).to_dict()
+
+
+def build_event_message(event: PaymentEvent, encoding: str = PAYMENT_EVENT_ENCODING) -> aio_pika.Message:
+    """Сообщение в формате PAYMENT_EVENT_ENCODING; message_id одинаков при любой повторной публикации"""
+    content_type, body = encode_event(event, encoding)
+    return aio_pika.Message(
+        body=body,
+        content_type=content_type,
+        message_id=event.message_id,
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+    )
+
+
+def build_notification_message(payment_id: UUID, message_type: str = "payment_complete") -> aio_pika.Message:
+    return build_event_message(PaymentEvent(message_type, payment_id))
+
+
+class MessagePublisher(ABC):
+    """Публикатор уведомлений в exchange EXCHANGE_NAME.
+
+    Сообщения описываются aio_pika.Message независимо от транспорта: in-process брокер
+    берет из них тело и свойства (headers, message_id, content_type).
+    """
+
+    async def start(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, messages: list[aio_pika.Message], return_exceptions: bool = False) -> list:
+        """Публикация с подтверждением; с return_exceptions=True — результат по каждому сообщению"""
+
+    async def close(self):
+        pass
+
+    async def send_payment_notification(self, payment_id: UUID, message_type: str = "payment_complete"):
+        """Отправка сообщения о успешном платеже"""
+        try:
+            await self.publish([build_notification_message(payment_id, message_type)])
+            logger.info(f"Notification sent for payment {payment_id}")
+
+        except Exception as e:
+            logger.error(f"Failed to send notification for payment {payment_id}: {e}")
+            # Не выбрасываем исключение, чтобы не ломать основной процесс
+
+    async def send_payment_notifications(self, payment_ids: list[UUID], message_type: str = "payment_complete"):
+        """Отправка уведомлений по пачке платежей"""
+        try:
+            await self.publish([build_notification_message(payment_id, message_type) for payment_id in payment_ids])
+            logger.info(f"Notifications sent for {len(payment_ids)} payments")
+
+        except Exception as e:
+            logger.error(f"Failed to send notifications for {len(payment_ids)} payments: {e}")
+
+
+def create_publisher() -> MessagePublisher:
+    """Публикатор по MESSAGE_TRANSPORT"""
+    if MESSAGE_TRANSPORT == "rabbitmq":
+        from app.clients.rabbitmq_client import RabbitMQClient
+        return RabbitMQClient()
+    if MESSAGE_TRANSPORT == "inprocess":
+        from app.clients.inprocess_client import InProcessClient
+        return InProcessClient()
+    raise ValueError(f"Unknown MESSAGE_TRANSPORT: {MESSAGE_TRANSPORT}")
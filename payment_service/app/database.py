@@ -1,11 +1,126 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import os
+import tempfile
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./payments.db"
+from app.metrics import DB_CONNECTIONS, DB_POOL_OVERFLOW
+from app.migrations import migrate, MIGRATION_BATCH_SIZE
+from app.process_lock import ProcessLock
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./payments.db")
+ASYNC_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL", SQLALCHEMY_DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
 )
+
+# Бэкенд репозитория для PaymentService: async (AsyncSession + aiosqlite) или sync
+DB_BACKEND = os.getenv("PAYMENT_DB_BACKEND", "async")
+
+# Настройки пула соединений
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# PRAGMA, выставляемые на каждом новом соединении SQLite
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+}
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def report_pool_status(*engines: Engine):
+    """Выставляет метрики занятых соединений и переполнения пулов.
+
+    Единственный источник этих метрик: в multiprocess-режиме значение процесса — один файл,
+    и учет по событиям checkout/checkin перетирался бы этим снимком между опросами.
+    """
+    pools = [e.pool for e in engines if isinstance(e.pool, QueuePool)]
+    DB_CONNECTIONS.set(sum(p.checkedout() for p in pools))
+    DB_POOL_OVERFLOW.set(sum(max(p.overflow(), 0) for p in pools))
+
+
+def instrument_engine(engine: Engine):
+    """PRAGMA SQLite на каждом новом соединении; метрики пула — report_pool_status"""
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", set_sqlite_pragmas)
+
+
+def create_db_engine(url: str = SQLALCHEMY_DATABASE_URL) -> Engine:
+    """Создание движка с пулом соединений и тюнингом SQLite"""
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    instrument_engine(engine)
+    return engine
+
+
+def create_async_db_engine(url: str = ASYNC_DATABASE_URL) -> AsyncEngine:
+    """Асинхронный движок с теми же настройками пула и PRAGMA"""
+    engine = create_async_engine(
+        url,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_db_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
+
+
+def process_lock(name: str) -> ProcessLock:
+    """Блокировка, общая для всех процессов, работающих с этой БД (файл рядом с ней)"""
+    database = engine.url.database
+    if engine.dialect.name == "sqlite" and database and database != ":memory:":
+        path = f"{database}.{name}.lock"
+    else:
+        path = os.path.join(tempfile.gettempdir(), f"payment_service.{name}.lock")
+    return ProcessLock(path)
+
+
+def init_db(batch_size: int = MIGRATION_BATCH_SIZE):
+    """Миграции и создание недостающих таблиц; воркеры стартуют одновременно, поэтому под межпроцессной блокировкой"""
+    with process_lock("schema"):
+        migrate(engine, batch_size)
+        Base.metadata.create_all(bind=engine)
+
+
+def get_db():
+    """Сессия БД на время запроса, всегда закрывается по его завершении"""
+    db: Session = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """Асинхронная сессия БД на время запроса"""
+    async with AsyncSessionLocal() as db:
+        yield db
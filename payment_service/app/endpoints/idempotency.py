@@ -0,0 +1,72 @@
+import json
+from typing import Any, Awaitable, Callable
+from fastapi import Header, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from app.services.idempotency import (
+    IdempotencyStore, IdempotencyKeyReused, IdempotencyInProgress, StoredResponse, request_fingerprint, MAX_KEY_LENGTH,
+)
+from app.metrics import IDEMPOTENT_REQUESTS
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+def render(content: Any) -> str:
+    """JSON как у JSONResponse FastAPI"""
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def to_response(stored: StoredResponse, replayed: bool = False) -> Response:
+    headers = {REPLAYED_HEADER: "true"} if replayed else None
+    return Response(stored.body, status_code=stored.status_code, media_type="application/json", headers=headers)
+
+
+class IdempotentCall:
+    """Выполнение обработчика запроса с учетом заголовка Idempotency-Key.
+
+    Без заголовка обработчик просто вызывается. С ним ответ (успешный или 4xx) сохраняется,
+    и повтор с тем же ключом получает его, не вызывая обработчик. 5xx и исключения
+    ключ освобождают: такой запрос повтор выполнит заново.
+    """
+
+    def __init__(self, store: IdempotencyStore, request: Request, key: str | None):
+        self.store = store
+        self.request = request
+        self.key = key
+
+    async def run(self, handler: Callable[[], Awaitable[Any]]) -> Any:
+        if self.key is None:
+            return await handler()
+
+        fingerprint = request_fingerprint(self.request.method, self.request.url.path, await self.request.body())
+        try:
+            stored = await self.store.begin(self.key, fingerprint)
+        except IdempotencyKeyReused:
+            IDEMPOTENT_REQUESTS.labels(result="mismatch").inc()
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        except IdempotencyInProgress:
+            IDEMPOTENT_REQUESTS.labels(result="in_progress").inc()
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        if stored is not None:
+            IDEMPOTENT_REQUESTS.labels(result="replayed").inc()
+            return to_response(stored, replayed=True)
+
+        try:
+            stored = StoredResponse(200, render(await handler()))
+        except HTTPException as e:
+            if e.status_code >= 500:
+                await self.store.release(self.key)
+                raise
+            stored = StoredResponse(e.status_code, render({"detail": e.detail}))
+        except BaseException:
+            await self.store.release(self.key)
+            raise
+        await self.store.complete(self.key, stored)
+        IDEMPOTENT_REQUESTS.labels(result="executed").inc()
+        return to_response(stored)
+
+
+def get_idempotent_call(
+    request: Request,
+    idempotency_key: str | None = Header(None, min_length=1, max_length=MAX_KEY_LENGTH),
+) -> IdempotentCall:
+    return IdempotentCall(request.app.state.idempotency_store, request, idempotency_key)
@@ -1,54 +1,166 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from uuid import UUID
-from app.services.payment_service import PaymentService, CreatePaymentRequest
-from app.models.payment import Payment
+from datetime import datetime
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db, get_async_db, DB_BACKEND
+from app.repositories.db_payment_repo import PaymentRepo
+from app.repositories.async_db_payment_repo import AsyncPaymentRepo
+from app.services.outbox_relay import OutboxRelay
+from app.services.payment_cache import PaymentCache
+from app.services.payment_service import PaymentService, CreatePaymentRequest, ProcessPaymentItem, BatchProcessResult
+from app.models.payment import Payment, PaymentStatus
+from app.endpoints.idempotency import IdempotentCall, get_idempotent_call
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-def get_service() -> PaymentService:
-    return PaymentService()
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+MAX_BATCH_SIZE = 1000
 
-@router.get("/", response_model=list[Payment])
-def list_payments(service: PaymentService = Depends(get_service)):
-    return service.list_payments()
+def get_outbox_relay(request: Request) -> OutboxRelay:
+    return request.app.state.outbox_relay
 
-@router.post("/", response_model=Payment)
-def create_payment(req: CreatePaymentRequest, service: PaymentService = Depends(get_service)):
-    return service.create_payment(amount=req.amount, currency=req.currency or "USD")
+def get_payment_cache(request: Request) -> PaymentCache | None:
+    return request.app.state.payment_cache
 
-@router.post("/{payment_id}/process", response_model=Payment)
-async def process_payment(payment_id: UUID, success: bool = Body(embed=True), service: PaymentService = Depends(get_service)):
+# Бэкенд БД выбирается при старте через PAYMENT_DB_BACKEND
+if DB_BACKEND == "sync":
+    def get_service(
+        db: Session = Depends(get_db),
+        outbox_relay: OutboxRelay = Depends(get_outbox_relay),
+        cache: PaymentCache | None = Depends(get_payment_cache),
+    ) -> PaymentService:
+        return PaymentService(PaymentRepo(db), outbox_relay, cache)
+else:
+    def get_service(
+        db: AsyncSession = Depends(get_async_db),
+        outbox_relay: OutboxRelay = Depends(get_outbox_relay),
+        cache: PaymentCache | None = Depends(get_payment_cache),
+    ) -> PaymentService:
+        return PaymentService(AsyncPaymentRepo(db), outbox_relay, cache)
+
+@router.get("/", response_model=list[Payment])
+async def list_payments(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    status: PaymentStatus | None = None,
+    currency: str | None = None,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+    stream: bool = False,
+    service: PaymentService = Depends(get_service),
+):
+    filters = dict(status=status, currency=currency, created_from=created_from, created_to=created_to)
     try:
-        result = await service.process_payment(payment_id, success)
-        logger.info(f"Payment {payment_id} processed successfully")
-        return result
-    except KeyError:
-        logger.error(f"Payment {payment_id} not found")
-        raise HTTPException(status_code=404, detail="Payment not found")
+        # Потоковая выдача всей выборки в NDJSON вместо постраничной
+        if stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+            return StreamingResponse(service.stream_payments(cursor=cursor, **filters), media_type=NDJSON_MEDIA_TYPE)
+
+        payments, next_cursor = await service.list_payment_dicts(limit=limit, cursor=cursor, **filters)
     except ValueError as e:
-        logger.error(f"Value error processing payment {payment_id}: {e}")
         raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        logger.error(f"Internal server error processing payment {payment_id}: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+    # Строки из БД уже соответствуют Payment: ответ сериализуется orjson напрямую,
+    # без повторной валидации по response_model (она остается для схемы OpenAPI)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return ORJSONResponse(payments, headers=headers)
 
-@router.post("/{payment_id}/refund", response_model=Payment)
-def request_refund(payment_id: UUID, service: PaymentService = Depends(get_service)):
+@router.post("/", response_model=Payment)
+async def create_payment(
+    req: CreatePaymentRequest,
+    service: PaymentService = Depends(get_service),
+    idempotent: IdempotentCall = Depends(get_idempotent_call),
+):
+    return await idempotent.run(lambda: service.create_payment(amount=req.amount, currency=req.currency or "USD"))
+
+@router.post("/batch", response_model=list[Payment])
+async def create_payments(
+    items: list[CreatePaymentRequest] = Body(min_length=1, max_length=MAX_BATCH_SIZE),
+    service: PaymentService = Depends(get_service),
+    idempotent: IdempotentCall = Depends(get_idempotent_call),
+):
+    return await idempotent.run(lambda: service.create_payments(items))
+
+@router.post("/batch/process", response_model=list[BatchProcessResult])
+async def process_payments(
+    items: list[ProcessPaymentItem] = Body(min_length=1, max_length=MAX_BATCH_SIZE),
+    service: PaymentService = Depends(get_service),
+    idempotent: IdempotentCall = Depends(get_idempotent_call),
+):
+    async def handle():
+        try:
+            return await service.process_payments(items)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return await idempotent.run(handle)
+
+@router.get("/{payment_id}", response_model=Payment)
+async def get_payment(payment_id: UUID, service: PaymentService = Depends(get_service)):
     try:
-        return service.request_refund(payment_id)
+        return await service.get_payment(payment_id)
     except KeyError:
         raise HTTPException(status_code=404, detail="Payment not found")
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/{payment_id}/process", response_model=Payment)
+async def process_payment(
+    payment_id: UUID,
+    success: bool = Body(embed=True),
+    service: PaymentService = Depends(get_service),
+    idempotent: IdempotentCall = Depends(get_idempotent_call),
+):
+    async def handle():
+        try:
+            result = await service.process_payment(payment_id, success)
+            logger.info(f"Payment {payment_id} processed successfully")
+            return result
+        except KeyError:
+            logger.error(f"Payment {payment_id} not found")
+            raise HTTPException(status_code=404, detail="Payment not found")
+        except ValueError as e:
+            logger.error(f"Value error processing payment {payment_id}: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.error(f"Internal server error processing payment {payment_id}: {e}")
+            raise HTTPException(status_code=500, detail="Internal server error")
+
+    return await idempotent.run(handle)
+
+@router.post("/{payment_id}/refund", response_model=Payment)
+async def request_refund(
+    payment_id: UUID,
+    service: PaymentService = Depends(get_service),
+    idempotent: IdempotentCall = Depends(get_idempotent_call),
+):
+    async def handle():
+        try:
+            return await service.request_refund(payment_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return await idempotent.run(handle)
 
 @router.post("/{payment_id}/refund/complete", response_model=Payment)
-def complete_refund(payment_id: UUID, success: bool = Body(embed=True), service: PaymentService = Depends(get_service)):
-    try:
-        return service.complete_refund(payment_id, success)
-    except KeyError:
-        raise HTTPException(status_code=404, detail="Payment not found")
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+async def complete_refund(
+    payment_id: UUID,
+    success: bool = Body(embed=True),
+    service: PaymentService = Depends(get_service),
+    idempotent: IdempotentCall = Depends(get_idempotent_call),
+):
+    async def handle():
+        try:
+            return await service.complete_refund(payment_id, success)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return await idempotent.run(handle)
@@ -0,0 +1,333 @@
+"""
+Брокер сообщений в памяти процесса — замена RabbitMQ для локальных запусков и тестов.
+
+Повторяет нужную сервисам часть модели AMQP: fanout-exchange, очереди, delivery tag
+в пределах подписки (канала), prefetch, ack(multiple)/nack/reject, очереди с TTL, из
+которых истекшие сообщения уходят в другую очередь (dead-letter). С INPROCESS_BUS_PATH
+сообщения пишутся в журнал и переживают перезапуск процесса: неподтвержденные
+доставляются заново. Без fsync — от падения ОС журнал не защищает.
+
+Модуль одинаков в обоих сервисах и не зависит от их кода: при запуске сервисов в одном
+процессе (benchmarks/local_stack.py) они используют один экземпляр модуля и общий брокер.
+"""
+import os
+import json
+import base64
+import asyncio
+import time
+import logging
+import itertools
+from collections import deque
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+INPROCESS_BUS_PATH = os.getenv("INPROCESS_BUS_PATH", "")
+# Журнал переписывается только с неподтвержденными сообщениями, когда подтвержденных больше
+INPROCESS_BUS_COMPACT_THRESHOLD = int(os.getenv("INPROCESS_BUS_COMPACT_THRESHOLD", "10000"))
+
+
+@dataclass
+class Envelope:
+    id: int
+    queue: str
+    body: bytes
+    headers: dict
+    message_id: str | None = None
+    content_type: str | None = None
+    redelivered: bool = False
+    expires_at: float | None = None  # time.time() истечения TTL очереди
+
+    def to_record(self) -> dict:
+        return {
+            "op": "publish", "id": self.id, "queue": self.queue, "body": base64.b64encode(self.body).decode(),
+            "headers": self.headers, "message_id": self.message_id, "content_type": self.content_type,
+            "expires_at": self.expires_at,
+        }
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Envelope":
+        return cls(
+            id=record["id"], queue=record["queue"], body=base64.b64decode(record["body"]), headers=record["headers"],
+            message_id=record["message_id"], content_type=record["content_type"], redelivered=True,
+            expires_at=record.get("expires_at"),
+        )
+
+
+class InProcessMessage:
+    """Доставленное сообщение с интерфейсом aio_pika.IncomingMessage, нужным consumer"""
+
+    def __init__(self, channel: "Subscription", delivery_tag: int, envelope: Envelope):
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.body = envelope.body
+        self.headers = envelope.headers
+        self.message_id = envelope.message_id
+        self.content_type = envelope.content_type
+        self.redelivered = envelope.redelivered
+
+    async def ack(self, multiple: bool = False):
+        self.channel.settle(self.delivery_tag, multiple, requeue=None)
+
+    async def nack(self, multiple: bool = False, requeue: bool = True):
+        self.channel.settle(self.delivery_tag, multiple, requeue=requeue)
+
+    async def reject(self, requeue: bool = False):
+        self.channel.settle(self.delivery_tag, False, requeue=requeue)
+
+
+class Subscription:
+    """Потребитель очереди — аналог канала с prefetch_count: async for выдает сообщения,
+    пока неподтвержденных меньше prefetch_count. При close неподтвержденные
+    возвращаются в начало очереди, как при закрытии канала RabbitMQ."""
+
+    def __init__(self, bus: "InProcessBus", queue: str, prefetch_count: int):
+        self.bus = bus
+        self.queue = queue
+        self.prefetch_count = prefetch_count
+        self.closed = False
+        self._unacked: dict[int, Envelope] = {}
+        self._tags = itertools.count(1)
+        self._wakeup: asyncio.Future | None = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> InProcessMessage:
+        while not self.closed:
+            if len(self._unacked) < self.prefetch_count:
+                envelope = self.bus.take(self.queue)
+                if envelope is not None:
+                    tag = next(self._tags)
+                    self._unacked[tag] = envelope
+                    return InProcessMessage(self, tag, envelope)
+            self._wakeup = asyncio.get_running_loop().create_future()
+            await self._wakeup
+        raise StopAsyncIteration
+
+    def notify(self):
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    def settle(self, delivery_tag: int, multiple: bool, requeue: bool | None):
+        """Подтверждение (requeue=None), возврат в очередь (True) или отбрасывание (False)"""
+        if self.closed:
+            raise RuntimeError("Channel is closed")
+        if delivery_tag not in self._unacked:
+            raise ValueError(f"Unknown delivery tag {delivery_tag}")
+        tags = [t for t in self._unacked if t <= delivery_tag] if multiple else [delivery_tag]
+        envelopes = [self._unacked.pop(t) for t in tags]
+        if requeue:
+            self.bus.requeue(envelopes)
+        else:
+            self.bus.remove(envelopes)
+        self.notify()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.bus.requeue(list(self._unacked.values()))
+        self._unacked.clear()
+        self.bus.unsubscribe(self)
+        self.notify()
+
+
+class InProcessBus:
+    def __init__(self, path: str | None = INPROCESS_BUS_PATH or None,
+                 compact_threshold: int = INPROCESS_BUS_COMPACT_THRESHOLD):
+        self.path = path
+        self.compact_threshold = compact_threshold
+        self._bindings: dict[str, set[str]] = {}
+        self._queues: dict[str, deque[Envelope]] = {}
+        self._subscriptions: dict[str, list[Subscription]] = {}
+        self._ttl: dict[str, tuple[float, str]] = {}  # очередь -> (TTL в секундах, очередь dead-letter)
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._live: dict[int, Envelope] = {}  # все неподтвержденные: в очередях и доставленные
+        self._ids = itertools.count(1)
+        self._journal = None
+        self._removed_since_compact = 0
+        if path:
+            self._restore()
+
+    def declare_queue(self, queue: str, exchange: str | None = None,
+                      message_ttl: float | None = None, dead_letter_queue: str | None = None):
+        """Очередь и ее привязка к fanout-exchange; повторное объявление ничего не меняет.
+
+        С message_ttl (секунды) сообщение, пролежавшее в очереди дольше, переносится
+        в dead_letter_queue (без нее отбрасывается) — как x-message-ttl и
+        x-dead-letter-routing-key в RabbitMQ.
+        """
+        self._queues.setdefault(queue, deque())
+        if exchange is not None:
+            self._bindings.setdefault(exchange, set()).add(queue)
+        if message_ttl is not None and queue not in self._ttl:
+            self._ttl[queue] = (message_ttl, dead_letter_queue)
+            if dead_letter_queue is not None:
+                self.declare_queue(dead_letter_queue)
+            for envelope in self._queues[queue]:
+                if envelope.expires_at is None:
+                    envelope.expires_at = time.time() + message_ttl
+            self._schedule_expiry(queue)
+
+    def publish(self, exchange: str, messages: list):
+        """Копия каждого сообщения (с атрибутами body, headers, message_id, content_type,
+        как у aio_pika.Message) попадает во все очереди exchange; без очередей теряется"""
+        queues = self._bindings.get(exchange, ())
+        self._enqueue([(queue, message) for message in messages for queue in queues])
+
+    def send(self, queue: str, messages: list):
+        """Публикация прямо в очередь, как через default exchange RabbitMQ"""
+        self.declare_queue(queue)
+        self._enqueue([(queue, message) for message in messages])
+
+    def _enqueue(self, routed: list[tuple]):
+        now = time.time()
+        envelopes = [
+            Envelope(next(self._ids), queue, message.body, dict(message.headers or {}),
+                     message.message_id, message.content_type,
+                     expires_at=now + self._ttl[queue][0] if queue in self._ttl else None)
+            for queue, message in routed
+        ]
+        self._write([e.to_record() for e in envelopes])
+        for envelope in envelopes:
+            self._live[envelope.id] = envelope
+            self._queues[envelope.queue].append(envelope)
+        for queue in {e.queue for e in envelopes}:
+            self._wake(queue)
+            self._schedule_expiry(queue)
+
+    def subscribe(self, queue: str, prefetch_count: int = 100) -> Subscription:
+        self.declare_queue(queue)
+        subscription = Subscription(self, queue, prefetch_count)
+        self._subscriptions.setdefault(queue, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.queue, [])
+        if subscription in subscriptions:
+            subscriptions.remove(subscription)
+
+    def take(self, queue: str) -> Envelope | None:
+        messages = self._queues.get(queue)
+        return messages.popleft() if messages else None
+
+    def requeue(self, envelopes: list[Envelope]):
+        for envelope in reversed(envelopes):
+            envelope.redelivered = True
+            self._queues[envelope.queue].appendleft(envelope)
+        for queue in {e.queue for e in envelopes}:
+            self._wake(queue)
+
+    def remove(self, envelopes: list[Envelope]):
+        for envelope in envelopes:
+            self._live.pop(envelope.id, None)
+        self._write([{"op": "ack", "ids": [e.id for e in envelopes]}])
+        self._removed_since_compact += len(envelopes)
+        if self._journal is not None and self._removed_since_compact > max(self.compact_threshold, len(self._live)):
+            self._compact()
+
+    def queue_depth(self, queue: str) -> int:
+        return len(self._queues.get(queue, ()))
+
+    def close(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for subscriptions in list(self._subscriptions.values()):
+            for subscription in list(subscriptions):
+                subscription.close()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _wake(self, queue: str):
+        for subscription in self._subscriptions.get(queue, ()):
+            subscription.notify()
+
+    def _schedule_expiry(self, queue: str):
+        """Таймер на истечение головы очереди; TTL у очереди один, поэтому голова истекает первой"""
+        messages = self._queues.get(queue)
+        if queue not in self._ttl or queue in self._timers or not messages:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # вне event loop — таймер поставит следующая публикация или объявление очереди
+        self._timers[queue] = loop.call_later(max(0.0, messages[0].expires_at - time.time()), self._expire, queue)
+
+    def _expire(self, queue: str):
+        """Перенос истекших сообщений в очередь dead-letter: в журнале — новая публикация и ack старой"""
+        del self._timers[queue]
+        messages, target = self._queues[queue], self._ttl[queue][1]
+        now = time.time()
+        expired = []
+        while messages and messages[0].expires_at <= now:
+            expired.append(messages.popleft())
+        if expired and target is None:
+            self.remove(expired)
+        elif expired:
+            target_ttl = self._ttl.get(target, (None,))[0]
+            moved = [
+                Envelope(next(self._ids), target, e.body, e.headers, e.message_id, e.content_type,
+                         expires_at=now + target_ttl if target_ttl is not None else None)
+                for e in expired
+            ]
+            self._write([e.to_record() for e in moved] + [{"op": "ack", "ids": [e.id for e in expired]}])
+            for old, new in zip(expired, moved):
+                del self._live[old.id]
+                self._live[new.id] = new
+                self._queues[target].append(new)
+            self._wake(target)
+            self._schedule_expiry(target)
+        self._schedule_expiry(queue)
+
+    def _write(self, records: list[dict]):
+        if self._journal is None or not records:
+            return
+        self._journal.write("".join(json.dumps(r) + "\n" for r in records))
+        self._journal.flush()
+
+    def _restore(self):
+        """Чтение журнала: неподтвержденные сообщения возвращаются в свои очереди"""
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"In-process bus journal {self.path}: truncated record skipped")
+                        break
+                    if record["op"] == "publish":
+                        self._live[record["id"]] = Envelope.from_record(record)
+                    else:
+                        for id in record["ids"]:
+                            self._live.pop(id, None)
+        for envelope in self._live.values():
+            self._queues.setdefault(envelope.queue, deque()).append(envelope)
+        self._ids = itertools.count(max(self._live, default=0) + 1)
+        if self._live:
+            logger.info(f"In-process bus: restored {len(self._live)} unacknowledged messages from {self.path}")
+        self._compact()
+
+    def _compact(self):
+        """Переписывает журнал только с неподтвержденными сообщениями"""
+        if self._journal is not None:
+            self._journal.close()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("".join(json.dumps(e.to_record()) + "\n" for e in sorted(self._live.values(), key=lambda e: e.id)))
+        os.replace(tmp_path, self.path)
+        self._journal = open(self.path, "a")
+        self._removed_since_compact = 0
+
+
+_bus: InProcessBus | None = None
+
+
+def get_bus() -> InProcessBus:
+    """Общий брокер процесса (создается при первом обращении)"""
+    global _bus
+    if _bus is None:
+        _bus = InProcessBus()
+    return _bus
@@ -1,60 +1,86 @@
 import logging
-from fastapi import FastAPI, Request, Response
-from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry
-import time
+import asyncio
+from fastapi import FastAPI, Request
 import os
 from pathlib import Path
 
+from app.instrumentation import PrometheusMiddleware, MetricsSnapshot
 from app.endpoints.payment_router import router as payment_router
-from app.database import Base, engine
-from app.metrics import REQUEST_COUNT, REQUEST_LATENCY, PAYMENTS_CREATED, PAYMENTS_PROCESSED, ACTIVE_PAYMENTS, DB_SIZE, \
-    DB_CONNECTIONS
+from app.database import engine, async_engine, report_pool_status, init_db, process_lock
+from app.clients.publisher import create_publisher
+from app.services.outbox_relay import OutboxRelay
+from app.services.payment_cache import create_payment_cache
+from app.services.idempotency import IdempotencyStore
+from app.metrics import DB_SIZE
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-Base.metadata.create_all(bind=engine)
+init_db()
+
+# Период фонового обновления метрик, которые дорого считать во время scrape
+METRICS_COLLECT_INTERVAL = float(os.getenv("METRICS_COLLECT_INTERVAL_SECONDS", "5"))
 
 app = FastAPI(title="Payment Service")
+app.add_middleware(PrometheusMiddleware)
 app.include_router(payment_router, prefix="/api/payments")
+metrics_snapshot = MetricsSnapshot()
 
 
-@app.middleware("http")
-async def monitor_requests(request: Request, call_next):
-    start_time = time.time()
-    method = request.method
-    endpoint = request.url.path
+@app.on_event("startup")
+async def startup_event():
+    # Один публикатор на все приложение: RabbitMQ или брокер процесса (MESSAGE_TRANSPORT)
+    app.state.publisher = create_publisher()
+    await app.state.publisher.start()
 
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
+    # Релей доставляет уведомления из outbox независимо от обработки запросов;
+    # при нескольких воркерах работает только один — владелец блокировки
+    app.state.outbox_relay = OutboxRelay(app.state.publisher, leader_lock=process_lock("outbox-relay"))
+    await app.state.outbox_relay.start()
 
-        # Регистрируем запрос
-        REQUEST_COUNT.labels(method=method, endpoint=endpoint, status=status_code).inc()
-        REQUEST_LATENCY.labels(method=method, endpoint=endpoint).observe(time.time() - start_time)
+    # Кеш платежей для чтения по id (PAYMENT_CACHE), по умолчанию выключен
+    app.state.payment_cache = create_payment_cache()
+    # Хранилище ключей идемпотентности само удаляет ключи старше TTL
+    app.state.idempotency_store = IdempotencyStore()
+    await app.state.idempotency_store.start()
+
+    app.state.metrics_collector = asyncio.create_task(collect_db_metrics())
 
-        return response
-    except Exception as e:
-        logger.error(f"Request failed: {e}")
-        REQUEST_COUNT.labels(method=method, endpoint=endpoint, status=500).inc()
-        raise
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.metrics_collector.cancel()
+    await app.state.outbox_relay.stop()
+    await app.state.idempotency_store.stop()
+    if app.state.payment_cache is not None:
+        await app.state.payment_cache.close()
+    await app.state.publisher.close()
+    await async_engine.dispose()
+    engine.dispose()
+    logger.info("Payment Service shutting down")
 
 
 def update_db_metrics():
     """Обновление метрик базы данных"""
     try:
-        db_path = Path("payments.db")
+        db_path = Path(engine.url.database)
         if db_path.exists():
             DB_SIZE.set(db_path.stat().st_size)
 
-        # Здесь можно добавить логику для подсчета активных соединений
-        DB_CONNECTIONS.set(1)  # Простое значение для примера
+        report_pool_status(engine, async_engine.sync_engine)
 
     except Exception as e:
         logger.error(f"Error updating DB metrics: {e}")
 
 
+async def collect_db_metrics():
+    """Фоновое обновление метрик БД, чтобы stat() файла не выполнялся в запросе /metrics"""
+    while True:
+        await asyncio.to_thread(update_db_metrics)
+        await asyncio.sleep(METRICS_COLLECT_INTERVAL)
+
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "payment"}
@@ -66,17 +92,5 @@ async def root():
 
 
 @app.get("/metrics")
-async def metrics():
-    # Обновляем метрики базы данных
-    update_db_metrics()
-
-    registry = CollectorRegistry()
-    registry.register(REQUEST_COUNT)
-    registry.register(REQUEST_LATENCY)
-    registry.register(PAYMENTS_CREATED)
-    registry.register(PAYMENTS_PROCESSED)
-    registry.register(ACTIVE_PAYMENTS)
-    registry.register(DB_SIZE)
-    registry.register(DB_CONNECTIONS)
-
-    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
\ No newline at end of file
+async def metrics(request: Request):
+    return metrics_snapshot.response(request)
@@ -1,48 +1,179 @@
 """
 Metrics for Payment Service
 """
-from prometheus_client import Counter, Histogram, Gauge
+import os
+from prometheus_client import Counter, Histogram, Gauge, CollectorRegistry, multiprocess
+
+# Единый реестр процесса: /metrics отдает его снимок
+REGISTRY = CollectorRegistry()
+
+# При нескольких воркерах значения метрик пишутся в файлы этого каталога и суммируются
+# при экспозиции; multiprocess_mode у Gauge задает способ агрегации между воркерами
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
 
 # Создаем метрики Prometheus
 REQUEST_COUNT = Counter(
     'http_requests_total',
     'Total HTTP Requests',
-    ['method', 'endpoint', 'status']
+    ['method', 'endpoint', 'status'],
+    registry=REGISTRY
 )
 
 REQUEST_LATENCY = Histogram(
     'http_request_duration_seconds',
     'HTTP request latency in seconds',
-    ['method', 'endpoint']
+    ['method', 'endpoint'],
+    registry=REGISTRY
+)
+
+REQUEST_SIZE = Histogram(
+    'http_request_size_bytes',
+    'HTTP request body size in bytes',
+    ['method', 'endpoint'],
+    buckets=(0, 100, 1000, 10_000, 100_000, 1_000_000),
+    registry=REGISTRY
+)
+
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes',
+    'HTTP response body size in bytes',
+    ['method', 'endpoint'],
+    buckets=(0, 100, 1000, 10_000, 100_000, 1_000_000, 10_000_000),
+    registry=REGISTRY
+)
+
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress',
+    'Number of HTTP requests being processed',
+    ['method'],
+    multiprocess_mode='livesum',
+    registry=REGISTRY
 )
 
 PAYMENTS_CREATED = Counter(
     'payments_created_total',
-    'Total number of payments created'
+    'Total number of payments created',
+    registry=REGISTRY
 )
 
 PAYMENTS_PROCESSED = Counter(
     'payments_processed_total',
     'Total number of payments processed',
-    ['status']
+    ['status'],
+    registry=REGISTRY
 )
 
+# Каждый воркер хранит свой прирост (+1 при создании, -1 при выходе из CREATED), livesum
+# складывает их по живым процессам. С завершением воркера его вклад пропадает, и сумма
+# расходится до перезапуска всех воркеров; точное число — payments_by_status из sqlite-exporter.
 ACTIVE_PAYMENTS = Gauge(
     'active_payments',
-    'Number of active payments'
+    'Number of payments in CREATED status (sum of per-worker deltas, drifts when a worker restarts)',
+    multiprocess_mode='livesum',
+    registry=REGISTRY
+)
+
+PUBLISH_BATCH_SIZE = Histogram(
+    'rabbitmq_publish_batch_size',
+    'Number of messages published to RabbitMQ per batch',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+    registry=REGISTRY
+)
+
+# Transactional outbox
+OUTBOX_DEPTH = Gauge(
+    'outbox_pending_events',
+    'Number of outbox events not yet published',
+    multiprocess_mode='livemax',
+    registry=REGISTRY
+)
+
+OUTBOX_LAG = Gauge(
+    'outbox_lag_seconds',
+    'Age of the oldest unpublished outbox event in seconds',
+    multiprocess_mode='livemax',
+    registry=REGISTRY
+)
+
+OUTBOX_PUBLISHED = Counter(
+    'outbox_published_total',
+    'Total number of outbox events published to RabbitMQ',
+    registry=REGISTRY
+)
+
+OUTBOX_FAILED = Counter(
+    'outbox_failed_total',
+    'Total number of undecodable outbox events moved to outbox_failed',
+    registry=REGISTRY
+)
+
+# Кеш платежей (PAYMENT_CACHE)
+PAYMENT_CACHE_HITS = Counter(
+    'payment_cache_hits_total',
+    'Payment lookups served from the cache',
+    registry=REGISTRY
+)
+
+PAYMENT_CACHE_MISSES = Counter(
+    'payment_cache_misses_total',
+    'Payment lookups that went to the database',
+    registry=REGISTRY
+)
+
+PAYMENT_CACHE_EVICTIONS = Counter(
+    'payment_cache_evictions_total',
+    'Payments removed from the cache by the size limit or TTL',
+    ['reason'],
+    registry=REGISTRY
+)
+
+PAYMENT_CACHE_SIZE = Gauge(
+    'payment_cache_entries',
+    'Number of payments held in the cache',
+    multiprocess_mode='livesum',
+    registry=REGISTRY
+)
+
+IDEMPOTENT_REQUESTS = Counter(
+    'idempotent_requests_total',
+    'Requests with an Idempotency-Key header by outcome',
+    ['result'],
+    registry=REGISTRY
 )
 
 # SQLite метрики
 DB_SIZE = Gauge(
     'sqlite_db_size_bytes',
-    'SQLite database size in bytes'
+    'SQLite database size in bytes',
+    multiprocess_mode='livemax',
+    registry=REGISTRY
 )
 
 DB_CONNECTIONS = Gauge(
     'sqlite_active_connections',
-    'Number of active SQLite connections'
+    'Number of active SQLite connections',
+    multiprocess_mode='livesum',
+    registry=REGISTRY
 )
 
+DB_POOL_OVERFLOW = Gauge(
+    'sqlite_pool_overflow_connections',
+    'Number of SQLite connections opened above the pool size',
+    multiprocess_mode='livesum',
+    registry=REGISTRY
+)
+
+def exposition_registry() -> CollectorRegistry:
+    """Реестр для /metrics: в multiprocess-режиме — агрегат метрик всех воркеров"""
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
 # Функция для получения метрик
 def get_payment_metrics():
     return {
@@ -0,0 +1,225 @@
+"""
+Миграции схемы SQLite без Alembic: версия схемы хранится в PRAGMA user_version,
+миграции применяются по порядку, каждая ровно один раз.
+
+Новая БД сразу создается в актуальной схеме (create_all) и помечается последней версией.
+У миграции две части: backfill переносит данные пачками, фиксируя каждую, и может
+идти параллельно с работающим сервисом; apply выполняется в одной транзакции вместе
+с записью версии. Прерванный backfill продолжается с места остановки.
+
+init_db применяет миграции при старте. На большой БД backfill лучше прогнать заранее,
+пока работает прежняя версия сервиса, тогда при старте останется только короткий apply:
+
+    python -m app.migrations --backfill-only --batch-size 20000
+    python -m app.migrations
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from typing import Callable, NamedTuple
+from uuid import UUID
+
+from sqlalchemy.engine import Engine
+
+from app.models.money import to_minor_units
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "5000"))
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Connection], None]
+    backfill: Callable[[sqlite3.Connection, int], None] | None = None
+
+
+# DDL в миграциях зафиксирован: модели будут меняться, а применённые миграции — нет
+
+def add_query_indexes(conn: sqlite3.Connection):
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_payments_status_created_at ON payments (status, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_payments_currency_created_at ON payments (currency, created_at)")
+
+
+COMPACT_PAYMENTS_TABLE = """
+CREATE TABLE IF NOT EXISTS payments_compact (
+    id BLOB NOT NULL,
+    amount_minor INTEGER NOT NULL,
+    currency VARCHAR NOT NULL,
+    status VARCHAR(16) NOT NULL,
+    created_at DATETIME,
+    PRIMARY KEY (id)
+)
+"""
+
+# rowid сохраняется: на него опираются отметки sqlite-exporter и журнал статусов
+COPY_PAYMENTS = """
+INSERT INTO payments_compact (rowid, id, amount_minor, currency, status, created_at)
+SELECT rowid, uuid_blob(id), minor_units(amount, currency), currency, status, created_at
+FROM payments
+WHERE rowid > (SELECT coalesce(max(rowid), 0) FROM payments_compact)
+ORDER BY rowid
+LIMIT ?
+"""
+
+STATUS_LOG_TABLE = """
+CREATE TABLE payment_status_log (
+    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    payment_rowid INTEGER NOT NULL,
+    payment_id BLOB NOT NULL,
+    currency VARCHAR NOT NULL,
+    amount_minor INTEGER NOT NULL,
+    old_status VARCHAR NOT NULL,
+    new_status VARCHAR NOT NULL,
+    changed_at DATETIME NOT NULL
+)
+"""
+
+STATUS_LOG_TRIGGER = """
+CREATE TRIGGER trg_payments_status_log
+AFTER UPDATE OF status ON payments
+WHEN OLD.status IS NOT NEW.status
+BEGIN
+    INSERT INTO payment_status_log (payment_rowid, payment_id, currency, amount_minor, old_status, new_status, changed_at)
+    VALUES (NEW.rowid, NEW.id, NEW.currency, NEW.amount_minor, OLD.status, NEW.status,
+            strftime('%Y-%m-%d %H:%M:%f', 'now'));
+END
+"""
+
+
+def register_functions(conn: sqlite3.Connection):
+    conn.create_function("uuid_blob", 1, lambda value: UUID(value).bytes, deterministic=True)
+    conn.create_function("minor_units", 2, to_minor_units, deterministic=True)
+
+
+def copy_payments_batches(conn: sqlite3.Connection, batch_size: int):
+    """Перенос платежей в payments_compact пачками, каждая — отдельная транзакция"""
+    conn.execute(COMPACT_PAYMENTS_TABLE)
+    register_functions(conn)
+    total = conn.execute("SELECT count(*) FROM payments").fetchone()[0]
+    copied = conn.execute("SELECT count(*) FROM payments_compact").fetchone()[0]
+    while True:
+        rows = conn.execute(COPY_PAYMENTS, (batch_size,)).rowcount
+        if rows <= 0:
+            break
+        copied += rows
+        logger.info("Backfilled %d/%d payments", copied, total)
+
+
+def swap_compact_payments(conn: sqlite3.Connection):
+    """Дозаливка, подмена таблицы payments и пересоздание индексов, журнала и триггера"""
+    conn.execute(COMPACT_PAYMENTS_TABLE)
+    register_functions(conn)
+    conn.execute(COPY_PAYMENTS, (-1,))
+    # Из изменяемых полей у платежа только статус: подтягиваем смены, прошедшие после backfill
+    conn.execute("""
+        UPDATE payments_compact SET status = p.status
+        FROM payments AS p
+        WHERE p.rowid = payments_compact.rowid AND p.status IS NOT payments_compact.status
+    """)
+    conn.execute("DROP TRIGGER IF EXISTS trg_payments_status_log")
+    conn.execute("DROP TABLE payments")
+    conn.execute("ALTER TABLE payments_compact RENAME TO payments")
+    conn.execute("CREATE INDEX ix_payments_created_at_id ON payments (created_at, id)")
+    add_query_indexes(conn)
+
+    # Журнал пересоздается пустым: sqlite-exporter при смене версии схемы пересчитывает агрегаты
+    conn.execute("DROP TABLE IF EXISTS payment_status_log")
+    conn.execute(STATUS_LOG_TABLE)
+    conn.execute("CREATE INDEX ix_payment_status_log_changed_at ON payment_status_log (changed_at)")
+    conn.execute(STATUS_LOG_TRIGGER)
+
+
+MIGRATIONS = [
+    Migration(1, "payments (status, created_at) and (currency, created_at) indexes", add_query_indexes),
+    Migration(2, "payments: 16-byte BLOB ids, integer minor-unit amounts", swap_compact_payments, copy_payments_batches),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+
+def run_migrations(
+    conn: sqlite3.Connection, batch_size: int = MIGRATION_BATCH_SIZE, backfill_only: bool = False
+) -> list[int]:
+    """Применяет недостающие миграции; conn — в режиме autocommit (isolation_level=None).
+
+    Возвращает номера примененных миграций.
+    """
+    if not has_table(conn, "payments"):
+        # Пустая БД: таблицы в актуальной схеме создаст create_all
+        conn.execute(f"PRAGMA user_version = {LATEST_VERSION}")
+        return []
+
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= schema_version(conn):
+            continue
+        started = time.perf_counter()
+        if migration.backfill is not None:
+            logger.info("Backfilling migration %d: %s", migration.version, migration.description)
+            migration.backfill(conn, batch_size)
+        if backfill_only:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration.apply(conn)
+            conn.execute(f"PRAGMA user_version = {migration.version}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        applied.append(migration.version)
+        logger.info(
+            "Applied migration %d (%s) in %.2fs", migration.version, migration.description,
+            time.perf_counter() - started,
+        )
+    return applied
+
+
+def migrate(engine: Engine, batch_size: int = MIGRATION_BATCH_SIZE, backfill_only: bool = False) -> list[int]:
+    """run_migrations на соединении из пула engine (только SQLite)"""
+    if engine.dialect.name != "sqlite":
+        return []
+    connection = engine.raw_connection()
+    try:
+        conn = connection.driver_connection
+        isolation_level = conn.isolation_level
+        conn.isolation_level = None
+        try:
+            return run_migrations(conn, batch_size, backfill_only)
+        finally:
+            conn.isolation_level = isolation_level
+    finally:
+        connection.close()
+
+
+def main():
+    from app.database import engine, init_db, process_lock
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument("--backfill-only", action="store_true", help="copy data without switching the schema")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.backfill_only:
+        with process_lock("schema"):
+            migrate(engine, args.batch_size, backfill_only=True)
+    else:
+        init_db(batch_size=args.batch_size)
+    with engine.connect() as conn:
+        logger.info("Schema version: %d", conn.exec_driver_sql("PRAGMA user_version").scalar())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+# Число знаков дробной части по ISO 4217 для валют, где оно отличается от 2
+CURRENCY_EXPONENTS = {
+    "BIF": 0, "CLP": 0, "DJF": 0, "GNF": 0, "ISK": 0, "JPY": 0, "KMF": 0, "KRW": 0, "PYG": 0,
+    "RWF": 0, "UGX": 0, "UYI": 0, "VND": 0, "VUV": 0, "XAF": 0, "XOF": 0, "XPF": 0,
+    "BHD": 3, "IQD": 3, "JOD": 3, "KWD": 3, "LYD": 3, "OMR": 3, "TND": 3,
+}
+DEFAULT_EXPONENT = 2
+# Сумма хранится в INTEGER SQLite (8 байт со знаком)
+MAX_MINOR_UNITS = 2 ** 63 - 1
+
+
+def currency_exponent(currency: str) -> int:
+    return CURRENCY_EXPONENTS.get(currency, DEFAULT_EXPONENT)
+
+
+def to_minor_units(amount: float, currency: str) -> int:
+    """Сумма в минимальных единицах валюты (центах и т.п.), с округлением до них"""
+    exponent = currency_exponent(currency)
+    return int(Decimal(str(amount)).scaleb(exponent).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor_units(amount_minor: int, currency: str) -> float:
+    return amount_minor / 10 ** currency_exponent(currency)
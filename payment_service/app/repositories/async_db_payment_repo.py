@@ -0,0 +1,115 @@
+from typing import AsyncIterator, Iterable
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.payment import Payment, PaymentStatus
+from app.repositories.db_payment_repo import (
+    build_payments_query, build_payment_dicts_query, build_transition_query, build_bulk_transition_query, build_existing_ids_query,
+    build_outbox_rows, build_prune_status_log_query, chunked, group_by_status, to_payment, to_payment_dict, to_row,
+    as_stored,
+    OutboxEventFactory,
+)
+from app.schemas.outbox_schema import OutboxDB
+from app.schemas.payment_schema import PaymentDB
+from uuid import UUID
+from datetime import datetime
+
+
+class AsyncPaymentRepo:
+    """Асинхронный аналог PaymentRepo поверх AsyncSession (aiosqlite)"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_payments(self, limit: int | None = None, cursor: str | None = None, **filters) -> list[Payment]:
+        query = build_payments_query(cursor=cursor, **filters)
+        if limit is not None:
+            query = query.limit(limit)
+        return [to_payment(r) for r in await self.db.scalars(query)]
+
+    async def get_payment_dicts(self, limit: int | None = None, cursor: str | None = None, **filters) -> list[dict]:
+        query = build_payment_dicts_query(cursor=cursor, **filters)
+        if limit is not None:
+            query = query.limit(limit)
+        return [to_payment_dict(r) for r in await self.db.execute(query)]
+
+    async def iter_payments(self, cursor: str | None = None, batch_size: int = 1000, **filters) -> AsyncIterator[list[Payment]]:
+        """Потоковое чтение платежей пачками по batch_size строк (yield_per)"""
+        query = build_payments_query(cursor=cursor, **filters).execution_options(yield_per=batch_size)
+        result = await self.db.stream_scalars(query)
+        async for partition in result.partitions():
+            yield [to_payment(r) for r in partition]
+
+    async def iter_payment_dicts(self, cursor: str | None = None, batch_size: int = 1000, **filters) -> AsyncIterator[list[dict]]:
+        query = build_payment_dicts_query(cursor=cursor, **filters).execution_options(yield_per=batch_size)
+        result = await self.db.stream(query)
+        async for partition in result.partitions():
+            yield [to_payment_dict(r) for r in partition]
+
+    async def get_payment_by_id(self, id: UUID) -> Payment:
+        record = await self.db.scalar(select(PaymentDB).where(PaymentDB.id == id))
+        if not record:
+            raise KeyError("Payment not found")
+        return to_payment(record)
+
+    async def create_payment(self, payment: Payment) -> Payment:
+        row = to_row(payment)
+        self.db.add(PaymentDB(**row))
+        await self.db.commit()
+        return as_stored(payment, row)
+
+    async def create_payments(self, payments: list[Payment]) -> list[Payment]:
+        """Вставка пачки платежей одним executemany в одной транзакции"""
+        rows = [to_row(p) for p in payments]
+        if rows:
+            await self.db.execute(insert(PaymentDB), rows)
+            await self.db.commit()
+        return [as_stored(p, row) for p, row in zip(payments, rows)]
+
+    async def update_status(self, payment: Payment) -> Payment:
+        record = await self.db.scalar(select(PaymentDB).where(PaymentDB.id == payment.id))
+        if not record:
+            raise KeyError("Payment not found")
+        record.status = payment.status
+        await self.db.commit()
+        return payment
+
+    async def add_outbox_events(self, payments: Iterable[Payment], outbox_event: OutboxEventFactory | None):
+        """Запись событий в outbox в текущей транзакции"""
+        rows = build_outbox_rows(payments, outbox_event)
+        if rows:
+            await self.db.execute(insert(OutboxDB), rows)
+
+    async def transition(
+        self, id: UUID, expected: PaymentStatus, new: PaymentStatus, outbox_event: OutboxEventFactory | None = None
+    ) -> Payment | None:
+        """Атомарный перевод платежа из статуса expected в new (см. PaymentRepo.transition)"""
+        record = (await self.db.scalars(build_transition_query(id, expected, new))).first()
+        payment = to_payment(record) if record else None
+        if payment is not None:
+            await self.add_outbox_events([payment], outbox_event)
+        await self.db.commit()
+        if payment is None and await self.db.get(PaymentDB, id) is None:
+            raise KeyError("Payment not found")
+        return payment
+
+    async def transition_many(
+        self, targets: dict[UUID, PaymentStatus], expected: PaymentStatus, outbox_event: OutboxEventFactory | None = None
+    ) -> tuple[dict[UUID, Payment], set[UUID]]:
+        """Пакетный transition в одной транзакции (см. PaymentRepo.transition_many)"""
+        updated: dict[UUID, Payment] = {}
+        for new, ids in group_by_status(targets).items():
+            for chunk in chunked(ids):
+                for record in await self.db.scalars(build_bulk_transition_query(chunk, expected, new)):
+                    updated[record.id] = to_payment(record)
+
+        skipped: set[UUID] = set()
+        for chunk in chunked([id for id in targets if id not in updated]):
+            skipped.update(await self.db.scalars(build_existing_ids_query(chunk)))
+        await self.add_outbox_events(updated.values(), outbox_event)
+        await self.db.commit()
+        return updated, skipped
+
+    async def prune_status_log(self, before: datetime) -> int:
+        result = await self.db.execute(build_prune_status_log_query(before))
+        await self.db.commit()
+        return result.rowcount
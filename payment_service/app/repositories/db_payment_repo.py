@@ -1,54 +1,272 @@
+import base64
+import json
+from datetime import datetime
+from typing import Callable, Iterable, Iterator
+from sqlalchemy import select, insert, update, delete, and_, or_
 from sqlalchemy.orm import Session
 from app.database import SessionLocal
 from app.models.payment import Payment, PaymentStatus
+from app.models.money import to_minor_units, from_minor_units
 from app.schemas.payment_schema import PaymentDB
+from app.schemas.outbox_schema import OutboxDB
+from app.schemas.payment_status_log_schema import PaymentStatusLogDB
 from uuid import UUID
 
+# Размер пачки id в IN (...) для пакетных операций
+BATCH_CHUNK_SIZE = 500
+
+# Колонки для быстрого пути списков (to_payment_dict)
+PAYMENT_COLUMNS = (PaymentDB.id, PaymentDB.amount_minor, PaymentDB.currency, PaymentDB.status, PaymentDB.created_at)
+
+# Событие для outbox по обновленному платежу (None — событие не нужно)
+OutboxEventFactory = Callable[[Payment], dict | None]
+
+
+def encode_cursor(payment: Payment) -> str:
+    """Кодирует позицию (created_at, id) последней записи страницы в непрозрачный курсор"""
+    return encode_cursor_position(payment.created_at, payment.id)
+
+
+def encode_cursor_position(created_at: datetime, id: UUID) -> str:
+    raw = json.dumps([created_at.isoformat(), str(id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), UUID(id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def build_payments_query(
+    cursor: str | None = None,
+    status: PaymentStatus | None = None,
+    currency: str | None = None,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+):
+    """Запрос списка платежей с фильтрами и keyset-пагинацией по (created_at, id)"""
+    query = select(PaymentDB)
+    if status is not None:
+        query = query.where(PaymentDB.status == status)
+    if currency is not None:
+        query = query.where(PaymentDB.currency == currency)
+    if created_from is not None:
+        query = query.where(PaymentDB.created_at >= created_from)
+    if created_to is not None:
+        query = query.where(PaymentDB.created_at < created_to)
+    if cursor is not None:
+        last_created_at, last_id = decode_cursor(cursor)
+        query = query.where(or_(
+            PaymentDB.created_at > last_created_at,
+            and_(PaymentDB.created_at == last_created_at, PaymentDB.id > last_id),
+        ))
+    return query.order_by(PaymentDB.created_at, PaymentDB.id)
+
+
+def build_payment_dicts_query(cursor: str | None = None, **filters):
+    """build_payments_query только по колонкам PAYMENT_COLUMNS: строки без ORM-объектов"""
+    return build_payments_query(cursor=cursor, **filters).with_only_columns(*PAYMENT_COLUMNS)
+
+
+def build_transition_query(id: UUID, expected: PaymentStatus, new: PaymentStatus):
+    """UPDATE ... WHERE id = :id AND status = :expected RETURNING * одним запросом"""
+    return (
+        update(PaymentDB)
+        .where(PaymentDB.id == id, PaymentDB.status == expected)
+        .values(status=new)
+        .returning(PaymentDB)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def build_bulk_transition_query(ids: list[UUID], expected: PaymentStatus, new: PaymentStatus):
+    """То же, что build_transition_query, но для пачки платежей с одинаковым целевым статусом"""
+    return (
+        update(PaymentDB)
+        .where(PaymentDB.id.in_(ids), PaymentDB.status == expected)
+        .values(status=new)
+        .returning(PaymentDB)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def build_existing_ids_query(ids: list[UUID]):
+    return select(PaymentDB.id).where(PaymentDB.id.in_(ids))
+
+
+def chunked(items: list, size: int = BATCH_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def group_by_status(targets: dict[UUID, PaymentStatus]) -> dict[PaymentStatus, list[UUID]]:
+    groups: dict[PaymentStatus, list[UUID]] = {}
+    for id, status in targets.items():
+        groups.setdefault(status, []).append(id)
+    return groups
+
+
+def build_outbox_rows(payments: Iterable[Payment], outbox_event: OutboxEventFactory | None) -> list[dict]:
+    if outbox_event is None:
+        return []
+    created_at = datetime.utcnow()
+    events = (outbox_event(p) for p in payments)
+    return [{"payload": json.dumps(e), "created_at": created_at} for e in events if e is not None]
+
+
+def build_prune_status_log_query(before: datetime):
+    return delete(PaymentStatusLogDB).where(PaymentStatusLogDB.changed_at < before) \
+        .execution_options(synchronize_session=False)
+
+
+def to_row(payment: Payment) -> dict:
+    return {
+        "id": payment.id,
+        "amount_minor": to_minor_units(payment.amount, payment.currency),
+        "currency": payment.currency,
+        "status": payment.status,
+        "created_at": payment.created_at,
+    }
+
+
+def as_stored(payment: Payment, row: dict) -> Payment:
+    """Платеж таким, каким его вернет чтение из БД: сумма округлена до минимальных единиц валюты"""
+    return payment.model_copy(update={"amount": from_minor_units(row["amount_minor"], payment.currency)})
+
+
+def to_payment(record: PaymentDB) -> Payment:
+    return Payment(
+        id=record.id,
+        amount=from_minor_units(record.amount_minor, record.currency),
+        currency=record.currency,
+        status=record.status,
+        created_at=record.created_at
+    )
+
+
+def to_payment_dict(row) -> dict:
+    """Строка по PAYMENT_COLUMNS в dict с полями модели Payment, без ее валидации.
+
+    Данные из БД уже соответствуют модели, поэтому списки отдаются через orjson
+    без создания объектов pydantic (см. payment_router.list_payments).
+    """
+    id, amount_minor, currency, status, created_at = row
+    return {
+        "id": id,
+        "amount": from_minor_units(amount_minor, currency),
+        "currency": currency,
+        "status": status,
+        "created_at": created_at,
+        "invoice_id": None,
+    }
+
+
 class PaymentRepo:
-    def __init__(self):
-        self.db: Session = SessionLocal()
-
-    def get_payments(self) -> list[Payment]:
-        records = self.db.query(PaymentDB).all()
-        return [
-            Payment(
-                id=UUID(r.id),
-                amount=r.amount,
-                currency=r.currency,
-                status=r.status,
-                created_at=r.created_at
-            ) for r in records
-        ]
+    def __init__(self, db: Session | None = None):
+        self.db: Session = db if db is not None else SessionLocal()
+
+    def get_payments(self, limit: int | None = None, cursor: str | None = None, **filters) -> list[Payment]:
+        query = build_payments_query(cursor=cursor, **filters)
+        if limit is not None:
+            query = query.limit(limit)
+        return [to_payment(r) for r in self.db.scalars(query)]
+
+    def get_payment_dicts(self, limit: int | None = None, cursor: str | None = None, **filters) -> list[dict]:
+        """get_payments в виде dict (to_payment_dict) для сериализации без pydantic"""
+        query = build_payment_dicts_query(cursor=cursor, **filters)
+        if limit is not None:
+            query = query.limit(limit)
+        return [to_payment_dict(r) for r in self.db.execute(query)]
+
+    def iter_payments(self, cursor: str | None = None, batch_size: int = 1000, **filters) -> Iterator[list[Payment]]:
+        """Потоковое чтение платежей пачками по batch_size строк (yield_per)"""
+        query = build_payments_query(cursor=cursor, **filters).execution_options(yield_per=batch_size)
+        for partition in self.db.scalars(query).partitions():
+            yield [to_payment(r) for r in partition]
+
+    def iter_payment_dicts(self, cursor: str | None = None, batch_size: int = 1000, **filters) -> Iterator[list[dict]]:
+        query = build_payment_dicts_query(cursor=cursor, **filters).execution_options(yield_per=batch_size)
+        for partition in self.db.execute(query).partitions():
+            yield [to_payment_dict(r) for r in partition]
 
     def get_payment_by_id(self, id: UUID) -> Payment:
-        record = self.db.query(PaymentDB).filter(PaymentDB.id == str(id)).first()
+        record = self.db.query(PaymentDB).filter(PaymentDB.id == id).first()
         if not record:
             raise KeyError("Payment not found")
-        return Payment(
-            id=UUID(record.id),
-            amount=record.amount,
-            currency=record.currency,
-            status=record.status,
-            created_at=record.created_at
-        )
+        return to_payment(record)
 
     def create_payment(self, payment: Payment) -> Payment:
-        db_payment = PaymentDB(
-            id=str(payment.id),
-            amount=payment.amount,
-            currency=payment.currency,
-            status=payment.status,
-            created_at=payment.created_at
-        )
+        row = to_row(payment)
+        db_payment = PaymentDB(**row)
         self.db.add(db_payment)
         self.db.commit()
         self.db.refresh(db_payment)
-        return payment
+        return as_stored(payment, row)
+
+    def create_payments(self, payments: list[Payment]) -> list[Payment]:
+        """Вставка пачки платежей одним executemany в одной транзакции"""
+        rows = [to_row(p) for p in payments]
+        if rows:
+            self.db.execute(insert(PaymentDB), rows)
+            self.db.commit()
+        return [as_stored(p, row) for p, row in zip(payments, rows)]
 
     def update_status(self, payment: Payment) -> Payment:
-        record = self.db.query(PaymentDB).filter(PaymentDB.id == str(payment.id)).first()
+        record = self.db.query(PaymentDB).filter(PaymentDB.id == payment.id).first()
         if not record:
             raise KeyError("Payment not found")
         record.status = payment.status
         self.db.commit()
         return payment
+
+    def add_outbox_events(self, payments: Iterable[Payment], outbox_event: OutboxEventFactory | None):
+        """Запись событий в outbox в текущей транзакции"""
+        rows = build_outbox_rows(payments, outbox_event)
+        if rows:
+            self.db.execute(insert(OutboxDB), rows)
+
+    def transition(
+        self, id: UUID, expected: PaymentStatus, new: PaymentStatus, outbox_event: OutboxEventFactory | None = None
+    ) -> Payment | None:
+        """Атомарный перевод платежа из статуса expected в new.
+
+        Возвращает None, если платеж уже не в статусе expected, и KeyError, если его нет.
+        Событие outbox_event пишется в outbox в той же транзакции.
+        """
+        record = self.db.scalars(build_transition_query(id, expected, new)).first()
+        payment = to_payment(record) if record else None
+        if payment is not None:
+            self.add_outbox_events([payment], outbox_event)
+        self.db.commit()
+        if payment is None and self.db.get(PaymentDB, id) is None:
+            raise KeyError("Payment not found")
+        return payment
+
+    def transition_many(
+        self, targets: dict[UUID, PaymentStatus], expected: PaymentStatus, outbox_event: OutboxEventFactory | None = None
+    ) -> tuple[dict[UUID, Payment], set[UUID]]:
+        """Пакетный transition в одной транзакции.
+
+        Возвращает обновленные платежи и id тех, что существуют, но не в статусе expected.
+        """
+        updated: dict[UUID, Payment] = {}
+        for new, ids in group_by_status(targets).items():
+            for chunk in chunked(ids):
+                for record in self.db.scalars(build_bulk_transition_query(chunk, expected, new)):
+                    updated[record.id] = to_payment(record)
+
+        skipped: set[UUID] = set()
+        for chunk in chunked([id for id in targets if id not in updated]):
+            skipped.update(self.db.scalars(build_existing_ids_query(chunk)))
+        self.add_outbox_events(updated.values(), outbox_event)
+        self.db.commit()
+        return updated, skipped
+
+    def prune_status_log(self, before: datetime) -> int:
+        """Удаление записей журнала статусов старше before"""
+        result = self.db.execute(build_prune_status_log_query(before))
+        self.db.commit()
+        return result.rowcount
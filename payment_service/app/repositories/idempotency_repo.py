@@ -0,0 +1,87 @@
+from datetime import datetime
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.schemas.idempotency_schema import IdempotencyKeyDB
+
+
+class IdempotencyRepo:
+    """Захват ключей идемпотентности и сохранение ответов; каждая операция — своя транзакция"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def acquire(self, key: str, fingerprint: str) -> bool:
+        """Вставка ключа «в работе»; False — ключ уже существует"""
+        now = datetime.utcnow()
+        result = await self.db.execute(
+            insert(IdempotencyKeyDB)
+            .values(key=key, fingerprint=fingerprint, created_at=now, locked_at=now)
+            .on_conflict_do_nothing(index_elements=["key"])
+        )
+        await self.db.commit()
+        return result.rowcount == 1
+
+    async def get(self, key: str) -> IdempotencyKeyDB | None:
+        record = await self.db.scalar(select(IdempotencyKeyDB).where(IdempotencyKeyDB.key == key))
+        await self.db.commit()
+        return record
+
+    async def take_over(self, key: str, locked_at: datetime) -> bool:
+        """Перехват зависшего ключа: удается только одному из конкурентов"""
+        result = await self.db.execute(
+            update(IdempotencyKeyDB)
+            .where(
+                IdempotencyKeyDB.key == key,
+                IdempotencyKeyDB.response_status.is_(None),
+                IdempotencyKeyDB.locked_at == locked_at,
+            )
+            .values(locked_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        await self.db.commit()
+        return result.rowcount == 1
+
+    async def refresh(self, key: str) -> bool:
+        """Продление захвата ключа, пока запрос выполняется; False — ключ уже завершен или удален"""
+        result = await self.db.execute(
+            update(IdempotencyKeyDB)
+            .where(IdempotencyKeyDB.key == key, IdempotencyKeyDB.response_status.is_(None))
+            .values(locked_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        await self.db.commit()
+        return result.rowcount == 1
+
+    async def complete(self, key: str, status: int, body: str):
+        await self.db.execute(
+            update(IdempotencyKeyDB).where(IdempotencyKeyDB.key == key)
+            .values(response_status=status, response_body=body)
+            .execution_options(synchronize_session=False)
+        )
+        await self.db.commit()
+
+    async def release(self, key: str):
+        """Удаление незавершенного ключа, чтобы запрос можно было повторить"""
+        await self.db.execute(
+            delete(IdempotencyKeyDB)
+            .where(IdempotencyKeyDB.key == key, IdempotencyKeyDB.response_status.is_(None))
+            .execution_options(synchronize_session=False)
+        )
+        await self.db.commit()
+
+    async def delete_expired(self, key: str, before: datetime):
+        await self.db.execute(
+            delete(IdempotencyKeyDB)
+            .where(IdempotencyKeyDB.key == key, IdempotencyKeyDB.created_at < before)
+            .execution_options(synchronize_session=False)
+        )
+        await self.db.commit()
+
+    async def prune(self, before: datetime) -> int:
+        result = await self.db.execute(
+            delete(IdempotencyKeyDB).where(IdempotencyKeyDB.created_at < before)
+            .execution_options(synchronize_session=False)
+        )
+        await self.db.commit()
+        return result.rowcount
@@ -0,0 +1,50 @@
+from datetime import datetime
+from sqlalchemy import select, update, delete, func, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.schemas.outbox_schema import OutboxDB, OutboxFailedDB
+
+
+class OutboxRepo:
+    """Чтение и разметка событий outbox для релея"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def fetch_pending(self, limit: int) -> list[OutboxDB]:
+        query = select(OutboxDB).where(OutboxDB.sent_at.is_(None)).order_by(OutboxDB.id).limit(limit)
+        return list(await self.db.scalars(query))
+
+    async def mark_sent(self, ids: list[int]):
+        if ids:
+            await self.db.execute(
+                update(OutboxDB).where(OutboxDB.id.in_(ids)).values(sent_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+        await self.db.commit()
+
+    async def quarantine(self, failed: list[tuple[OutboxDB, str]]):
+        """Перенос событий с ошибкой в outbox_failed; фиксируется вместе с mark_sent"""
+        if not failed:
+            return
+        failed_at = datetime.utcnow()
+        await self.db.execute(insert(OutboxFailedDB), [
+            {"id": e.id, "payload": e.payload, "created_at": e.created_at, "failed_at": failed_at, "error": error}
+            for e, error in failed
+        ])
+        await self.db.execute(
+            delete(OutboxDB).where(OutboxDB.id.in_([e.id for e, _ in failed]))
+            .execution_options(synchronize_session=False)
+        )
+
+    async def pending_stats(self) -> tuple[int, datetime | None]:
+        """Глубина очереди неотправленных событий и время создания самого старого из них"""
+        query = select(func.count(), func.min(OutboxDB.created_at)).where(OutboxDB.sent_at.is_(None))
+        depth, oldest = (await self.db.execute(query)).one()
+        return depth, oldest
+
+    async def prune_sent(self, before: datetime) -> int:
+        result = await self.db.execute(
+            delete(OutboxDB).where(OutboxDB.sent_at < before).execution_options(synchronize_session=False)
+        )
+        await self.db.commit()
+        return result.rowcount
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index
+from datetime import datetime
+from app.database import Base
+
+class IdempotencyKeyDB(Base):
+    """Ответы на запросы с заголовком Idempotency-Key.
+
+    Пока response_status пуст, запрос с этим ключом выполняется: locked_at — время захвата,
+    по нему зависший после падения воркера ключ может перехватить повторный запрос.
+    """
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    response_status = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    # Индекс для очистки ключей старше TTL
+    __table_args__ = (
+        Index("ix_idempotency_keys_created_at", "created_at"),
+    )
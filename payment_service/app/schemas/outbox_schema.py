@@ -0,0 +1,29 @@
+from sqlalchemy import Column, Integer, Text, DateTime, Index, text
+from datetime import datetime
+from app.database import Base
+
+class OutboxDB(Base):
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    # Частичный индекс: релей и метрики читают только неотправленные события;
+    # индекс по sent_at нужен для очистки доставленных
+    __table_args__ = (
+        Index("ix_outbox_pending", "id", sqlite_where=text("sent_at IS NULL")),
+        Index("ix_outbox_sent_at", "sent_at"),
+    )
+
+
+class OutboxFailedDB(Base):
+    """Карантин событий outbox, которые релей не смог разобрать: разбираются вручную и не очищаются"""
+    __tablename__ = "outbox_failed"
+
+    id = Column(Integer, primary_key=True)  # id события в outbox
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    failed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    error = Column(Text, nullable=False)
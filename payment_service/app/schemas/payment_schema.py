@@ -1,15 +1,26 @@
-from sqlalchemy import Column, String, Float, DateTime, Enum
-from sqlalchemy.dialects.sqlite import BLOB
+from sqlalchemy import Column, String, Integer, DateTime, Enum, Index
 from datetime import datetime
 from uuid import uuid4
 from app.database import Base
 from app.models.payment import PaymentStatus
+from app.schemas.types import UUIDBlob
 
 class PaymentDB(Base):
     __tablename__ = "payments"
 
-    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid4()))
-    amount = Column(Float, nullable=False)
+    # id — 16 байт вместо 36-символьной строки, сумма — целое в минимальных единицах валюты
+    # (см. app.models.money); существующие БД переводятся миграцией 2 (app.migrations)
+    id = Column(UUIDBlob, primary_key=True, default=uuid4)
+    amount_minor = Column(Integer, nullable=False)
     currency = Column(String, nullable=False)
     status = Column(Enum(PaymentStatus), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Индекс под keyset-пагинацию списка платежей; (status, created_at) — для поиска
+    # самого старого платежа в статусе и выборок по статусу за период;
+    # (currency, created_at) — для выборок по валюте за период
+    __table_args__ = (
+        Index("ix_payments_created_at_id", "created_at", "id"),
+        Index("ix_payments_status_created_at", "status", "created_at"),
+        Index("ix_payments_currency_created_at", "currency", "created_at"),
+    )
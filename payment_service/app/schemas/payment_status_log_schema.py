@@ -0,0 +1,43 @@
+from sqlalchemy import Column, Integer, String, DateTime, Index, DDL, event
+from app.database import Base
+from app.schemas.types import UUIDBlob
+
+class PaymentStatusLogDB(Base):
+    """Журнал смен статуса платежей; заполняется триггером на payments.
+
+    По нему sqlite-exporter пересчитывает агрегаты инкрементально, читая только
+    записи после своей отметки. payment_rowid связывает запись с rowid платежа.
+    """
+    __tablename__ = "payment_status_log"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    payment_rowid = Column(Integer, nullable=False)
+    payment_id = Column(UUIDBlob, nullable=False)
+    currency = Column(String, nullable=False)
+    amount_minor = Column(Integer, nullable=False)
+    old_status = Column(String, nullable=False)
+    new_status = Column(String, nullable=False)
+    changed_at = Column(DateTime, nullable=False)
+
+    # AUTOINCREMENT: id не переиспользуются после очистки, на них держится отметка экспортера.
+    # Индекс — для очистки старых записей
+    __table_args__ = (
+        Index("ix_payment_status_log_changed_at", "changed_at"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+# Триггер ловит любую смену статуса, в том числе массовые UPDATE в обход ORM.
+# Создается после всех таблиц, поскольку ссылается на payments
+PAYMENT_STATUS_TRIGGER = DDL("""
+CREATE TRIGGER IF NOT EXISTS trg_payments_status_log
+AFTER UPDATE OF status ON payments
+WHEN OLD.status IS NOT NEW.status
+BEGIN
+    INSERT INTO payment_status_log (payment_rowid, payment_id, currency, amount_minor, old_status, new_status, changed_at)
+    VALUES (NEW.rowid, NEW.id, NEW.currency, NEW.amount_minor, OLD.status, NEW.status,
+            strftime('%%Y-%%m-%%d %%H:%%M:%%f', 'now'));
+END
+""").execute_if(dialect="sqlite")
+
+event.listen(Base.metadata, "after_create", PAYMENT_STATUS_TRIGGER)
@@ -0,0 +1,20 @@
+from uuid import UUID
+from sqlalchemy import LargeBinary
+from sqlalchemy.types import TypeDecorator
+
+
+class UUIDBlob(TypeDecorator):
+    """UUID в 16-байтовом BLOB вместо 36-символьной строки.
+
+    Порядок байтов совпадает с порядком hex-строк, так что сортировка по id не меняется.
+    """
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return (value if isinstance(value, UUID) else UUID(str(value))).bytes
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else UUID(bytes=value)
@@ -0,0 +1,186 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from app.database import AsyncSessionLocal
+from app.repositories.idempotency_repo import IdempotencyRepo
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL = timedelta(hours=float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")))
+# Сколько повторный запрос ждет завершения первого, прежде чем получить 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+# Через сколько незавершенный ключ считается брошенным (воркер упал посреди запроса);
+# пока запрос выполняется, захват продлевается каждую треть этого времени
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(seconds=float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT_SECONDS", "60")))
+# Период опроса БД, когда первый запрос выполняется в другом воркере
+IDEMPOTENCY_POLL_INTERVAL = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL_MS", "50")) / 1000
+# Период удаления ключей старше TTL
+IDEMPOTENCY_PRUNE_INTERVAL = float(os.getenv("IDEMPOTENCY_PRUNE_INTERVAL_SECONDS", "60"))
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(Exception):
+    """Ключ уже использован для запроса с другим методом, путем или телом"""
+
+
+class IdempotencyInProgress(Exception):
+    """Первый запрос с этим ключом не завершился за время ожидания"""
+
+
+@dataclass
+class StoredResponse:
+    status_code: int
+    body: str
+
+
+def request_fingerprint(method: str, path: str, body: bytes) -> str:
+    return hashlib.sha256(b"\n".join([method.encode(), path.encode(), body])).hexdigest()
+
+
+class IdempotencyStore:
+    """Ключи идемпотентности в таблице idempotency_keys.
+
+    Первый запрос захватывает ключ вставкой строки и выполняется; повторные получают
+    сохраненный ответ. Дубликат, пришедший во время выполнения первого, ждет его:
+    в том же процессе — по событию, из другого воркера — опрашивая БД.
+
+    Пока обработчик выполняется, владелец продлевает locked_at, поэтому долгий запрос
+    не перехватывается как брошенный. Ограничение: захват ключа, бизнес-транзакция и
+    сохранение ответа — отдельные коммиты. Если процесс упадет после бизнес-транзакции,
+    но до complete, ключ останется незавершенным, и через lock_timeout повтор
+    выполнит запрос еще раз.
+
+    Ключи старше TTL удаляет фоновая задача (start/stop) в каждом воркере: удаление
+    идемпотентно и не зависит от того, какой процесс ведет outbox-релей.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self.ttl = IDEMPOTENCY_TTL
+        self.wait_timeout = IDEMPOTENCY_WAIT_SECONDS
+        self.lock_timeout = IDEMPOTENCY_LOCK_TIMEOUT
+        self.poll_interval = IDEMPOTENCY_POLL_INTERVAL
+        self.prune_interval = IDEMPOTENCY_PRUNE_INTERVAL
+        self._in_flight: dict[str, asyncio.Event] = {}
+        self._heartbeats: dict[str, asyncio.Task] = {}
+        self._prune_task: asyncio.Task | None = None
+
+    async def start(self):
+        self._prune_task = asyncio.create_task(self._prune_loop())
+
+    async def stop(self):
+        if self._prune_task is None:
+            return
+        self._prune_task.cancel()
+        try:
+            await self._prune_task
+        except asyncio.CancelledError:
+            pass
+        self._prune_task = None
+
+    async def prune(self) -> int:
+        """Удаление ключей старше TTL; возвращает число удаленных"""
+        async with self.session_factory() as db:
+            pruned = await IdempotencyRepo(db).prune(datetime.utcnow() - self.ttl)
+        if pruned:
+            logger.info(f"Idempotency: pruned {pruned} expired keys")
+        return pruned
+
+    async def _prune_loop(self):
+        while True:
+            try:
+                await self.prune()
+            except Exception as e:
+                logger.error(f"Idempotency key pruning error: {e}")
+            await asyncio.sleep(self.prune_interval)
+
+    async def begin(self, key: str, fingerprint: str) -> StoredResponse | None:
+        """None — ключ захвачен и запрос нужно выполнить, иначе сохраненный ответ"""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            # Сессия — на одну попытку: ожидающие дубликаты не держат соединения пула
+            async with self.session_factory() as db:
+                owned, stored = await self._attempt(IdempotencyRepo(db), key, fingerprint)
+            if owned:
+                self._in_flight[key] = asyncio.Event()
+                self._heartbeats[key] = asyncio.create_task(self._heartbeat(key))
+                return None
+            if stored is not None:
+                return stored
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise IdempotencyInProgress()
+            await self._wait(key, remaining)
+
+    async def _attempt(self, repo: IdempotencyRepo, key: str, fingerprint: str) -> tuple[bool, StoredResponse | None]:
+        """Захват ключа или сохраненный ответ; (False, None) — первый запрос еще выполняется"""
+        while not await repo.acquire(key, fingerprint):
+            record = await repo.get(key)
+            if record is None:
+                continue  # первый запрос завершился ошибкой и освободил ключ
+            if record.fingerprint != fingerprint:
+                raise IdempotencyKeyReused()
+
+            now = datetime.utcnow()
+            if record.created_at < now - self.ttl:
+                await repo.delete_expired(key, now - self.ttl)
+                continue
+            if record.response_status is not None:
+                return False, StoredResponse(record.response_status, record.response_body)
+            if record.locked_at < now - self.lock_timeout and await repo.take_over(key, record.locked_at):
+                logger.warning(f"Idempotency key {key} was abandoned, taking over")
+                return True, None
+            return False, None
+        return True, None
+
+    async def _wait(self, key: str, timeout: float):
+        event = self._in_flight.get(key)
+        if event is None:
+            await asyncio.sleep(min(timeout, self.poll_interval))
+            return
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def complete(self, key: str, response: StoredResponse):
+        """Сохранение ответа захваченного ключа"""
+        try:
+            async with self.session_factory() as db:
+                await IdempotencyRepo(db).complete(key, response.status_code, response.body)
+        finally:
+            self._finish(key)
+
+    async def release(self, key: str):
+        """Освобождение ключа без ответа (ошибка сервера): повтор выполнится заново"""
+        try:
+            async with self.session_factory() as db:
+                await IdempotencyRepo(db).release(key)
+        finally:
+            self._finish(key)
+
+    async def _heartbeat(self, key: str):
+        """Продление захвата, пока ключ не завершен (отменяется в _finish)"""
+        while True:
+            await asyncio.sleep(self.lock_timeout.total_seconds() / 3)
+            try:
+                async with self.session_factory() as db:
+                    if not await IdempotencyRepo(db).refresh(key):
+                        logger.warning(f"Idempotency key {key} is no longer held by this request")
+                        return
+            except Exception as e:
+                logger.error(f"Idempotency key {key} lock refresh error: {e}")
+
+    def _finish(self, key: str):
+        heartbeat = self._heartbeats.pop(key, None)
+        if heartbeat is not None:
+            heartbeat.cancel()
+        event = self._in_flight.pop(key, None)
+        if event is not None:
+            event.set()
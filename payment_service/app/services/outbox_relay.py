@@ -0,0 +1,152 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from app.database import AsyncSessionLocal
+from app.process_lock import ProcessLock
+from app.repositories.outbox_repo import OutboxRepo
+from app.repositories.async_db_payment_repo import AsyncPaymentRepo
+from app.clients.publisher import MessagePublisher, build_event_message
+from app.payment_events import PaymentEvent, InvalidEvent, PAYMENT_EVENT_ENCODING
+from app.metrics import OUTBOX_DEPTH, OUTBOX_LAG, OUTBOX_PUBLISHED, OUTBOX_FAILED
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxRelay:
+    """Фоновая доставка событий из outbox брокеру (MessagePublisher) пачками с подтверждением.
+
+    С leader_lock события публикует только процесс, захвативший блокировку: иначе
+    релеи разных воркеров отправили бы одни и те же события. Остальные периодически
+    пытаются ее захватить и подхватывают работу, если лидер завершился.
+    """
+
+    def __init__(self, publisher: MessagePublisher, session_factory=AsyncSessionLocal,
+                 leader_lock: ProcessLock | None = None):
+        self.publisher = publisher
+        self.session_factory = session_factory
+        self.leader_lock = leader_lock
+        self.batch_size = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+        self.poll_interval = float(os.getenv("OUTBOX_POLL_INTERVAL_MS", "500")) / 1000
+        self.retention = timedelta(hours=float(os.getenv("OUTBOX_RETENTION_HOURS", "24")))
+        # Журнал статусов нужен sqlite-exporter лишь до следующего цикла сбора
+        self.status_log_retention = timedelta(hours=float(os.getenv("STATUS_LOG_RETENTION_HOURS", "24")))
+        self.prune_interval = 60
+        # Формат событий на проводе: json или binary (app.payment_events)
+        self.event_encoding = PAYMENT_EVENT_ENCODING
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: asyncio.Task | None = None
+        self._last_prune = datetime.min
+
+    async def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info("Outbox relay started")
+
+    async def stop(self, timeout: float = 5):
+        """Остановка после текущей пачки; по таймауту задача отменяется"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        if self.leader_lock is not None:
+            self.leader_lock.release()
+        logger.info("Outbox relay stopped")
+
+    def notify(self):
+        """Будит релей сразу после коммита нового события, не дожидаясь опроса"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            if not self._is_leader():
+                await asyncio.sleep(self.poll_interval)
+                continue
+            try:
+                published = await self.relay_once()
+                await self._maybe_prune()
+            except Exception as e:
+                logger.error(f"Outbox relay error: {e}")
+                published = 0
+
+            if published < self.batch_size and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _is_leader(self) -> bool:
+        if self.leader_lock is None or self.leader_lock.locked:
+            return True
+        if self.leader_lock.acquire(blocking=False):
+            logger.info("Outbox relay: acquired leadership")
+            return True
+        return False
+
+    async def relay_once(self) -> int:
+        """Публикует одну пачку неотправленных событий; возвращает число доставленных"""
+        async with self.session_factory() as db:
+            repo = OutboxRepo(db)
+            events = await repo.fetch_pending(self.batch_size)
+            sent_ids = []
+            if events:
+                # Метрики обновляются и до публикации: при недоступном брокере она может ждать долго
+                await self._report_pending(repo)
+                await db.commit()  # не держим транзакцию и соединение на время публикации
+                decoded, messages, failed = self._build_messages(events)
+                if messages:
+                    results = await self.publisher.publish(messages, return_exceptions=True)
+                    sent_ids = [e.id for e, r in zip(decoded, results) if not isinstance(r, BaseException)]
+                    if len(sent_ids) < len(decoded):
+                        logger.warning(f"Outbox relay: {len(decoded) - len(sent_ids)} events not confirmed, will retry")
+                await repo.quarantine(failed)
+                await repo.mark_sent(sent_ids)
+                OUTBOX_PUBLISHED.inc(len(sent_ids))
+                OUTBOX_FAILED.inc(len(failed))
+
+            await self._report_pending(repo)
+            return len(sent_ids)
+
+    def _build_messages(self, events: list) -> tuple[list, list, list[tuple]]:
+        """Событие из outbox перекодируется в формат PAYMENT_EVENT_ENCODING; message_id постоянен
+        для события: consumer отбросит повторную публикацию.
+
+        Событие, которое не разобрать (битый payload, неизвестный тип), уходит в карантин,
+        а не останавливает пачку: иначе оно выбиралось бы первым снова и снова.
+        """
+        decoded, messages, failed = [], [], []
+        for e in events:
+            try:
+                message = build_event_message(PaymentEvent.from_dict(json.loads(e.payload)), self.event_encoding)
+            except (json.JSONDecodeError, InvalidEvent, KeyError) as error:
+                logger.error(f"Outbox relay: event {e.id} cannot be encoded, moved to outbox_failed: {error!r}")
+                failed.append((e, repr(error)))
+                continue
+            decoded.append(e)
+            messages.append(message)
+        return decoded, messages, failed
+
+    async def _report_pending(self, repo: OutboxRepo):
+        depth, oldest = await repo.pending_stats()
+        OUTBOX_DEPTH.set(depth)
+        OUTBOX_LAG.set((datetime.utcnow() - oldest).total_seconds() if oldest else 0)
+
+    async def _maybe_prune(self):
+        now = datetime.utcnow()
+        if now - self._last_prune < timedelta(seconds=self.prune_interval):
+            return
+        self._last_prune = now
+        async with self.session_factory() as db:
+            pruned = await OutboxRepo(db).prune_sent(now - self.retention)
+            pruned_log = await AsyncPaymentRepo(db).prune_status_log(now - self.status_log_retention)
+        if pruned:
+            logger.info(f"Outbox relay: pruned {pruned} sent events")
+        if pruned_log:
+            logger.info(f"Outbox relay: pruned {pruned_log} payment status log entries")
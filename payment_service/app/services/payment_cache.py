@@ -0,0 +1,103 @@
+import os
+import time
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from uuid import UUID
+from app.models.payment import Payment
+from app.metrics import PAYMENT_CACHE_EVICTIONS, PAYMENT_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Бэкенд кеша платежей: none (выключен) или memory (LRU+TTL в процессе воркера)
+PAYMENT_CACHE = os.getenv("PAYMENT_CACHE", "none")
+PAYMENT_CACHE_MAX_SIZE = int(os.getenv("PAYMENT_CACHE_MAX_SIZE", "10000"))
+PAYMENT_CACHE_TTL_SECONDS = float(os.getenv("PAYMENT_CACHE_TTL_SECONDS", "30"))
+
+
+class PaymentCache(ABC):
+    """Интерфейс кеша платежей по id.
+
+    Методы асинхронные, чтобы за ним мог стоять общий для воркеров кеш (например, Redis).
+    set — запись после изменения платежа, add — заполнение после чтения из БД: оно не
+    перетирает запись, сделанную, пока шло чтение, и устаревший платеж не попадает в кеш.
+    """
+
+    @abstractmethod
+    async def get(self, id: UUID) -> Payment | None: ...
+
+    @abstractmethod
+    async def add(self, payment: Payment): ...
+
+    @abstractmethod
+    async def set(self, payment: Payment): ...
+
+    @abstractmethod
+    async def delete(self, id: UUID): ...
+
+    async def close(self):
+        pass
+
+
+class LRUPaymentCache(PaymentCache):
+    """Кеш в памяти процесса: не больше max_size платежей, каждый живет ttl секунд.
+
+    У каждого воркера gunicorn свой кеш, изменения из других воркеров он увидит
+    только по истечении ttl — от этого и зависит выбор PAYMENT_CACHE_TTL_SECONDS.
+    """
+
+    def __init__(self, max_size: int = PAYMENT_CACHE_MAX_SIZE, ttl: float = PAYMENT_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[UUID, tuple[float, Payment]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    async def get(self, id: UUID) -> Payment | None:
+        item = self._items.get(id)
+        if item is None:
+            return None
+        expires_at, payment = item
+        if expires_at <= time.monotonic():
+            self._remove(id, "ttl")
+            return None
+        self._items.move_to_end(id)
+        return payment
+
+    async def add(self, payment: Payment):
+        if payment.id not in self._items:
+            self._put(payment)
+
+    async def set(self, payment: Payment):
+        self._put(payment)
+
+    async def delete(self, id: UUID):
+        if self._items.pop(id, None) is not None:
+            PAYMENT_CACHE_SIZE.dec()
+
+    def _put(self, payment: Payment):
+        if payment.id not in self._items:
+            PAYMENT_CACHE_SIZE.inc()
+        self._items[payment.id] = (time.monotonic() + self.ttl, payment)
+        self._items.move_to_end(payment.id)
+        while len(self._items) > self.max_size:
+            self._remove(next(iter(self._items)), "size")
+
+    def _remove(self, id: UUID, reason: str):
+        del self._items[id]
+        PAYMENT_CACHE_SIZE.dec()
+        PAYMENT_CACHE_EVICTIONS.labels(reason=reason).inc()
+
+    async def close(self):
+        PAYMENT_CACHE_SIZE.dec(len(self._items))
+        self._items.clear()
+
+
+def create_payment_cache() -> PaymentCache | None:
+    """Кеш по PAYMENT_CACHE; None — кеш выключен"""
+    if PAYMENT_CACHE == "none":
+        return None
+    if PAYMENT_CACHE == "memory":
+        return LRUPaymentCache()
+    raise ValueError(f"Unknown PAYMENT_CACHE backend: {PAYMENT_CACHE}")
@@ -1,29 +1,134 @@
-import os
-import asyncio
+import math
 from uuid import UUID, uuid4
 from datetime import datetime
+import orjson
 from app.models.payment import Payment, PaymentStatus
-from app.repositories.db_payment_repo import PaymentRepo
-from app.clients.rabbitmq_client import RabbitMQClient
-from pydantic import BaseModel
+from app.models.money import currency_exponent, MAX_MINOR_UNITS
+from app.repositories.db_payment_repo import PaymentRepo, encode_cursor, encode_cursor_position, decode_cursor
+from app.repositories.async_db_payment_repo import AsyncPaymentRepo
+from app.clients.publisher import build_notification_body
+from app.services.outbox_relay import OutboxRelay
+from app.services.payment_cache import PaymentCache
+from pydantic import BaseModel, model_validator
+from starlette.concurrency import run_in_threadpool
 
-from app.metrics import PAYMENTS_CREATED, PAYMENTS_PROCESSED, ACTIVE_PAYMENTS
+from app.metrics import (
+    PAYMENTS_CREATED, PAYMENTS_PROCESSED, ACTIVE_PAYMENTS, PAYMENT_CACHE_HITS, PAYMENT_CACHE_MISSES,
+)
 
 
 class CreatePaymentRequest(BaseModel):
+    """Сумма округляется до минимальных единиц валюты; в ответе и при чтении — уже округленная"""
     amount: float
     currency: str | None = "USD"
 
+    @model_validator(mode="after")
+    def check_amount(self):
+        if not math.isfinite(self.amount):
+            raise ValueError("amount must be a finite number")
+        if abs(self.amount) * 10 ** currency_exponent(self.currency or "USD") > MAX_MINOR_UNITS:
+            raise ValueError("amount is out of range for the currency")
+        return self
 
-class PaymentService:
-    def __init__(self):
-        self.repo = PaymentRepo()
-        self.rabbitmq_client = RabbitMQClient()
 
-    def list_payments(self):
-        return self.repo.get_payments()
+class ProcessPaymentItem(BaseModel):
+    id: UUID
+    success: bool
+
+
+class BatchProcessResult(BaseModel):
+    id: UUID
+    ok: bool
+    payment: Payment | None = None
+    error: str | None = None
+
 
-    def create_payment(self, amount: float, currency: str = "USD"):
+def payment_complete_event(payment: Payment) -> dict | None:
+    """Событие для outbox: уведомление отправляется только при успешном платеже"""
+    if payment.status != PaymentStatus.SUCCESS:
+        return None
+    return build_notification_body(payment.id)
+
+
+class PaymentService:
+    def __init__(
+        self,
+        repo: PaymentRepo | AsyncPaymentRepo | None = None,
+        outbox_relay: OutboxRelay | None = None,
+        cache: PaymentCache | None = None,
+    ):
+        self.repo = repo or PaymentRepo()
+        self.is_async = isinstance(self.repo, AsyncPaymentRepo)
+        self.outbox_relay = outbox_relay
+        self.cache = cache
+
+    def _notify_outbox(self):
+        if self.outbox_relay is not None:
+            self.outbox_relay.notify()
+
+    async def _repo_call(self, method: str, *args, **kwargs):
+        """Вызов репозитория: async-бэкенд ожидается напрямую, sync уходит в пул потоков"""
+        func = getattr(self.repo, method)
+        if self.is_async:
+            return await func(*args, **kwargs)
+        return await run_in_threadpool(func, *args, **kwargs)
+
+    async def _cache_written(self, id: UUID, payment: Payment | None):
+        """Обновление кеша после записи; None — платеж не изменен, и его копия в кеше могла устареть"""
+        if self.cache is None:
+            return
+        if payment is not None:
+            await self.cache.set(payment)
+        else:
+            await self.cache.delete(id)
+
+    async def get_payment(self, id: UUID) -> Payment:
+        if self.cache is not None:
+            payment = await self.cache.get(id)
+            if payment is not None:
+                PAYMENT_CACHE_HITS.inc()
+                return payment
+            PAYMENT_CACHE_MISSES.inc()
+        payment = await self._repo_call("get_payment_by_id", id)
+        if self.cache is not None:
+            await self.cache.add(payment)
+        return payment
+
+    async def list_payments(self, limit: int, cursor: str | None = None, **filters):
+        """Страница платежей и курсор следующей страницы (None, если страница последняя)"""
+        payments = await self._repo_call("get_payments", limit=limit + 1, cursor=cursor, **filters)
+        if len(payments) <= limit:
+            return payments, None
+        payments = payments[:limit]
+        return payments, encode_cursor(payments[-1])
+
+    async def list_payment_dicts(self, limit: int, cursor: str | None = None, **filters):
+        """list_payments для быстрого пути: платежи в виде dict (to_payment_dict), без pydantic"""
+        rows = await self._repo_call("get_payment_dicts", limit=limit + 1, cursor=cursor, **filters)
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor_position(rows[-1]["created_at"], rows[-1]["id"])
+
+    def stream_payments(self, cursor: str | None = None, **filters):
+        """Платежи в формате NDJSON, по одному чанку на пачку строк из БД"""
+        if cursor is not None:
+            decode_cursor(cursor)  # невалидный курсор должен дать ошибку до начала ответа
+
+        def to_chunk(batch: list[dict]) -> bytes:
+            return b"".join(orjson.dumps(row) + b"\n" for row in batch)
+
+        async def async_chunks():
+            async for batch in self.repo.iter_payment_dicts(cursor=cursor, **filters):
+                yield to_chunk(batch)
+
+        def sync_chunks():
+            for batch in self.repo.iter_payment_dicts(cursor=cursor, **filters):
+                yield to_chunk(batch)
+
+        return async_chunks() if self.is_async else sync_chunks()
+
+    async def create_payment(self, amount: float, currency: str = "USD"):
         payment = Payment(
             id=uuid4(),
             amount=amount,
@@ -31,7 +136,8 @@ class PaymentService:
             status=PaymentStatus.CREATED,
             created_at=datetime.utcnow()
         )
-        result = self.repo.create_payment(payment)
+        result = await self._repo_call("create_payment", payment)
+        await self._cache_written(result.id, result)
 
         # Обновляем метрики
         PAYMENTS_CREATED.inc()
@@ -39,36 +145,87 @@ class PaymentService:
 
         return result
 
+    async def create_payments(self, requests: list[CreatePaymentRequest]) -> list[Payment]:
+        """Создание пачки платежей в одной транзакции"""
+        created_at = datetime.utcnow()
+        payments = [
+            Payment(
+                id=uuid4(),
+                amount=req.amount,
+                currency=req.currency or "USD",
+                status=PaymentStatus.CREATED,
+                created_at=created_at
+            ) for req in requests
+        ]
+        result = await self._repo_call("create_payments", payments)
+        for payment in result:
+            await self._cache_written(payment.id, payment)
+
+        PAYMENTS_CREATED.inc(len(result))
+        ACTIVE_PAYMENTS.inc(len(result))
+
+        return result
+
+    async def process_payments(self, items: list[ProcessPaymentItem]) -> list[BatchProcessResult]:
+        """Обработка пачки платежей в одной транзакции с результатом по каждому элементу"""
+        targets = {item.id: PaymentStatus.SUCCESS if item.success else PaymentStatus.FAILED for item in items}
+        if len(targets) != len(items):
+            raise ValueError("Duplicate payment ids in batch")
+
+        updated, skipped = await self._repo_call(
+            "transition_many", targets, PaymentStatus.CREATED, outbox_event=payment_complete_event
+        )
+
+        results = []
+        for item in items:
+            payment = updated.get(item.id)
+            await self._cache_written(item.id, payment)
+            if payment is not None:
+                PAYMENTS_PROCESSED.labels(status=payment.status.value).inc()
+                ACTIVE_PAYMENTS.dec()
+                results.append(BatchProcessResult(id=item.id, ok=True, payment=payment))
+            elif item.id in skipped:
+                results.append(BatchProcessResult(
+                    id=item.id, ok=False, error="Payment already processed or not in CREATED state"
+                ))
+            else:
+                results.append(BatchProcessResult(id=item.id, ok=False, error="Payment not found"))
+
+        self._notify_outbox()
+        return results
+
     async def process_payment(self, id: UUID, success: bool):
-        payment = self.repo.get_payment_by_id(id)
-        if payment.status != PaymentStatus.CREATED:
+        new_status = PaymentStatus.SUCCESS if success else PaymentStatus.FAILED
+        # Уведомление пишется в outbox в той же транзакции, что и смена статуса
+        updated_payment = await self._repo_call(
+            "transition", id, PaymentStatus.CREATED, new_status, outbox_event=payment_complete_event
+        )
+        await self._cache_written(id, updated_payment)
+        if updated_payment is None:
             raise ValueError("Payment already processed or not in CREATED state")
 
-        payment.status = PaymentStatus.SUCCESS if success else PaymentStatus.FAILED
-        updated_payment = self.repo.update_status(payment)
-
         # Обновляем метрики
         status_label = "success" if success else "failed"
         PAYMENTS_PROCESSED.labels(status=status_label).inc()
+        # Платеж больше не ожидает обработки
+        ACTIVE_PAYMENTS.dec()
 
-        # Отправляем уведомление в RabbitMQ только при успешном платеже
-        if success and updated_payment.status == PaymentStatus.SUCCESS:
-            asyncio.create_task(
-                self.rabbitmq_client.send_payment_notification(updated_payment.id)
-            )
+        if success:
+            self._notify_outbox()
 
         return updated_payment
 
-    def request_refund(self, id: UUID):
-        payment = self.repo.get_payment_by_id(id)
-        if payment.status != PaymentStatus.SUCCESS:
+    async def request_refund(self, id: UUID):
+        payment = await self._repo_call("transition", id, PaymentStatus.SUCCESS, PaymentStatus.REFUND_REQUESTED)
+        await self._cache_written(id, payment)
+        if payment is None:
             raise ValueError("Can only request refund for successful payments")
-        payment.status = PaymentStatus.REFUND_REQUESTED
-        return self.repo.update_status(payment)
+        return payment
 
-    def complete_refund(self, id: UUID, success: bool):
-        payment = self.repo.get_payment_by_id(id)
-        if payment.status != PaymentStatus.REFUND_REQUESTED:
+    async def complete_refund(self, id: UUID, success: bool):
+        new_status = PaymentStatus.REFUND_DONE if success else PaymentStatus.REFUND_DENIED
+        payment = await self._repo_call("transition", id, PaymentStatus.REFUND_REQUESTED, new_status)
+        await self._cache_written(id, payment)
+        if payment is None:
             raise ValueError("Refund must be requested first")
-        payment.status = PaymentStatus.REFUND_DONE if success else PaymentStatus.REFUND_DENIED
-        return self.repo.update_status(payment)
\ No newline at end of file
+        return payment
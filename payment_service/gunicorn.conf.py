@@ -0,0 +1,29 @@
+"""
+Запуск нескольких воркеров uvicorn под gunicorn: gunicorn -c gunicorn.conf.py app.main:app
+"""
+import os
+import glob
+from prometheus_client import multiprocess
+
+bind = os.getenv("BIND", "0.0.0.0:80")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+def on_starting(server):
+    """Файлы метрик прошлого запуска иначе попали бы в счетчики нового"""
+    if MULTIPROC_DIR:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(MULTIPROC_DIR, "*.db")):
+            os.remove(path)
+    # Кеш в памяти у каждого воркера свой: изменения из соседних воркеров он видит только через TTL
+    if workers > 1 and os.getenv("PAYMENT_CACHE", "none") == "memory":
+        server.log.warning("WEB_CONCURRENCY > 1 with PAYMENT_CACHE=memory; cached payments may be stale for up to the TTL")
+
+def child_exit(server, worker):
+    """Live-gauge завершившегося воркера больше не учитываются"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(worker.pid)
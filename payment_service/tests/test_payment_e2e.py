@@ -1,6 +1,7 @@
 import pytest
 import requests
 import time
+import uuid
 
 BASE_URL = "http://localhost:8001/api/payments"
 
@@ -48,6 +49,40 @@ def test_process_payment():
     data = process_response.json()
     assert data["status"] in ["success", "failed"]
 
+def test_get_payment_by_id():
+    payment_id = requests.post(f"{BASE_URL}/", json={"amount": 75.5}).json()["id"]
+    requests.post(f"{BASE_URL}/{payment_id}/process", json={"success": True})
+
+    response = requests.get(f"{BASE_URL}/{payment_id}")
+
+    assert response.status_code == 200
+    assert response.json()["id"] == payment_id
+    assert response.json()["amount"] == 75.5
+    assert response.json()["status"] == "success"
+
+def test_create_payment_rounds_to_minor_units():
+    key = str(uuid.uuid4())
+    created = requests.post(f"{BASE_URL}/", json={"amount": 12.345, "currency": "USD"}, headers={"Idempotency-Key": key})
+    replayed = requests.post(f"{BASE_URL}/", json={"amount": 12.345, "currency": "USD"}, headers={"Idempotency-Key": key})
+    fetched = requests.get(f"{BASE_URL}/{created.json()['id']}")
+
+    assert created.status_code == 200
+    assert created.json()["amount"] == replayed.json()["amount"] == fetched.json()["amount"] == 12.35
+    assert requests.post(f"{BASE_URL}/", json={"amount": 1e30}).status_code == 422
+
+def test_idempotent_create_payment():
+    key = str(uuid.uuid4())
+    headers = {"Idempotency-Key": key}
+
+    first = requests.post(f"{BASE_URL}/", json={"amount": 20.0}, headers=headers)
+    retry = requests.post(f"{BASE_URL}/", json={"amount": 20.0}, headers=headers)
+    other = requests.post(f"{BASE_URL}/", json={"amount": 21.0}, headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json()["id"] == first.json()["id"]
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert other.status_code == 422
+
 def test_payment_not_found():
     fake_id = "00000000-0000-0000-0000-000000000000"
     response = requests.get(f"{BASE_URL}/{fake_id}")
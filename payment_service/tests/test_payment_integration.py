@@ -9,6 +9,8 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from app.models.payment import Payment, PaymentStatus
 from app.repositories.db_payment_repo import PaymentRepo
 from app.database import Base, engine, SessionLocal
+# Таблицы, которые не подтягивают импорты репозиториев выше, для create_all в фикстуре
+import app.schemas.idempotency_schema  # noqa: F401
 
 
 @pytest.fixture(scope='function')
@@ -164,3 +166,708 @@ def test_payment_created_at_persistence(payment_repo):
     # Проверяем, что время создания сохранилось
     retrieved_payment = payment_repo.get_payment_by_id(payment.id)
     assert retrieved_payment.created_at == specific_time
+
+
+def _create_payments(payment_repo, count, currency="USD"):
+    from datetime import timedelta
+
+    base_time = datetime(2024, 1, 1, 12, 0, 0)
+    payments = [
+        Payment(
+            id=uuid4(),
+            amount=10.0 * (i + 1),
+            currency=currency,
+            status=PaymentStatus.CREATED,
+            created_at=base_time + timedelta(minutes=i)
+        ) for i in range(count)
+    ]
+    for payment in payments:
+        payment_repo.create_payment(payment)
+    return payments
+
+
+# Проверяем keyset-пагинацию: страницы идут по порядку и не пересекаются
+def test_get_payments_keyset_pagination(payment_repo):
+    from app.repositories.db_payment_repo import encode_cursor
+
+    payments = _create_payments(payment_repo, 5)
+
+    first_page = payment_repo.get_payments(limit=2)
+    assert [p.id for p in first_page] == [p.id for p in payments[:2]]
+
+    second_page = payment_repo.get_payments(limit=2, cursor=encode_cursor(first_page[-1]))
+    assert [p.id for p in second_page] == [p.id for p in payments[2:4]]
+
+    last_page = payment_repo.get_payments(limit=2, cursor=encode_cursor(second_page[-1]))
+    assert [p.id for p in last_page] == [payments[4].id]
+
+
+# Проверяем фильтры по статусу, валюте и диапазону created_at
+def test_get_payments_filters(payment_repo):
+    usd = _create_payments(payment_repo, 3)
+    eur = _create_payments(payment_repo, 2, currency="EUR")
+
+    usd[0].status = PaymentStatus.SUCCESS
+    payment_repo.update_status(usd[0])
+
+    assert {p.id for p in payment_repo.get_payments(currency="EUR")} == {p.id for p in eur}
+    assert [p.id for p in payment_repo.get_payments(status=PaymentStatus.SUCCESS)] == [usd[0].id]
+
+    in_range = payment_repo.get_payments(currency="USD", created_from=usd[1].created_at, created_to=usd[2].created_at)
+    assert [p.id for p in in_range] == [usd[1].id]
+
+
+# Невалидный курсор
+def test_get_payments_invalid_cursor(payment_repo):
+    with pytest.raises(ValueError):
+        payment_repo.get_payments(cursor="not-a-cursor")
+
+
+# Проверяем потоковое чтение пачками
+def test_iter_payments_batches(payment_repo):
+    payments = _create_payments(payment_repo, 5)
+
+    batches = list(payment_repo.iter_payments(batch_size=2))
+
+    assert [len(b) for b in batches] == [2, 2, 1]
+    assert [p.id for b in batches for p in b] == [p.id for p in payments]
+
+
+# Быстрый путь списков: dict из БД дают тот же JSON, что и модель Payment, и тот же курсор
+def test_payment_dicts_match_model_json(payment_repo):
+    import json
+    import asyncio
+    import orjson
+    from app.services.payment_service import PaymentService
+
+    payments = _create_payments(payment_repo, 3) + _create_payments(payment_repo, 2, currency="JPY")
+    expected = [json.loads(p.model_dump_json()) for p in payment_repo.get_payments()]
+
+    assert json.loads(orjson.dumps(payment_repo.get_payment_dicts())) == expected
+    assert json.loads(orjson.dumps([r for b in payment_repo.iter_payment_dicts(batch_size=2) for r in b])) == expected
+
+    service = PaymentService(payment_repo)
+    rows, rows_cursor = asyncio.run(service.list_payment_dicts(limit=2, currency="USD"))
+    page, page_cursor = asyncio.run(service.list_payments(limit=2, currency="USD"))
+    assert [r["id"] for r in rows] == [p.id for p in page] == [p.id for p in payments[:2]]
+    assert rows_cursor == page_cursor
+
+
+# Проверяем PRAGMA, выставленные на соединении
+def test_sqlite_pragmas_applied(db_session):
+    from sqlalchemy import text
+
+    assert db_session.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+    assert db_session.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+    assert db_session.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+
+
+# Сессия из get_db закрывается, а метрика пула отражает занятые соединения
+def test_get_db_closes_session_and_reports_pool():
+    from sqlalchemy import text
+    from app.database import get_db, report_pool_status
+    from app.metrics import DB_CONNECTIONS
+
+    dependency = get_db()
+    session = next(dependency)
+    session.execute(text("SELECT 1"))
+    checked_out = engine.pool.checkedout()
+    report_pool_status(engine)
+    assert DB_CONNECTIONS._value.get() == checked_out
+
+    with pytest.raises(StopIteration):
+        next(dependency)
+
+    assert engine.pool.checkedout() == checked_out - 1
+    report_pool_status(engine)
+    assert DB_CONNECTIONS._value.get() == checked_out - 1
+
+
+def run_async(coro_factory):
+    """Запускает корутину с асинхронной сессией и освобождает пул после теста"""
+    import asyncio
+    from app.database import AsyncSessionLocal, async_engine
+
+    async def runner():
+        try:
+            async with AsyncSessionLocal() as session:
+                return await coro_factory(session)
+        finally:
+            await async_engine.dispose()
+
+    return asyncio.run(runner())
+
+
+def outbox_payment_ids():
+    import json
+    from app.schemas.outbox_schema import OutboxDB
+
+    with SessionLocal() as session:
+        return [json.loads(e.payload)["payment_id"] for e in session.query(OutboxDB).order_by(OutboxDB.id)]
+
+
+# Асинхронный репозиторий: создание, чтение и обновление статуса
+def test_async_repo_create_get_update(db_session, sample_payment):
+    from app.repositories.async_db_payment_repo import AsyncPaymentRepo
+
+    async def scenario(session):
+        repo = AsyncPaymentRepo(session)
+        await repo.create_payment(sample_payment)
+
+        retrieved = await repo.get_payment_by_id(sample_payment.id)
+        assert retrieved.id == sample_payment.id
+        assert retrieved.currency == "EUR"
+
+        retrieved.status = PaymentStatus.SUCCESS
+        await repo.update_status(retrieved)
+        assert (await repo.get_payment_by_id(sample_payment.id)).status == PaymentStatus.SUCCESS
+
+        with pytest.raises(KeyError):
+            await repo.get_payment_by_id(uuid4())
+
+    run_async(scenario)
+
+
+# Асинхронный репозиторий: страницы и потоковое чтение совпадают с синхронным
+def test_async_repo_pagination_and_stream(payment_repo):
+    from app.repositories.async_db_payment_repo import AsyncPaymentRepo
+
+    payments = _create_payments(payment_repo, 5)
+
+    async def scenario(session):
+        repo = AsyncPaymentRepo(session)
+        page = await repo.get_payments(limit=3)
+        batches = [batch async for batch in repo.iter_payments(batch_size=2)]
+        return page, batches
+
+    page, batches = run_async(scenario)
+
+    assert [p.id for p in page] == [p.id for p in payments[:3]]
+    assert [p.id for b in batches for p in b] == [p.id for p in payments]
+
+
+# Полный цикл платежа в PaymentService на обоих бэкендах
+@pytest.mark.parametrize("backend", ["sync", "async"])
+def test_payment_service_backends(db_session, backend):
+    from app.metrics import ACTIVE_PAYMENTS
+    from app.repositories.async_db_payment_repo import AsyncPaymentRepo
+    from app.services.payment_service import PaymentService
+
+    async def scenario(session):
+        repo = AsyncPaymentRepo(session) if backend == "async" else PaymentRepo()
+        service = PaymentService(repo)
+        active_before = ACTIVE_PAYMENTS._value.get()
+
+        payment = await service.create_payment(amount=42.0, currency="EUR")
+        assert ACTIVE_PAYMENTS._value.get() - active_before == 1
+        processed = await service.process_payment(payment.id, True)
+        assert processed.status == PaymentStatus.SUCCESS
+        # Повторная обработка ниже отклоняется и счетчик не трогает
+        assert ACTIVE_PAYMENTS._value.get() == active_before
+        assert outbox_payment_ids() == [str(payment.id)]
+
+        with pytest.raises(ValueError):
+            await service.process_payment(payment.id, True)
+
+        await service.request_refund(payment.id)
+        refunded = await service.complete_refund(payment.id, True)
+        assert refunded.status == PaymentStatus.REFUND_DONE
+
+        page, next_cursor = await service.list_payments(limit=10)
+        assert [p.id for p in page] == [payment.id]
+        assert next_cursor is None
+
+    run_async(scenario)
+
+
+# Атомарный переход статуса: срабатывает только из ожидаемого статуса
+def test_transition_compare_and_swap(payment_repo, sample_payment):
+    payment_repo.create_payment(sample_payment)
+
+    updated = payment_repo.transition(sample_payment.id, PaymentStatus.CREATED, PaymentStatus.SUCCESS)
+    assert updated.status == PaymentStatus.SUCCESS
+    assert updated.amount == sample_payment.amount
+
+    # Повторная обработка не проходит: статус уже не CREATED
+    assert payment_repo.transition(sample_payment.id, PaymentStatus.CREATED, PaymentStatus.FAILED) is None
+    assert payment_repo.get_payment_by_id(sample_payment.id).status == PaymentStatus.SUCCESS
+
+    with pytest.raises(KeyError):
+        payment_repo.transition(uuid4(), PaymentStatus.CREATED, PaymentStatus.SUCCESS)
+
+
+# Конкурентная обработка одного платежа: успешно проходит ровно один вызов
+def test_transition_concurrent_process(payment_repo, sample_payment):
+    from concurrent.futures import ThreadPoolExecutor
+
+    payment_repo.create_payment(sample_payment)
+
+    def process(_):
+        repo = PaymentRepo(SessionLocal())
+        try:
+            return repo.transition(sample_payment.id, PaymentStatus.CREATED, PaymentStatus.SUCCESS)
+        finally:
+            repo.db.close()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(process, range(8)))
+
+    assert sum(r is not None for r in results) == 1
+
+
+# Пакетная вставка и пакетный transition в одной транзакции
+def test_create_payments_and_transition_many(payment_repo):
+    payments = [Payment(id=uuid4(), amount=float(i), status=PaymentStatus.CREATED) for i in range(1, 4)]
+    payment_repo.create_payments(payments)
+    assert len(payment_repo.get_payments()) == 3
+
+    payment_repo.transition(payments[2].id, PaymentStatus.CREATED, PaymentStatus.FAILED)
+    missing_id = uuid4()
+    targets = {
+        payments[0].id: PaymentStatus.SUCCESS,
+        payments[1].id: PaymentStatus.FAILED,
+        payments[2].id: PaymentStatus.SUCCESS,
+        missing_id: PaymentStatus.SUCCESS,
+    }
+
+    updated, skipped = payment_repo.transition_many(targets, PaymentStatus.CREATED)
+
+    assert updated[payments[0].id].status == PaymentStatus.SUCCESS
+    assert updated[payments[1].id].status == PaymentStatus.FAILED
+    assert set(updated) == {payments[0].id, payments[1].id}
+    assert skipped == {payments[2].id}
+
+
+# Кеш платежей обновляется при каждой записи через PaymentService
+def test_payment_service_cache(db_session):
+    import asyncio
+    from app.services.payment_cache import LRUPaymentCache
+    from app.services.payment_service import PaymentService
+    from app.metrics import PAYMENT_CACHE_HITS, PAYMENT_CACHE_MISSES
+
+    async def scenario():
+        service = PaymentService(PaymentRepo(), cache=LRUPaymentCache(max_size=10, ttl=60))
+        hits, misses = PAYMENT_CACHE_HITS._value.get(), PAYMENT_CACHE_MISSES._value.get()
+
+        payment = await service.create_payment(amount=10.0)
+        assert (await service.get_payment(payment.id)).status == PaymentStatus.CREATED
+        assert PAYMENT_CACHE_HITS._value.get() == hits + 1
+
+        # Платеж изменен в обход этого сервиса (например, другим воркером): кеш еще отдает старую копию,
+        # а неудавшийся переход ее сбрасывает
+        PaymentRepo().transition(payment.id, PaymentStatus.CREATED, PaymentStatus.SUCCESS)
+        assert (await service.get_payment(payment.id)).status == PaymentStatus.CREATED
+        with pytest.raises(ValueError):
+            await service.process_payment(payment.id, False)
+        assert (await service.get_payment(payment.id)).status == PaymentStatus.SUCCESS
+        assert PAYMENT_CACHE_MISSES._value.get() == misses + 1
+
+        await service.request_refund(payment.id)
+        assert (await service.get_payment(payment.id)).status == PaymentStatus.REFUND_REQUESTED
+        assert PAYMENT_CACHE_HITS._value.get() == hits + 3
+
+        with pytest.raises(KeyError):
+            await service.get_payment(uuid4())
+
+    asyncio.run(scenario())
+
+
+# Ответ, кеш и повторное чтение из БД отдают одну сумму, округленную до минимальных единиц
+@pytest.mark.parametrize("backend", ["sync", "async"])
+def test_payment_service_rounds_amount_to_minor_units(db_session, backend):
+    from pydantic import ValidationError
+    from app.repositories.async_db_payment_repo import AsyncPaymentRepo
+    from app.services.payment_cache import LRUPaymentCache
+    from app.services.payment_service import PaymentService, CreatePaymentRequest
+
+    async def scenario(session):
+        repo = AsyncPaymentRepo(session) if backend == "async" else PaymentRepo()
+        service = PaymentService(repo, cache=LRUPaymentCache(max_size=10, ttl=60))
+
+        payment = await service.create_payment(amount=12.345, currency="USD")
+        batch = await service.create_payments([CreatePaymentRequest(amount=1.5, currency="JPY")])
+        assert (payment.amount, batch[0].amount) == (12.35, 2)
+        assert (await service.get_payment(payment.id)).amount == 12.35
+        assert PaymentRepo().get_payment_by_id(payment.id).amount == 12.35
+        assert PaymentRepo().get_payment_by_id(batch[0].id).amount == 2
+
+    run_async(scenario)
+
+    for amount in (float("inf"), float("nan"), 1e30):
+        with pytest.raises(ValidationError):
+            CreatePaymentRequest(amount=amount)
+
+
+# Пакетные операции PaymentService на обоих бэкендах
+@pytest.mark.parametrize("backend", ["sync", "async"])
+def test_payment_service_batch(db_session, backend):
+    from app.repositories.async_db_payment_repo import AsyncPaymentRepo
+    from app.services.payment_service import PaymentService, CreatePaymentRequest, ProcessPaymentItem
+
+    async def scenario(session):
+        repo = AsyncPaymentRepo(session) if backend == "async" else PaymentRepo()
+        service = PaymentService(repo)
+
+        created = await service.create_payments([CreatePaymentRequest(amount=1.0), CreatePaymentRequest(amount=2.0, currency="EUR")])
+        assert [p.amount for p in created] == [1.0, 2.0]
+
+        missing_id = uuid4()
+        results = await service.process_payments([
+            ProcessPaymentItem(id=created[0].id, success=True),
+            ProcessPaymentItem(id=created[1].id, success=False),
+            ProcessPaymentItem(id=missing_id, success=True),
+        ])
+        assert [r.ok for r in results] == [True, True, False]
+        assert results[1].payment.status == PaymentStatus.FAILED
+        assert results[2].error == "Payment not found"
+
+        assert outbox_payment_ids() == [str(created[0].id)]
+
+        again = await service.process_payments([ProcessPaymentItem(id=created[0].id, success=True)])
+        assert not again[0].ok
+
+        with pytest.raises(ValueError):
+            await service.process_payments([ProcessPaymentItem(id=missing_id, success=True)] * 2)
+
+    run_async(scenario)
+
+
+class StubRabbitMQClient:
+    def __init__(self, fail_every=None):
+        self.published = []
+        self.fail_every = fail_every
+
+    async def publish(self, messages, return_exceptions=False):
+        results = []
+        for i, message in enumerate(messages):
+            if self.fail_every and i % self.fail_every == 0:
+                results.append(ConnectionError("not confirmed"))
+            else:
+                self.published.append(message.body)
+                results.append(None)
+        return results
+
+
+# Релей outbox публикует события пачками и помечает подтвержденные как отправленные
+def test_outbox_relay_publishes_and_marks_sent(payment_repo):
+    import asyncio
+    import json
+    from app.database import AsyncSessionLocal, async_engine
+    from app.metrics import OUTBOX_DEPTH, OUTBOX_PUBLISHED
+    from app.services.outbox_relay import OutboxRelay
+    from app.services.payment_service import payment_complete_event
+
+    payments = _create_payments(payment_repo, 3)
+    for payment in payments:
+        payment_repo.transition(payment.id, PaymentStatus.CREATED, PaymentStatus.SUCCESS, outbox_event=payment_complete_event)
+
+    client = StubRabbitMQClient(fail_every=2)
+    relay = OutboxRelay(client, AsyncSessionLocal)
+    published_before = OUTBOX_PUBLISHED._value.get()
+
+    async def scenario():
+        try:
+            first = await relay.relay_once()
+            depth_after_first = OUTBOX_DEPTH._value.get()
+            client.fail_every = None
+            second = await relay.relay_once()
+            third = await relay.relay_once()
+            return first, depth_after_first, second, third
+        finally:
+            await async_engine.dispose()
+
+    first, depth_after_first, second, third = asyncio.run(scenario())
+
+    assert (first, depth_after_first, second, third) == (1, 2, 2, 0)
+    assert OUTBOX_DEPTH._value.get() == 0
+    assert OUTBOX_PUBLISHED._value.get() - published_before == 3
+    assert sorted(json.loads(b)["payment_id"] for b in client.published) == sorted(str(p.id) for p in payments)
+
+
+# Без RabbitMQ релей публикует в брокер процесса: события ждут consumer в очереди
+def test_outbox_relay_publishes_to_inprocess_bus(payment_repo):
+    import asyncio
+    import json
+    from app.clients.inprocess_client import InProcessClient
+    from app.clients.publisher import QUEUE_NAME
+    from app.database import AsyncSessionLocal, async_engine
+    from app.inprocess_bus import InProcessBus
+    from app.services.outbox_relay import OutboxRelay
+    from app.services.payment_service import payment_complete_event
+
+    payments = _create_payments(payment_repo, 3)
+    for payment in payments:
+        payment_repo.transition(payment.id, PaymentStatus.CREATED, PaymentStatus.SUCCESS, outbox_event=payment_complete_event)
+
+    bus = InProcessBus()
+    relay = OutboxRelay(InProcessClient(bus), AsyncSessionLocal)
+
+    async def scenario():
+        try:
+            published = await relay.relay_once()
+            it = bus.subscribe(QUEUE_NAME).__aiter__()
+            received = [await it.__anext__() for _ in range(published)]
+            return published, received, await relay.relay_once()
+        finally:
+            await async_engine.dispose()
+
+    published, received, republished = asyncio.run(scenario())
+
+    assert (published, republished) == (3, 0)
+    assert [json.loads(m.body)["payment_id"] for m in received] == [str(p.id) for p in payments]
+    assert [m.message_id for m in received] == [f"payment_complete:{p.id}" for p in payments]
+
+
+def test_outbox_relay_encodes_binary_events(payment_repo):
+    import asyncio
+    from app.clients.inprocess_client import InProcessClient
+    from app.clients.publisher import QUEUE_NAME
+    from app.database import AsyncSessionLocal, async_engine
+    from app.inprocess_bus import InProcessBus
+    from app.payment_events import CONTENT_TYPE_BINARY, decode_binary
+    from app.services.outbox_relay import OutboxRelay
+    from app.services.payment_service import payment_complete_event
+
+    payments = _create_payments(payment_repo, 2)
+    for payment in payments:
+        payment_repo.transition(payment.id, PaymentStatus.CREATED, PaymentStatus.SUCCESS, outbox_event=payment_complete_event)
+
+    bus = InProcessBus()
+    relay = OutboxRelay(InProcessClient(bus), AsyncSessionLocal)
+    relay.event_encoding = "binary"
+
+    async def scenario():
+        try:
+            published = await relay.relay_once()
+            it = bus.subscribe(QUEUE_NAME).__aiter__()
+            return [await it.__anext__() for _ in range(published)]
+        finally:
+            await async_engine.dispose()
+
+    received = asyncio.run(scenario())
+
+    assert [m.content_type for m in received] == [CONTENT_TYPE_BINARY] * 2
+    assert [len(m.body) for m in received] == [18, 18]
+    assert [decode_binary(m.body).payment_id for m in received] == [p.id for p in payments]
+    assert [m.message_id for m in received] == [f"payment_complete:{p.id}" for p in payments]
+
+
+# Неразборчивое событие уходит в outbox_failed, остальные события пачки публикуются
+def test_outbox_relay_quarantines_undecodable_events(payment_repo):
+    import asyncio
+    import json
+    from app.database import AsyncSessionLocal, async_engine
+    from app.metrics import OUTBOX_FAILED
+    from app.schemas.outbox_schema import OutboxDB, OutboxFailedDB
+    from app.services.outbox_relay import OutboxRelay
+    from app.services.payment_service import payment_complete_event
+
+    payments = _create_payments(payment_repo, 2)
+    payment_repo.transition(payments[0].id, PaymentStatus.CREATED, PaymentStatus.SUCCESS, outbox_event=payment_complete_event)
+    with SessionLocal() as session:
+        session.add(OutboxDB(payload="{not json"))
+        session.add(OutboxDB(payload=json.dumps({"v": 1, "type": "refund", "payment_id": str(uuid4())})))
+        session.commit()
+    payment_repo.transition(payments[1].id, PaymentStatus.CREATED, PaymentStatus.SUCCESS, outbox_event=payment_complete_event)
+
+    client = StubRabbitMQClient()
+    relay = OutboxRelay(client, AsyncSessionLocal)
+    failed_before = OUTBOX_FAILED._value.get()
+
+    async def scenario():
+        try:
+            return await relay.relay_once(), await relay.relay_once()
+        finally:
+            await async_engine.dispose()
+
+    assert asyncio.run(scenario()) == (2, 0)
+    assert sorted(json.loads(b)["payment_id"] for b in client.published) == sorted(str(p.id) for p in payments)
+    assert OUTBOX_FAILED._value.get() - failed_before == 2
+    with SessionLocal() as session:
+        quarantined = session.query(OutboxFailedDB).order_by(OutboxFailedDB.id).all()
+        assert session.query(OutboxDB).filter(OutboxDB.sent_at.is_(None)).count() == 0
+    assert [e.payload[:9] for e in quarantined] == ["{not json", '{"v": 1, ']
+    assert "JSONDecodeError" in quarantined[0].error and "refund" in quarantined[1].error
+
+
+# Неуспешный платеж не порождает событий в outbox
+def test_failed_payment_writes_no_outbox_event(payment_repo, sample_payment):
+    from app.services.payment_service import payment_complete_event
+
+    payment_repo.create_payment(sample_payment)
+    payment_repo.transition(sample_payment.id, PaymentStatus.CREATED, PaymentStatus.FAILED, outbox_event=payment_complete_event)
+
+    assert outbox_payment_ids() == []
+
+
+# При нескольких воркерах outbox публикует только релей, владеющий блокировкой
+def test_outbox_relay_leadership_is_exclusive(tmp_path):
+    from app.process_lock import ProcessLock
+    from app.services.outbox_relay import OutboxRelay
+
+    path = str(tmp_path / "outbox-relay.lock")
+    leader = OutboxRelay(StubRabbitMQClient(), leader_lock=ProcessLock(path))
+    follower = OutboxRelay(StubRabbitMQClient(), leader_lock=ProcessLock(path))
+
+    assert leader._is_leader()
+    assert not follower._is_leader()
+
+    leader.leader_lock.release()
+    assert follower._is_leader()
+    assert not leader._is_leader()
+    follower.leader_lock.release()
+
+
+# Триггер пишет каждую смену статуса в журнал, в том числе пакетную
+def test_status_changes_are_logged_and_pruned(payment_repo):
+    from datetime import timedelta
+    from sqlalchemy import select
+    from app.schemas.payment_status_log_schema import PaymentStatusLogDB
+
+    payments = _create_payments(payment_repo, 3)
+    payment_repo.transition(payments[0].id, PaymentStatus.CREATED, PaymentStatus.SUCCESS)
+    payment_repo.transition_many({p.id: PaymentStatus.FAILED for p in payments[1:]}, PaymentStatus.CREATED)
+    payment_repo.transition(payments[0].id, PaymentStatus.SUCCESS, PaymentStatus.REFUND_REQUESTED)
+
+    entries = payment_repo.db.execute(
+        select(PaymentStatusLogDB.payment_id, PaymentStatusLogDB.old_status, PaymentStatusLogDB.new_status)
+        .order_by(PaymentStatusLogDB.id)
+    ).all()
+    assert [(e.old_status, e.new_status) for e in entries] == [
+        ("CREATED", "SUCCESS"), ("CREATED", "FAILED"), ("CREATED", "FAILED"), ("SUCCESS", "REFUND_REQUESTED")
+    ]
+    assert entries[0].payment_id == payments[0].id
+
+    assert payment_repo.prune_status_log(datetime.utcnow() - timedelta(hours=1)) == 0
+    assert payment_repo.prune_status_log(datetime.utcnow() + timedelta(seconds=1)) == 4
+
+
+# Миграция старой схемы (строковые id, суммы Float): backfill пачками, затем подмена таблицы
+def test_migrations_compact_legacy_payments(tmp_path):
+    import sqlite3
+    from sqlalchemy import text
+    from sqlalchemy.orm import Session
+    from app.database import create_db_engine
+    from app.migrations import migrate, LATEST_VERSION
+
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE payments (
+            id VARCHAR NOT NULL PRIMARY KEY, amount FLOAT NOT NULL, currency VARCHAR NOT NULL,
+            status VARCHAR(16) NOT NULL, created_at DATETIME
+        );
+        CREATE INDEX ix_payments_id ON payments (id);
+        CREATE INDEX ix_payments_created_at_id ON payments (created_at, id);
+    """)
+    rows = [
+        (str(uuid4()), amount, currency, "CREATED", f"2024-01-01 12:00:0{i}.000000")
+        for i, (amount, currency) in enumerate([(19.99, "USD"), (0.29, "EUR"), (1500.0, "JPY"), (1.005, "KWD"), (5.0, "USD")])
+    ]
+    conn.executemany("INSERT INTO payments VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+
+    engine = create_db_engine(f"sqlite:///{path}")
+    assert migrate(engine, batch_size=2, backfill_only=True) == []
+    # Изменения, сделанные прежней версией сервиса после backfill, переносятся при подмене
+    conn.execute("UPDATE payments SET status = 'SUCCESS' WHERE id = ?", (rows[0][0],))
+    conn.execute("INSERT INTO payments VALUES (?, 7.5, 'USD', 'CREATED', '2024-01-01 12:00:09.000000')", (str(uuid4()),))
+    conn.commit()
+    assert migrate(engine, batch_size=2) == [1, 2]
+    assert migrate(engine) == []
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == LATEST_VERSION
+    assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'payments_compact'").fetchone()
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'payments'")}
+    assert {"ix_payments_status_created_at", "ix_payments_currency_created_at", "ix_payments_created_at_id"} <= indexes
+    assert conn.execute("SELECT typeof(id), length(id), typeof(amount_minor) FROM payments LIMIT 1").fetchone() == \
+        ("blob", 16, "integer")
+    conn.close()
+
+    with Session(engine) as session:
+        repo = PaymentRepo(session)
+        payments = repo.get_payments()
+        assert [(str(p.id), p.amount, p.currency) for p in payments[:5]] == [r[:3] for r in rows]
+        assert [p.status for p in payments] == [PaymentStatus.SUCCESS] + [PaymentStatus.CREATED] * 5
+        assert repo.transition(payments[1].id, PaymentStatus.CREATED, PaymentStatus.FAILED) is not None
+        assert session.execute(text("SELECT count(*) FROM payment_status_log")).scalar() == 1
+    engine.dispose()
+
+
+# Ключи идемпотентности: дубликат ждет первый запрос, ошибка освобождает ключ, брошенный ключ перехватывается
+def test_idempotency_store(db_session):
+    import asyncio
+    from datetime import timedelta
+    from app.database import async_engine
+    from app.repositories.idempotency_repo import IdempotencyRepo
+    from app.services.idempotency import (
+        IdempotencyStore, IdempotencyKeyReused, IdempotencyInProgress, StoredResponse,
+    )
+
+    async def scenario():
+        store = IdempotencyStore()
+        assert await store.begin("create-1", "fp") is None
+
+        async def finish_first():
+            await asyncio.sleep(0.05)
+            await store.complete("create-1", StoredResponse(200, '{"id":1}'))
+
+        duplicate, _ = await asyncio.gather(store.begin("create-1", "fp"), finish_first())
+        assert duplicate == StoredResponse(200, '{"id":1}')
+        with pytest.raises(IdempotencyKeyReused):
+            await store.begin("create-1", "other")
+
+        assert await store.begin("create-2", "fp") is None
+        await store.release("create-2")
+        assert await store.begin("create-2", "fp") is None
+
+        # Другой воркер: ждет по опросу БД и перехватывает ключ после lock_timeout
+        other = IdempotencyStore()
+        other.wait_timeout = 0.1
+        with pytest.raises(IdempotencyInProgress):
+            await other.begin("create-2", "fp")
+        other.lock_timeout = timedelta(0)
+        assert await other.begin("create-2", "fp") is None
+
+        assert await store.prune() == 0
+        # Фоновая очистка ключей старше TTL идет в самом хранилище, а не в outbox-релее
+        store.ttl = timedelta(seconds=-1)
+        await store.start()
+        for _ in range(100):
+            async with store.session_factory() as db:
+                if await IdempotencyRepo(db).get("create-1") is None:
+                    break
+            await asyncio.sleep(0.01)
+        await store.stop()
+        async with store.session_factory() as db:
+            assert [await IdempotencyRepo(db).get(key) for key in ("create-1", "create-2")] == [None, None]
+        await async_engine.dispose()
+
+    asyncio.run(scenario())
+
+
+# Владелец продлевает захват ключа, пока выполняется: долгий запрос не перехватывается как брошенный
+def test_idempotency_lock_is_refreshed_while_running(db_session):
+    import asyncio
+    from datetime import timedelta
+    from app.database import async_engine
+    from app.services.idempotency import IdempotencyStore, IdempotencyInProgress, StoredResponse
+
+    async def scenario():
+        owner = IdempotencyStore()
+        owner.lock_timeout = timedelta(seconds=0.3)
+        assert await owner.begin("slow", "fp") is None
+
+        other = IdempotencyStore()
+        other.lock_timeout = owner.lock_timeout
+        other.wait_timeout = 0.05
+        await asyncio.sleep(0.6)  # дольше lock_timeout
+        with pytest.raises(IdempotencyInProgress):
+            await other.begin("slow", "fp")
+
+        await owner.complete("slow", StoredResponse(200, "{}"))
+        assert owner._heartbeats == {}
+        assert await other.begin("slow", "fp") == StoredResponse(200, "{}")
+        await async_engine.dispose()
+
+    asyncio.run(scenario())
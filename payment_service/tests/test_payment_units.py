@@ -35,4 +35,174 @@ def test_payment_model_defaults():
     )
 
     assert payment.currency == "USD"
-    assert payment.amount == 50.0
\ No newline at end of file
+    assert payment.amount == 50.0
+
+def make_recording_client(fail=False):
+    """RabbitMQClient без брокера: запоминает отправленные пачки"""
+    from app.clients.rabbitmq_client import RabbitMQClient
+
+    class RecordingClient(RabbitMQClient):
+        async def _send_batch(self, messages):
+            self.batches.append(messages)
+            if fail:
+                raise ConnectionError("broker is down")
+            return [None] * len(messages)
+
+    client = RecordingClient()
+    client.batches = []
+    return client
+
+
+def test_minor_units_follow_currency_exponent():
+    from app.models.money import to_minor_units, from_minor_units
+
+    assert to_minor_units(19.99, "USD") == 1999
+    assert to_minor_units(0.285, "EUR") == 29
+    assert to_minor_units(1500, "JPY") == 1500
+    assert to_minor_units(1.0005, "KWD") == 1001
+    assert from_minor_units(1999, "USD") == 19.99
+    assert from_minor_units(1500, "JPY") == 1500.0
+
+
+def test_rabbitmq_client_batches_concurrent_publishes():
+    import asyncio
+    import json
+
+    async def scenario():
+        client = make_recording_client()
+        await client.start()
+        ids = [uuid4() for _ in range(5)]
+        await asyncio.gather(*(client.send_payment_notification(payment_id) for payment_id in ids))
+        await client.close()
+        return client.batches, ids
+
+    batches, ids = asyncio.run(scenario())
+
+    assert len(batches) == 1
+    assert [json.loads(m.body)["payment_id"] for m in batches[0]] == [str(i) for i in ids]
+
+
+def test_rabbitmq_client_respects_batch_size_and_swallows_errors():
+    import asyncio
+
+    async def scenario():
+        client = make_recording_client(fail=True)
+        client._max_batch_size = 2
+        await client.send_payment_notifications([uuid4() for _ in range(5)])
+        await client.close()
+        return client.batches
+
+    batches = asyncio.run(scenario())
+
+    assert [len(b) for b in batches] == [2, 2, 1]
+
+
+def test_lru_payment_cache_limits_size_and_ttl():
+    import asyncio
+    from app.models.payment import Payment, PaymentStatus
+    from app.services.payment_cache import LRUPaymentCache
+    from app.metrics import PAYMENT_CACHE_EVICTIONS
+
+    async def scenario():
+        cache = LRUPaymentCache(max_size=2, ttl=60)
+        first, second, third = (Payment(id=uuid4(), amount=1.0) for _ in range(3))
+        evicted = PAYMENT_CACHE_EVICTIONS.labels(reason="size")._value.get()
+
+        await cache.set(first)
+        await cache.set(second)
+        assert await cache.get(first.id) is first  # first становится самым свежим
+        await cache.set(third)
+        assert await cache.get(second.id) is None
+        assert PAYMENT_CACHE_EVICTIONS.labels(reason="size")._value.get() == evicted + 1
+
+        # add не перетирает запись, сделанную после изменения платежа
+        stale = first.model_copy(update={"status": PaymentStatus.SUCCESS})
+        await cache.add(stale)
+        assert await cache.get(first.id) is first
+
+        cache.ttl = 0
+        await cache.set(first)
+        assert await cache.get(first.id) is None
+        assert len(cache) == 1
+
+    asyncio.run(scenario())
+
+
+def asgi_request(app, method, path, body=b""):
+    """Прямой вызов ASGI-приложения без HTTP-клиента; возвращает статус ответа"""
+    import asyncio
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"content-length", str(len(body)).encode())], "client": ("test", 1), "server": ("test", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return next(m["status"] for m in sent if m["type"] == "http.response.start")
+
+
+def test_prometheus_middleware_labels_by_route_template():
+    """HTTP metrics use the route template, so path parameters do not create new series"""
+    from fastapi import FastAPI
+    from app.metrics import REGISTRY
+    from app.instrumentation import PrometheusMiddleware, UNMATCHED_ROUTE
+
+    app = FastAPI()
+    app.add_middleware(PrometheusMiddleware)
+
+    @app.post("/test-items/{item_id}/process")
+    async def process(item_id: str):
+        return {"id": item_id}
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    template = "/test-items/{item_id}/process"
+    count_before = sample("http_requests_total", method="POST", endpoint=template, status="200")
+    size_before = sample("http_request_size_bytes_sum", method="POST", endpoint=template)
+    unmatched_before = sample("http_requests_total", method="GET", endpoint=UNMATCHED_ROUTE, status="404")
+
+    for _ in range(3):
+        assert asgi_request(app, "POST", f"/test-items/{uuid4()}/process", b"12345") == 200
+    assert asgi_request(app, "GET", f"/missing/{uuid4()}") == 404
+
+    assert sample("http_requests_total", method="POST", endpoint=template, status="200") == count_before + 3
+    assert sample("http_request_size_bytes_sum", method="POST", endpoint=template) == size_before + 15
+    assert sample("http_response_size_bytes_count", method="POST", endpoint=template) >= 3
+    assert sample("http_requests_total", method="GET", endpoint=UNMATCHED_ROUTE, status="404") == unmatched_before + 1
+    assert sample("http_requests_in_progress", method="POST") == 0
+
+
+def test_metrics_snapshot_caches_and_negotiates_format():
+    """Exposition is rebuilt at most once per interval, per format and encoding"""
+    import gzip
+    from prometheus_client import CollectorRegistry, Counter
+    from prometheus_client.openmetrics.exposition import CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE
+    from app.instrumentation import MetricsSnapshot
+
+    registry = CollectorRegistry()
+    counter = Counter("snapshot_test_total", "Test counter", registry=registry)
+    snapshot = MetricsSnapshot(registry, interval=60)
+
+    body, content_type, compressed = snapshot.render()
+    assert b"snapshot_test_total 0.0" in body
+    assert content_type.startswith("text/plain") and not compressed
+
+    counter.inc()
+    assert snapshot.render()[0] == body
+
+    body, content_type, compressed = snapshot.render("application/openmetrics-text", "gzip, deflate")
+    assert content_type == OPENMETRICS_CONTENT_TYPE and compressed
+    assert b"snapshot_test_total 1.0" in gzip.decompress(body)
+
+    snapshot.interval = 0
+    assert b"snapshot_test_total 1.0" in snapshot.render()[0]
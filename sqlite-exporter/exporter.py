@@ -1,94 +1,380 @@
 #!/usr/bin/env python3
 """
 SQLite Exporter для Prometheus
+
+Метрики собираются в фоне по расписанию через постоянное read-only соединение,
+а HTTP-сервер отдает последний готовый снимок — scrape не трогает базу.
 """
 import os
 import sqlite3
+import threading
 import time
-from http.server import HTTPServer
-from prometheus_client import Gauge, generate_latest, CONTENT_TYPE_LATEST
+from collections import defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from prometheus_client import Counter, Gauge, generate_latest, CONTENT_TYPE_LATEST
 
 # Получаем путь к базе данных из переменной окружения
 SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH', '/app/payments.db')
+EXPORTER_PORT = int(os.getenv('EXPORTER_PORT', '8082'))
+# Период сбора дешевых метрик и более редкого обхода страниц через dbstat
+COLLECT_INTERVAL = float(os.getenv('COLLECT_INTERVAL_SECONDS', '15'))
+TABLE_SIZE_INTERVAL = float(os.getenv('TABLE_SIZE_INTERVAL_SECONDS', '300'))
 
 # Создаем метрики Prometheus
 DB_SIZE = Gauge('sqlite_db_size_bytes', 'Size of SQLite database file in bytes')
+WAL_SIZE = Gauge('sqlite_wal_size_bytes', 'Size of SQLite write-ahead log file in bytes')
+PAGE_COUNT = Gauge('sqlite_page_count', 'Number of pages in the database')
+PAGE_SIZE = Gauge('sqlite_page_size_bytes', 'Database page size in bytes')
+FREELIST_COUNT = Gauge('sqlite_freelist_pages', 'Number of unused pages in the database')
 TABLE_COUNT = Gauge('sqlite_table_count', 'Number of tables in the database')
-ROW_COUNT = Gauge('sqlite_table_rows', 'Number of rows in table', ['table'])
-TABLE_SIZE = Gauge('sqlite_table_size_kb', 'Estimated table size in KB', ['table'])
+ROW_COUNT = Gauge('sqlite_table_rows', 'Estimated number of rows in table', ['table'])
+TABLE_SIZE = Gauge('sqlite_table_size_kb', 'Table size in KB from dbstat', ['table'])
+INDEX_SIZE = Gauge('sqlite_index_size_kb', 'Index size in KB from dbstat', ['table', 'index'])
 
+# Бизнес-метрики платежей
+PAYMENTS_COUNT = Gauge('payments_by_status', 'Number of payments by status and currency', ['status', 'currency'])
+PAYMENTS_AMOUNT = Gauge('payments_amount_by_status', 'Total payment amount by status and currency', ['status', 'currency'])
+STATUS_TRANSITIONS = Counter(
+    'payment_status_transitions_total', 'Payment status changes seen by the exporter', ['from_status', 'to_status']
+)
+REFUND_RATIO = Gauge('payments_refund_ratio', 'Share of paid payments with a refund requested')
+OLDEST_CREATED_AGE = Gauge('payments_oldest_created_age_seconds', 'Age of the oldest payment still in CREATED status')
 
-def collect_metrics():
-    """Сбор метрик из SQLite базы данных"""
-    try:
-        # Размер файла базы данных
-        if os.path.exists(SQLITE_DB_PATH):
-            DB_SIZE.set(os.path.getsize(SQLITE_DB_PATH))
-        else:
+COLLECT_DURATION = Gauge('sqlite_exporter_collect_duration_seconds', 'Duration of the last collection')
+LAST_COLLECT = Gauge('sqlite_exporter_last_collect_timestamp_seconds', 'Time of the last successful collection')
+COLLECT_ERRORS = Counter('sqlite_exporter_collect_errors_total', 'Number of failed collections')
+
+
+class SQLiteCollector:
+    """Периодический сбор метрик через одно read-only соединение"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn: sqlite3.Connection | None = None
+        self._inode = None
+        self._dbstat_available = True
+        self._last_table_sizes = 0.0
+        self._known_tables: set[str] = set()
+        self._known_indexes: set[tuple[str, str]] = set()
+        self.payments = PaymentAggregates()
+
+    def connect(self) -> sqlite3.Connection:
+        """Переоткрывает соединение, если файл базы был заменен"""
+        inode = os.stat(self.db_path).st_ino
+        if self.conn is None or inode != self._inode:
+            self.close()
+            self.conn = sqlite3.connect(
+                f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False, isolation_level=None
+            )
+            self._inode = inode
+            self.payments.reset()  # другой файл — другие данные
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def collect(self):
+        """Сбор метрик из SQLite базы данных"""
+        if not os.path.exists(self.db_path):
             DB_SIZE.set(0)
-            print(f"Database file not found: {SQLITE_DB_PATH}")
+            print(f"Database file not found: {self.db_path}")
             return
 
-        # Подключаемся к базе данных
-        conn = sqlite3.connect(SQLITE_DB_PATH)
-        cursor = conn.cursor()
+        # Размер файла базы данных и WAL
+        DB_SIZE.set(os.path.getsize(self.db_path))
+        wal_path = self.db_path + '-wal'
+        WAL_SIZE.set(os.path.getsize(wal_path) if os.path.exists(wal_path) else 0)
 
-        # Количество таблиц
-        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
-        TABLE_COUNT.set(cursor.fetchone()[0])
+        try:
+            conn = self.connect()
+            PAGE_COUNT.set(conn.execute("PRAGMA page_count").fetchone()[0])
+            PAGE_SIZE.set(conn.execute("PRAGMA page_size").fetchone()[0])
+            FREELIST_COUNT.set(conn.execute("PRAGMA freelist_count").fetchone()[0])
 
-        # Информация о таблицах
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
-        tables = cursor.fetchall()
+            tables = [
+                name for (name,) in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+                )
+            ]
+            TABLE_COUNT.set(len(tables))
+            stat_rows = self._stat1_rows(conn)
+            for table_name in tables:
+                ROW_COUNT.labels(table=table_name).set(self._estimate_rows(conn, table_name, stat_rows))
+            for table_name in self._known_tables - set(tables):
+                ROW_COUNT.remove(table_name)
+            self._known_tables = set(tables)
 
-        for (table_name,) in tables:
-            # Количество строк в таблице
-            try:
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                row_count = cursor.fetchone()[0]
-                ROW_COUNT.labels(table=table_name).set(row_count)
+            if 'payments' in tables:
+                self.payments.update(conn)
 
-                # Примерный размер таблицы (очень грубая оценка)
-                cursor.execute(f"PRAGMA table_info({table_name})")
-                columns = cursor.fetchall()
-                estimated_size = row_count * len(columns) * 100  # ~100 байт на запись
-                TABLE_SIZE.labels(table=table_name).set(estimated_size / 1024)  # в KB
-            except Exception as e:
-                print(f"Error processing table {table_name}: {e}")
+            if time.monotonic() - self._last_table_sizes >= TABLE_SIZE_INTERVAL:
+                self._collect_table_sizes(conn)
+                self._last_table_sizes = time.monotonic()
+        except sqlite3.Error:
+            self.close()  # переподключимся на следующем цикле
+            raise
 
-        conn.close()
+    @staticmethod
+    def _stat1_rows(conn: sqlite3.Connection) -> dict[str, int]:
+        """Число строк по статистике ANALYZE: первое число в sqlite_stat1.stat.
 
-    except Exception as e:
-        print(f"Error collecting metrics: {e}")
+        У частичного индекса это число строк индекса, поэтому берем максимум по таблице.
+        """
+        try:
+            rows = conn.execute("SELECT tbl, stat FROM sqlite_stat1").fetchall()
+        except sqlite3.OperationalError:
+            return {}  # ANALYZE не выполнялся
+        result: dict[str, int] = {}
+        for table, stat in rows:
+            if stat:
+                result[table] = max(result.get(table, 0), int(stat.split()[0]))
+        return result
 
+    @staticmethod
+    def _estimate_rows(conn: sqlite3.Connection, table_name: str, stat_rows: dict[str, int]) -> int:
+        """Оценка без полного сканирования.
 
-class MetricsHandler:
-    def do_GET(self):
-        collect_metrics()
+        Для rowid-таблиц — размах rowid (два поиска по B-дереву); он точен, пока строки
+        не удаляются из середины, и учитывает удаление старых строк (outbox).
+        Иначе — статистика sqlite_stat1.
+        """
+        try:
+            low, high = conn.execute(f'SELECT min(rowid), max(rowid) FROM "{table_name}"').fetchone()
+            return high - low + 1 if high is not None else 0
+        except sqlite3.OperationalError:
+            return stat_rows.get(table_name, 0)  # WITHOUT ROWID
 
-        self.send_response(200)
-        self.send_header('Content-Type', CONTENT_TYPE_LATEST)
-        self.end_headers()
+    def _collect_table_sizes(self, conn: sqlite3.Connection):
+        """Реальный размер таблиц и индексов по страницам (dbstat обходит все B-деревья)"""
+        if not self._dbstat_available:
+            return
+        try:
+            sizes = conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"dbstat is not available, table sizes disabled: {e}")
+            self._dbstat_available = False
+            return
+        owners = dict(conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type IN ('table', 'index')"))
+        indexes = set()
+        for name, size in sizes:
+            table_name = owners.get(name)
+            if table_name is None or name.startswith('sqlite_'):
+                continue
+            if name == table_name:
+                TABLE_SIZE.labels(table=name).set(size / 1024)
+            else:
+                INDEX_SIZE.labels(table=table_name, index=name).set(size / 1024)
+                indexes.add((table_name, name))
+        for table_name, index_name in self._known_indexes - indexes:
+            INDEX_SIZE.remove(table_name, index_name)
+        self._known_indexes = indexes
 
-        self.wfile.write(generate_latest())
 
+REFUND_STATUSES = ('REFUND_REQUESTED', 'REFUND_DONE', 'REFUND_DENIED')
+SCAN_BATCH_SIZE = 10000
+
+# Суммы хранятся в минимальных единицах валюты; знаки дробной части — как в
+# payment_service (app/models/money.py), по умолчанию 2
+CURRENCY_EXPONENTS = {
+    "BIF": 0, "CLP": 0, "DJF": 0, "GNF": 0, "ISK": 0, "JPY": 0, "KMF": 0, "KRW": 0, "PYG": 0,
+    "RWF": 0, "UGX": 0, "UYI": 0, "VND": 0, "VUV": 0, "XAF": 0, "XOF": 0, "XPF": 0,
+    "BHD": 3, "IQD": 3, "JOD": 3, "KWD": 3, "LYD": 3, "OMR": 3, "TND": 3,
+}
+
+
+class PaymentAggregates:
+    """Агрегаты по платежам, поддерживаемые инкрементально.
+
+    Новые платежи читаются по отметке rowid, смены статуса — по отметке в журнале
+    payment_status_log (его заполняет триггер payment_service). Оба чтения идут в одной
+    транзакции: платеж новее отметки уже учтен с текущим статусом, поэтому его записи
+    журнала пропускаются. Полный проход по payments нужен только при первом запуске
+    или если журнал очищен дальше отметки, а также после миграции схемы (PRAGMA user_version).
+    """
+
+    def __init__(self):
+        self.schema_version: int | None = None
+        self.amount_column = 'amount_minor'
+        self.reset()
+
+    def reset(self):
+        self.counts: dict[tuple[str, str], int] = defaultdict(int)
+        self.amounts: dict[tuple[str, str], float] = defaultdict(float)
+        self.payments_rowid = 0
+        self.log_id: int | None = None
+
+    def update(self, conn: sqlite3.Connection):
+        conn.execute("BEGIN")
+        try:
+            self._check_schema(conn)
+            has_log = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='payment_status_log'"
+            ).fetchone() is not None
+            if not has_log:
+                self.reset()  # без журнала изменения статусов не отследить — только пересчет
+            elif self.log_id is not None and not self._log_is_contiguous(conn):
+                print("Payment status log was pruned past the exporter mark, recounting")
+                self.reset()
+
+            scanned_rowid = self.payments_rowid
+            if has_log:
+                self._apply_status_changes(conn, scanned_rowid)
+            self._scan_new_payments(conn)
+            oldest = conn.execute(
+                "SELECT min(created_at) FROM payments WHERE status = 'CREATED'"
+            ).fetchone()[0]
+        except Exception:
+            self.reset()  # агрегаты могли обновиться частично
+            raise
+        finally:
+            conn.execute("ROLLBACK")
+
+        self._export(oldest)
+
+    def _check_schema(self, conn: sqlite3.Connection):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == self.schema_version:
+            return
+        if self.schema_version is not None:
+            print(f"Payments schema changed to version {version}, recounting")
+        self.reset()
+        self.schema_version = version
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(payments)")}
+        # До миграции на минимальные единицы сумма хранилась в amount (Float)
+        self.amount_column = 'amount_minor' if 'amount_minor' in columns else 'amount'
+
+    def _log_is_contiguous(self, conn: sqlite3.Connection) -> bool:
+        first = conn.execute("SELECT min(id) FROM payment_status_log").fetchone()[0]
+        if first is not None:
+            return first <= self.log_id + 1
+        # Журнал пуст: AUTOINCREMENT хранит последний выданный id в sqlite_sequence —
+        # если он дальше отметки, записи после нее были и уже очищены
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'payment_status_log'").fetchone()
+        return row is None or row[0] <= self.log_id
+
+    def _apply_status_changes(self, conn: sqlite3.Connection, scanned_rowid: int):
+        if self.log_id is None:
+            # Первый запуск: прошлые смены уже отражены в текущих статусах
+            self.log_id = conn.execute("SELECT coalesce(max(id), 0) FROM payment_status_log").fetchone()[0]
+            return
+        rows = conn.execute(
+            f"SELECT id, payment_rowid, currency, {self.amount_column}, old_status, new_status "
+            "FROM payment_status_log WHERE id > ? ORDER BY id",
+            (self.log_id,)
+        )
+        for log_id, payment_rowid, currency, amount, old_status, new_status in rows:
+            self.log_id = log_id
+            STATUS_TRANSITIONS.labels(from_status=old_status.lower(), to_status=new_status.lower()).inc()
+            if payment_rowid > scanned_rowid:
+                continue  # платеж еще не учтен, будет прочитан с текущим статусом
+            self.counts[(old_status, currency)] -= 1
+            self.amounts[(old_status, currency)] -= amount
+            self.counts[(new_status, currency)] += 1
+            self.amounts[(new_status, currency)] += amount
+
+    def _scan_new_payments(self, conn: sqlite3.Connection):
+        while True:
+            rows = conn.execute(
+                f"SELECT rowid, status, currency, {self.amount_column} FROM payments "
+                "WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (self.payments_rowid, SCAN_BATCH_SIZE)
+            ).fetchall()
+            for rowid, status, currency, amount in rows:
+                self.counts[(status, currency)] += 1
+                self.amounts[(status, currency)] += amount
+            if len(rows) < SCAN_BATCH_SIZE:
+                if rows:
+                    self.payments_rowid = rows[-1][0]
+                return
+            self.payments_rowid = rows[-1][0]
+
+    def _major_units(self, status: str, currency: str) -> float:
+        amount = self.amounts[(status, currency)]
+        if self.amount_column == 'amount_minor':
+            return amount / 10 ** CURRENCY_EXPONENTS.get(currency, 2)
+        return amount
+
+    def _export(self, oldest_created: str | None):
+        PAYMENTS_COUNT.clear()
+        PAYMENTS_AMOUNT.clear()
+        for (status, currency), count in self.counts.items():
+            PAYMENTS_COUNT.labels(status=status.lower(), currency=currency).set(count)
+            PAYMENTS_AMOUNT.labels(status=status.lower(), currency=currency).set(self._major_units(status, currency))
+
+        refunds = sum(count for (status, _), count in self.counts.items() if status in REFUND_STATUSES)
+        paid = refunds + sum(count for (status, _), count in self.counts.items() if status == 'SUCCESS')
+        REFUND_RATIO.set(refunds / paid if paid else 0)
+
+        if oldest_created is None:
+            OLDEST_CREATED_AGE.set(0)
+        else:
+            OLDEST_CREATED_AGE.set((datetime.utcnow() - datetime.fromisoformat(oldest_created)).total_seconds())
 
-if __name__ == '__main__':
-    print(f"Starting SQLite Exporter on port 8082 for database: {SQLITE_DB_PATH}")
 
-    # Создаем простой HTTP сервер
-    from http.server import BaseHTTPRequestHandler
-    import socketserver
+class MetricsSnapshot:
+    """Последняя экспозиция метрик, которую отдает HTTP-сервер"""
 
+    def __init__(self):
+        self._body = generate_latest()
+        self._lock = threading.Lock()
 
-    class Handler(BaseHTTPRequestHandler, MetricsHandler):
-        pass
+    def update(self):
+        body = generate_latest()
+        with self._lock:
+            self._body = body
+
+    def get(self) -> bytes:
+        with self._lock:
+            return self._body
+
+
+def collect_loop(collector: SQLiteCollector, snapshot: MetricsSnapshot, stop: threading.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            collector.collect()
+            LAST_COLLECT.set(time.time())
+        except Exception as e:
+            COLLECT_ERRORS.inc()
+            print(f"Error collecting metrics: {e}")
+        COLLECT_DURATION.set(time.perf_counter() - start)
+        snapshot.update()
+        stop.wait(COLLECT_INTERVAL)
+
+
+def make_handler(snapshot: MetricsSnapshot):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = snapshot.get()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE_LATEST)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # не пишем строку лога на каждый scrape
+
+    return Handler
+
+
+if __name__ == '__main__':
+    print(f"Starting SQLite Exporter on port {EXPORTER_PORT} for database: {SQLITE_DB_PATH}")
 
+    collector = SQLiteCollector(SQLITE_DB_PATH)
+    snapshot = MetricsSnapshot()
+    stop = threading.Event()
+    threading.Thread(target=collect_loop, args=(collector, snapshot, stop), daemon=True).start()
 
-    server = HTTPServer(('0.0.0.0', 8082), Handler)
+    server = ThreadingHTTPServer(('0.0.0.0', EXPORTER_PORT), make_handler(snapshot))
 
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\nShutting down SQLite Exporter")
-        server.server_close()
\ No newline at end of file
+        stop.set()
+        server.server_close()
+        collector.close()